@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
+import os
 import re
 import sys
 from argparse import Namespace
@@ -73,6 +74,16 @@ class CorpusConverterNewspaper:  # Mimic CorpusConverter
         _ = url, article_raw_html, scheme  # Silence dummy IDE
         return set()
 
+    def checkpoint_state(self):
+        self._file_out.flush()
+        os.fsync(self._file_out.fileno())
+        return {'offset': self._file_out.tell()}
+
+    def resume_from_checkpoint(self, state):
+        if state is not None:  # The articles converted after the checkpoint are converted again
+            self._file_out.truncate(state['offset'])
+            self._file_out.seek(state['offset'])
+
     def __del__(self):
         if hasattr(self, '_file_out') and self._file_out is not None:
             self._file_out.close()
@@ -115,3 +126,11 @@ class MultiPageArticleConverter:  # No output corpus
         if ret is not None:
             return {ret}
         return set()
+
+    @staticmethod
+    def checkpoint_state():
+        return None
+
+    @staticmethod
+    def resume_from_checkpoint(state):
+        _ = state  # Silence dummy IDE
@@ -8,8 +8,12 @@ from mplogger import Logger
 
 from .version import  __version__
 from .utils import wrap_input_constants
+from .checkpoint import CrawlCheckpoint
+from .pagination_stats import PaginationStats
+from .url_store import UrlStateStore
 from .news_crawler import NewsArchiveCrawler, NewsArticleCrawler
-from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, archive_page_contains_article_url
+from .other_modes import validate_warc_file, online_test, sample_warc_by_urls, archive_page_contains_article_url, \
+    index_warc_files
 
 
 def str2bool(v):
@@ -48,29 +52,104 @@ def parse_args_crawl(parser):
                                                    ' and print the number of extracted URLs per page')
     parser.add_argument('--strict', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Set strict-mode in WARCReader to enable validation')
+    parser.add_argument('--compact-index', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Use memory efficient (array-backed) URL index in WARCReader for large WARC files')
+    parser.add_argument('--use-mmap', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Memory-map the cache WARC files and read the cached pages directly from memory')
+    parser.add_argument('--index-jobs', type=int, default=1, metavar='PROCESSES',
+                        help='Create the URL index of the WARC files (without an index file) in this many processes'
+                             ' in parallel (default 1, 0: the number of CPUs)')
     parser.add_argument('--crawler-name', type=str, help='The name of the crawler for the WARC info record',
                         default='WebArticleCurator {0}'.format(__version__))
     parser.add_argument('--user-agent', type=str, help='The User-Agent string to use in headers while downloading')
     parser.add_argument('--no-overwrite-warc', help='Do not overwrite --{archive,articles}-warc if needed',
                         action='store_false')
+    parser.add_argument('--max-warc-size', type=int, default=None, metavar='BYTES',
+                        help='Rotate --{archive,articles}-warc to numbered segments (name-00000.warc.gz, ...)'
+                             ' of about this size')
+    parser.add_argument('--max-warc-records', type=int, default=None,
+                        help='Rotate --{archive,articles}-warc to numbered segments of this many records')
+    parser.add_argument('--max-warc-age', type=float, default=None, metavar='SECONDS',
+                        help='Rotate --{archive,articles}-warc to numbered segments after this many seconds')
     parser.add_argument('--cumulative-error-threshold', type=int, help='Sum of download errors before giving up',
                         default=15)
     parser.add_argument('--known-bad-urls', type=str, help='Known bad URLs to be excluded from download (filename, '
                                                            'one URL per line)', default=None)
     parser.add_argument('--known-article-urls', type=str, help='Known article URLs to mark the desired end of '
                                                                'the archive (filename, one URL per line)', default=None)
-    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period',
-                        default=2)
-    parser.add_argument('--limit-period', type=int, help='Limit (seconds) the period the number of HTTP request'
-                                                         ' see also --max-no-of-calls-in-period',
+    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period'
+                                                                      ' per host', default=2)
+    parser.add_argument('--limit-period', type=float, help='Limit (seconds) the period the number of HTTP request'
+                                                           ' per host see also --max-no-of-calls-in-period',
                         default=1)
+    parser.add_argument('--burst', type=int, default=None,
+                        help='Allow this many HTTP requests at once per host (default: --max-no-of-calls-in-period)')
+    parser.add_argument('--rate-limit-state', type=str, default=None, metavar='FILE',
+                        help='Share the rate limits per host with the other processes using the same state file'
+                             ' (SQLite database on a local filesystem)')
+    parser.add_argument('--honor-retry-after', type=str2bool, nargs='?', const=True, default=True,
+                        metavar='True/False', help='Wait and retry as the server asks with Retry-After'
+                                                   ' on HTTP 429 and 503 (default True)')
+    parser.add_argument('--honor-crawl-delay', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Download robots.txt of the hosts and obey their Crawl-delay'
+                                                   ' (default False)')
+    parser.add_argument('--http-compression', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Request gzip/deflate (and br with the brotli extra) compressed'
+                                                   ' transfer and store the compressed bytes in the WARC file'
+                                                   ' (default False)')
     parser.add_argument('--proxy-url', type=str, help='SOCKS Proxy URL to use eg. socks5h://localhost:9050',
                         default=None)
     parser.add_argument('--allow-cookies', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Allow session cookies')
+    parser.add_argument('--download-workers', type=int, default=1,
+                        help='Download this many URLs concurrently on a thread pool (default 1, the records are still'
+                             ' written in order and --max-no-of-calls-in-period is obeyed)')
+    parser.add_argument('--download-engine', type=str, choices={'requests', 'async'}, default='requests',
+                        help='Download the pages one by one (requests, default) or concurrently with asyncio '
+                             '(async, requires aiohttp)')
+    parser.add_argument('--max-concurrency-per-host', type=int, default=2,
+                        help='Limit the number of HTTP requests in flight per host (only with --download-engine async)')
+    parser.add_argument('--archive-workers', type=int, default=1,
+                        help='Crawl the pagination of this many archive page URLs (days or columns) at once'
+                             ' (default 1, the article URLs are generated in the same order, see also'
+                             ' --download-workers and --download-engine)')
+    parser.add_argument('--archive-prefetch', type=int, default=0, metavar='PAGES',
+                        help='Download this many archive pages ahead speculatively when the pages are numbered'
+                             ' (infinite scrolling or max_pagenum, default 0: disabled, it needs --download-workers'
+                             ' > 1 or --download-engine async to download the pages concurrently)')
+    parser.add_argument('--probe-archive-end', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Search for the last archive page with new articles (not in'
+                                                   ' --known-article-urls) by galloping and binary search'
+                                                   ' and crawl only the pages before it (only with infinite'
+                                                   ' scrolling, default False)')
+    parser.add_argument('--pagination-stats', type=str, default=None, metavar='FILE',
+                        help='Record the pages of the archive page URLs per column in this SQLite database'
+                             ' (see the stats command)')
+    parser.add_argument('--adaptive-pagination', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Use the --pagination-stats of the previous crawls to limit'
+                                                   ' --archive-prefetch to the predicted number of pages and to stop'
+                                                   ' the pagination at the first page with only known articles when'
+                                                   ' the next pages are predicted to hold only known articles'
+                                                   ' (default False)')
+    parser.add_argument('--url-store', type=str, default=None, metavar='FILE',
+                        help='Keep the sets of the processed, problematic, known and bad URLs in this SQLite database'
+                             ' instead of memory (kept between the crawls, continued with --resume)')
+    parser.add_argument('--url-store-reset', type=str2bool, nargs='?', const=True, default=False,
+                        metavar='True/False', help='Forget the URLs of the previous crawls in the --url-store'
+                                                   ' (default False)')
+    parser.add_argument('--url-store-capacity', type=int, default=10000000, metavar='URLS',
+                        help='The expected number of URLs in the --url-store to size its in-memory Bloom filter'
+                             ' (about 1.2 bytes per URL, default 10000000)')
     parser.add_argument('--stay-offline', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
                         help='Do not download, but write output WARC (see --just-cache when no output warcfile'
                              ' is needed)')
+    parser.add_argument('--checkpoint', type=str, default=None, metavar='FILE',
+                        help='Save the state of the crawl periodically to this file to be able to --resume it')
+    parser.add_argument('--checkpoint-interval', type=float, default=60, metavar='SECONDS',
+                        help='Save the --checkpoint at most this often (default 60)')
+    parser.add_argument('--resume', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Continue the interrupted crawl from the --checkpoint (the output WARC files are truncated'
+                             ' to the checkpoint and appended)')
 
     # Mutually exclusive group...
     group = parser.add_mutually_exclusive_group()
@@ -95,6 +174,15 @@ def parse_args_crawl(parser):
     if cli_args.corpus and not cli_args.old_articles_warc:
         print('Must specify at least --old-articles-warc as source!', file=sys.stderr)
         exit(1)
+    if cli_args.resume and not cli_args.checkpoint:
+        print('Must specify --checkpoint to resume from!', file=sys.stderr)
+        exit(1)
+    if cli_args.adaptive_pagination and not cli_args.pagination_stats:
+        print('Must specify --pagination-stats for --adaptive-pagination!', file=sys.stderr)
+        exit(1)
+    if cli_args.url_store_reset and (not cli_args.url_store or cli_args.resume):
+        print('Must specify --url-store and not --resume for --url-store-reset!', file=sys.stderr)
+        exit(1)
 
     if cli_args.debug_news_archive:
         cli_args.debug_params = {'console_level': 'DEBUG', 'logfile_level': 'DEBUG'}
@@ -108,6 +196,11 @@ def parse_args_validate_and_list(parser):
                         help='Validate a warc file (created by this program) or list the urls in it')
     parser.add_argument('-s', '--source-warcfile', type=str, metavar='SOURCE WARCFILE', nargs='+',
                         help='A warc file (created by this program) to work from')
+    parser.add_argument('--compact-index', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Use memory efficient (array-backed) URL index in WARCReader for large WARC files')
+    parser.add_argument('--index-jobs', type=int, default=1, metavar='PROCESSES',
+                        help='Create the URL index of the WARC files (without an index file) in this many processes'
+                             ' in parallel (default 1, 0: the number of CPUs)')
     args = parser.parse_args()
     if (args.source_warcfile is None or len(args.source_warcfile) == 0) and args.offline:
         print('Must specify at least one SOURCE_WARC !', file=sys.stderr)
@@ -115,6 +208,14 @@ def parse_args_validate_and_list(parser):
     return args
 
 
+def parse_args_index(parser):
+    parser.add_argument(dest='command', choices={'index'}, metavar='index',
+                        help='Write sorted CDXJ index next to the supplied warc files (created by this program)')
+    parser.add_argument('-s', '--source-warcfile', type=str, metavar='SOURCE WARCFILE', nargs='+', required=True,
+                        help='A warc file (created by this program) to work from')
+    return parser.parse_args()
+
+
 def parse_args_sample(parser):
     parser.add_argument(dest='command', choices={'sample'}, metavar='sample',
                         help='Copy the supplied list of URLs to the output warc file from the internet '
@@ -135,11 +236,23 @@ def parse_args_sample(parser):
                         help='Allow session cookies')
     parser.add_argument('--max-tries', type=int, help='No of maximal tries if the download fails because duplicate '
                                                       'articles', default=3)
-    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period',
-                        default=2)
-    parser.add_argument('--limit-period', type=int, help='Limit (seconds) the period the number of HTTP request'
-                                                         ' see also --max-no-of-calls-in-period',
+    parser.add_argument('--max-no-of-calls-in-period', type=int, help='Limit number of HTTP request per period'
+                                                                      ' per host', default=2)
+    parser.add_argument('--limit-period', type=float, help='Limit (seconds) the period the number of HTTP request'
+                                                           ' per host see also --max-no-of-calls-in-period',
                         default=1)
+    parser.add_argument('--bulk', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Process the URLs in the order of their offsets in the source WARC files '
+                             '(faster on spinning disks and network filesystems, default False)')
+    parser.add_argument('--index-jobs', type=int, default=1, metavar='PROCESSES',
+                        help='Create the URL index of the WARC files (without an index file) in this many processes'
+                             ' in parallel (default 1, 0: the number of CPUs)')
+    parser.add_argument('--rate-limit-state', type=str, default=None, metavar='FILE',
+                        help='Share the rate limits per host with the other processes using the same state file'
+                             ' (SQLite database on a local filesystem)')
+    parser.add_argument('--download-workers', type=int, default=1,
+                        help='Download this many URLs concurrently on a thread pool (default 1, the records are still'
+                             ' written in order and --max-no-of-calls-in-period is obeyed)')
     args = parser.parse_args()
     if (args.source_warcfile is None or len(args.source_warcfile) == 0) and args.offline:
         print('Must specify at least one SOURCE_WARC if --offline is False!', file=sys.stderr)
@@ -155,6 +268,12 @@ def parse_args_cat(parser):
     parser.add_argument('-i', '--input-urls', dest='url_input_stream', type=FileType(), default=sys.stdin,
                         help='Use input file instead of STDIN (one URL per line)', metavar='FILE')
     parser.add_argument('out_dir', type=str)
+    parser.add_argument('--bulk', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Process the URLs in the order of their offsets in the source WARC files '
+                             '(faster on spinning disks and network filesystems, default False)')
+    parser.add_argument('--index-jobs', type=int, default=1, metavar='PROCESSES',
+                        help='Create the URL index of the WARC files (without an index file) in this many processes'
+                             ' in parallel (default 1, 0: the number of CPUs)')
     args = parser.parse_args()
     if (args.source_warcfile is None or len(args.source_warcfile) == 0) and args.offline:
         print('Must specify at least one SOURCE_WARC !', file=sys.stderr)
@@ -170,6 +289,17 @@ def parse_args_donwload(parser):
     return parser.parse_args()
 
 
+def parse_args_stats(parser):
+    parser.add_argument(dest='command', choices={'stats'}, metavar='stats',
+                        help='Print the pagination statistics recorded by crawl --pagination-stats')
+    parser.add_argument('pagination_stats', type=str, metavar='STATS_DB', help='The pagination statistics database')
+    parser.add_argument('--site', type=str, default=None, help='Print only the columns of this site (site_name)')
+    parser.add_argument('--column', type=str, default=None, help='Print only the columns of this name')
+    parser.add_argument('--archive-urls', type=str2bool, nargs='?', const=True, default=False, metavar='True/False',
+                        help='Print the statistics per archive page URL instead of per column (default False)')
+    return parser.parse_args()
+
+
 def parse_args_checkurls(parser):
     parser.add_argument(dest='command', choices={'checkurls'}, metavar='crawl',
                         help='Extract HTML content for archive URLs which contains input-urls as article urls '
@@ -190,33 +320,73 @@ def main_crawl(args):
     download_params = {'program_name': args.crawler_name, 'user_agent': args.user_agent,
                        'overwrite_warc': args.no_overwrite_warc, 'err_threshold': args.cumulative_error_threshold,
                        'known_bad_urls': args.known_bad_urls, 'strict_mode': args.strict,
+                       'compact_index': args.compact_index, 'use_mmap': args.use_mmap, 'index_jobs': args.index_jobs,
+                       'download_engine': args.download_engine,
+                       'max_concurrency_per_host': args.max_concurrency_per_host,
+                       'download_workers': args.download_workers, 'burst': args.burst,
+                       'honor_retry_after': args.honor_retry_after, 'honor_crawl_delay': args.honor_crawl_delay,
+                       'rate_limit_state': args.rate_limit_state, 'http_compression': args.http_compression,
+                       'max_warc_size': args.max_warc_size, 'max_warc_records': args.max_warc_records,
+                       'max_warc_age': args.max_warc_age,
                        'max_no_of_calls_in_period': args.max_no_of_calls_in_period, 'limit_period': args.limit_period,
                        'proxy_url': args.proxy_url, 'allow_cookies': args.allow_cookies,
                        'stay_offline': args.stay_offline, 'verify_request': portal_settings['verify_request']}
+    checkpoint = None
+    if args.checkpoint is not None:
+        checkpoint = CrawlCheckpoint(args.checkpoint, args.checkpoint_interval, args.resume)
+        if args.resume and ('url_store' in checkpoint.state) != (args.url_store is not None):
+            if args.url_store is None:
+                print('The checkpoint was saved with --url-store, it must be supplied again to --resume!',
+                      file=sys.stderr)
+            else:
+                print('The checkpoint was saved without --url-store, it can not be used to --resume!', file=sys.stderr)
+            exit(1)
+    pagination_stats = None
+    if args.pagination_stats is not None:
+        pagination_stats = PaginationStats(args.pagination_stats)
+    url_store = None
+    if args.url_store is not None:
+        url_store_resume_state = checkpoint.state.get('url_store') if checkpoint is not None else None
+        url_store = UrlStateStore(args.url_store, args.url_store_capacity, resume_state=url_store_resume_state,
+                                  reset=args.url_store_reset)
     if args.archive:
         # For the article links only...
         archive_crawler = NewsArchiveCrawler(portal_settings, args.old_archive_warc, args.archive_warc,
                                              args.archive_just_cache, args.known_article_urls, args.debug_params,
-                                             download_params)
+                                             download_params, checkpoint, args.archive_workers,
+                                             args.archive_prefetch, args.probe_archive_end, pagination_stats,
+                                             args.adaptive_pagination, url_store)
         for url in archive_crawler.url_iterator():  # Get the list of urls in the archive...
             print(url, flush=True)
+            archive_crawler.save_checkpoint()
+        archive_crawler.save_checkpoint(force=True)  # The finished crawl is not continued on resume
     else:
         articles_crawler = NewsArticleCrawler(portal_settings, args.old_articles_warc, args.articles_warc,
                                               args.old_archive_warc, args.archive_warc, args.articles_just_cache,
                                               args.archive_just_cache, args.known_article_urls, args.debug_params,
-                                              download_params)
+                                              download_params, checkpoint, args.archive_workers,
+                                              args.archive_prefetch, args.probe_archive_end, pagination_stats,
+                                              args.adaptive_pagination, url_store)
         articles_crawler.download_and_extract_all_articles()
 
 
 def main_validate_and_list(args):
     """ __file__ validate [source warcfiles]     # WarcReader(..., strict_mode=True, check_digest=True) """
     level = 'INFO'
-    url_index = validate_warc_file(args.source_warcfile, Logger(console_level=level, logfile_level=level))
+    url_index = validate_warc_file(args.source_warcfile, Logger(console_level=level, logfile_level=level),
+                                   args.compact_index, args.index_jobs)
     if args.command == 'listurls':
         for url in url_index:
             print(url)
 
 
+def main_index(args):
+    """ __file__ index [source warcfiles] """
+    main_logger = Logger()
+    index_warc_files(args.source_warcfile, main_logger)
+    main_logger.log('INFO', 'Done!')
+
+
 def main_cat_and_sample(args):
     """ __file__ sample [source warcfiles or None] [urls list file or stdin] [target warcfile] [Online or Offline] """
     if args.command == 'sample':
@@ -224,7 +394,7 @@ def main_cat_and_sample(args):
     else:
         just_cache = True
 
-    if args.config is not None:
+    if getattr(args, 'config', None) is not None:  # Only for sample
         extract_article_urls_from_page_plus_fun = \
             wrap_input_constants(args.config)['EXTRACT_ARTICLE_URLS_FROM_PAGE_PLUS_FUN']
     else:
@@ -239,12 +409,17 @@ def main_cat_and_sample(args):
     negative = getattr(args, 'negative', False)  # Sample URLs from warc not in input_stream
     max_tries = getattr(args, 'max_tries', 1)
     allow_cookies = getattr(args, 'allow_cookies', False)
+    max_no_of_calls_in_period = getattr(args, 'max_no_of_calls_in_period', 2)  # Only for sample
+    limit_period = getattr(args, 'limit_period', 1)  # Only for sample
+    download_workers = getattr(args, 'download_workers', 1)  # Only for sample
+    rate_limit_state = getattr(args, 'rate_limit_state', None)  # Only for sample
     sample_warc_by_urls(args.source_warcfile, args.url_input_stream, main_logger, target_warcfile=target_warcfile,
                         offline=offline, out_dir=out_dir, just_cache=just_cache, negative=negative,
                         extract_article_urls_from_page_plus_fun=extract_article_urls_from_page_plus_fun,
                         max_tries=max_tries, allow_cookies=allow_cookies,
-                        max_no_of_calls_in_period=args.max_no_of_calls_in_period,
-                        limit_period=args.limit_period)
+                        max_no_of_calls_in_period=max_no_of_calls_in_period, limit_period=limit_period,
+                        bulk=args.bulk, download_workers=download_workers, rate_limit_state=rate_limit_state,
+                        index_jobs=args.index_jobs)
     main_logger.log('INFO', 'Done!')
 
 
@@ -260,6 +435,18 @@ def main_checkurls(args):
     main_logger.log('INFO', 'Done!')
 
 
+def main_stats(args):
+    """ __file__ stats [stats db] """
+    header = ['site', 'column']
+    if args.archive_urls:
+        header.append('archive_page_url')
+    header.extend(['chains', 'failed', 'avg_pages', 'max_pages', 'urls_per_page', 'new_urls_per_page', 'retries',
+                   'max_page_retries', 'predicted_pages', 'known_rest'])
+    print(*header, sep='\t')
+    for row in PaginationStats(args.pagination_stats).summary(args.site, args.column, args.archive_urls):
+        print(*(round(val, 2) if isinstance(val, float) else val for val in row), sep='\t')
+
+
 def main_download(args):
     """ __file__ download [URL] [target warcfile] """
     main_logger = Logger()
@@ -272,9 +459,10 @@ def main():
     # Parse command arg from CLI and pass to the selected main function
     commands = {'validate': (parse_args_validate_and_list, main_validate_and_list),
                 'listurls': (parse_args_validate_and_list, main_validate_and_list),
+                'index': (parse_args_index, main_index),
                 'sample': (parse_args_sample, main_cat_and_sample), 'download': (parse_args_donwload, main_download),
                 'cat': (parse_args_cat, main_cat_and_sample), 'crawl': (parse_args_crawl, main_crawl),
-                'checkurls': (parse_args_checkurls, main_checkurls)}
+                'checkurls': (parse_args_checkurls, main_checkurls), 'stats': (parse_args_stats, main_stats)}
     parser = ArgumentParser()
     parser.add_argument('command', choices=commands.keys(), metavar='COMMAND',
                         help='Please choose from the available commands ({0}) to set mode and see detailed help!'.
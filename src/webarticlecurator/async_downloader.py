@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Asyncio download engine for WarcDownloader (optional, requires aiohttp: pip install webarticlecurator[aiohttp])
+
+import asyncio
+from atexit import register
+from threading import Thread, Lock
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+    from yarl import URL
+    from multidict import CIMultiDict
+except ImportError:  # Optional dependency, checked when AsyncWarcDownloader is created
+    aiohttp = None
+
+from .enhanced_downloader import WarcDownloader, respv_str, SPOOL_CHUNK_SIZE
+
+if aiohttp is not None:
+    class _PeerNameClientRequest(aiohttp.ClientRequest):
+        """
+            Store the peer name of the connection on the response
+            The connection is released as soon as the whole (small) response is received, so it must be queried here
+        """
+        async def send(self, conn):
+            try:
+                peer_name = conn.transport.get_extra_info('peername')[0]
+            except (AttributeError, TypeError, IndexError):
+                peer_name = 'None'  # Socket closed and could not determine peername...
+            resp = await super().send(conn)
+            resp.peer_name = peer_name
+            return resp
+
+
+class AsyncHostLimiter:
+    """
+        Per-host politeness for asyncio: at most max_concurrency requests in flight
+         and the token-bucket rate limit of the host (see HostRateLimiter)
+        Only the requests of the same host wait for each other, not the whole process
+    """
+    def __init__(self, host, max_concurrency, rate_limiter):
+        self._host = host
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = rate_limiter
+
+    def pause(self, seconds):
+        self._rate_limiter.pause(self._host, seconds)
+
+    def set_crawl_delay(self, seconds):
+        self._rate_limiter.set_crawl_delay(self._host, seconds)
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            delay = self._rate_limiter.reserve(self._host)  # The tokens are reserved in order
+            if delay > 0:
+                await asyncio.sleep(delay)
+        except BaseException:  # E.g. cancelled while waiting
+            self._semaphore.release()
+            raise
+
+    async def __aexit__(self, *_):
+        self._semaphore.release()
+
+
+class AsyncDownloadEngine:
+    """
+        An asyncio event loop running in a background thread for one or more AsyncWarcDownloader
+        The downloaders (e.g. for several portals or columns crawled at once) share the per-host limits of the engine
+    """
+    _shared_engine = None
+    _shared_engine_lock = Lock()
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, name='AsyncDownloadEngine', daemon=True)
+        self._thread.start()
+        self._host_limiters = {}
+        self._sessions = []
+        register(self.close)  # The loop thread is still running when the atexit handlers are called
+
+    def close(self):
+        """Close the HTTP sessions of the downloaders and stop the event loop"""
+        if self._loop.is_running():
+            sessions, self._sessions = self._sessions, []
+            for session in sessions:
+                self.run(session.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    @classmethod
+    def shared(cls):
+        """The default engine of the process"""
+        with cls._shared_engine_lock:
+            if cls._shared_engine is None:
+                cls._shared_engine = cls()
+            return cls._shared_engine
+
+    def run(self, coro, timeout=None):
+        """Run the coroutine in the event loop and wait for its result (must not be called from the loop itself!)"""
+        return self.submit(coro).result(timeout)
+
+    def submit(self, coro):
+        """Schedule the coroutine in the event loop and return its concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def new_session(self, *args, **kwargs):
+        """Create an aiohttp.ClientSession which is closed with the engine (must be called from the event loop)"""
+        session = aiohttp.ClientSession(*args, **kwargs)
+        self._sessions.append(session)
+        return session
+
+    def host_limiter(self, host, max_concurrency, rate_limiter):
+        """Get or create the limiter of the host, the first downloader sets its limits (call from the event loop)"""
+        limiter = self._host_limiters.get(host)
+        if limiter is None:
+            limiter = AsyncHostLimiter(host, max_concurrency, rate_limiter)
+            self._host_limiters[host] = limiter
+        return limiter
+
+
+class AsyncWarcDownloader(WarcDownloader):
+    """
+        WarcDownloader with asyncio engine: many requests in flight with per-host concurrency and rate limits
+         and a single writer task which serializes the records into the WARC file
+
+        download_url() and write_records_for_url() keep the contract of WarcDownloader,
+         download_urls() and iter_download_urls() download a batch of URLs concurrently
+    """
+    def __init__(self, *args, engine=None, max_concurrency_per_host=2, **kwargs):
+        if aiohttp is None:
+            raise ImportError('The asyncio download engine requires aiohttp:'
+                              ' pip install webarticlecurator[aiohttp]')
+        super().__init__(*args, **kwargs)
+        if self._proxy_url is not None and not self._proxy_url.startswith(('http://', 'https://')):
+            raise ValueError('The asyncio download engine supports only HTTP(S) proxies: {0}'.format(self._proxy_url))
+        self._max_concurrency_per_host = max_concurrency_per_host
+        if engine is None:
+            engine = AsyncDownloadEngine.shared()
+        self._engine = engine
+        # Created in the event loop when first needed
+        self._aio_session = None
+        self._write_queue = None
+        self._writer_running = False
+        self._in_flight = set()
+        self._robots_futures = {}
+        # aiohttp does not accept None header values (requests omits them)
+        self._aio_req_headers = {k: v for k, v in self._req_headers.items() if v is not None}
+
+    @property
+    def concurrency(self):  # Ready-only property for shortcut
+        return self._max_concurrency_per_host
+
+    async def _get_session(self):
+        if self._aio_session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self._max_concurrency_per_host,
+                                             ssl=None if self._verify_request else False)
+            cookie_jar = None if self._allow_cookies else aiohttp.DummyCookieJar()  # Dummy: purge all cookies
+            self._aio_session = self._engine.new_session(connector=connector, cookie_jar=cookie_jar,
+                                                         request_class=_PeerNameClientRequest,
+                                                         auto_decompress=False)  # Store the bytes from the wire
+        return self._aio_session
+
+    async def _writer_task(self):
+        """The single writer of the WARC file: writes the records in the order of the queue and exits when idle"""
+        while not self._write_queue.empty():
+            url, rec, done = self._write_queue.get_nowait()
+            try:
+                WarcDownloader.write_records_for_url(self, url, rec)
+                done.set_result(None)
+            except Exception as err:
+                done.set_exception(err)
+            await asyncio.sleep(0)  # Let the downloads run between the writes
+        self._writer_running = False
+
+    async def _write_records_for_url(self, url, rec):
+        if self._write_queue is None:
+            self._write_queue = asyncio.Queue()
+        done = asyncio.get_running_loop().create_future()
+        self._write_queue.put_nowait((url, rec, done))
+        if not self._writer_running:  # Only one writer at a time (the event loop is single-threaded)
+            self._writer_running = True
+            asyncio.ensure_future(self._writer_task())
+        await done
+
+    def write_records_for_url(self, url, rec):
+        self._engine.run(self._write_records_for_url(url, rec))
+
+    async def _fetch_and_create_records(self, url, revisit_of=None):
+        url_reparsed, netloc, request_target = self._reparse_url(url)
+        req_headers = self._aio_req_headers
+        if revisit_of is not None:  # Conditional request (see WarcDownloader._fetch_records())
+            req_headers = dict(req_headers, **revisit_of[2])
+        session = await self._get_session()
+        limiter = self._engine.host_limiter(netloc, self._max_concurrency_per_host, self._rate_limiter)
+        if self._honor_crawl_delay:
+            robots_future = self._robots_futures.get(netloc)
+            if robots_future is None:  # The other requests to the host must wait for its Crawl-delay
+                robots_future = asyncio.get_running_loop().run_in_executor(None, self._get_crawl_delay,
+                                                                           urlparse(url_reparsed).scheme, netloc,
+                                                                           self._verify_request)
+                self._robots_futures[netloc] = robots_future
+                crawl_delay = await robots_future
+                if crawl_delay is not None:
+                    limiter.set_crawl_delay(crawl_delay)
+            else:
+                await robots_future
+
+        # Try to resolve network errors with retries
+        for i in range(1, self._max_retries+1):
+            try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
+                async with limiter, session.get(URL(url_reparsed, encoded=True), headers=req_headers,
+                                                proxy=self._proxy_url) as resp:
+                    if resp.status == 200 or (resp.status == 304 and revisit_of is not None):
+                        peer_name = resp.peer_name
+                        proto = 'HTTP/{0}'.format(respv_str[resp.version.major * 10 + resp.version.minor])
+                        # RESPONSE
+                        # resp_status need to be stripped else warcio strips the spaces and digest verification
+                        #  will fail!
+                        resp_status = '{0} {1}'.format(resp.status, resp.reason).strip()
+                        resp_headers_list = [(k.decode('latin-1'), v.decode('latin-1')) for k, v in resp.raw_headers]
+                        if resp.status == 304:  # Not Modified
+                            payload = None
+                            break
+                        payload = self._new_payload_spool(proto, resp_status, resp_headers_list, resp.headers)
+                        try:  # To be able to return decoded and also write warc holding only one copy of the data
+                            async for chunk in resp.content.iter_chunked(SPOOL_CHUNK_SIZE):
+                                payload.write(chunk)
+                        except BaseException:
+                            payload.close()
+                            raise
+                        break
+                    retry_after = self._get_retry_after(url, resp.status, resp.headers)
+                    if retry_after is None:  # Not HTTP 200 OK
+                        self._handle_request_exception(url, f'Downloading failed with status code: {resp.status} '
+                                                            f'{resp.reason}')
+                        return None
+                # Retry if there is retries left (after the server allows it)...
+                limiter.pause(retry_after)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
+                                                    ' The program ignores it and jumps to the next one.')
+                # Retry if there is retries left...
+            # UnicodeError is originated from idna codec error, ValueError from invalid URLs
+            except (UnicodeError, ValueError) as err:
+                self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
+                                                    ' The program ignores it and jumps to the next one.')
+                return None
+        else:  # Out of retries -> Failed
+            self._handle_request_exception(url, 'RequestException happened during downloading: Out of retries! \n\n'
+                                                ' The program ignores it and jumps to the next one.')
+            return None
+
+        # REQUEST (build headers for warc)
+        reqv_headers = CIMultiDict(resp.request_info.headers)
+        reqv_headers['Host'] = netloc
+
+        if payload is None:
+            return self._create_not_modified_records(url, request_target, proto, reqv_headers.items(), peer_name,
+                                                     resp_status, resp_headers_list, revisit_of)
+        # Detecting the encoding and creating the records is CPU-bound: it must not block the other downloads
+        return await asyncio.get_running_loop().run_in_executor(None, self._create_records, url, request_target,
+                                                                proto, list(reqv_headers.items()), peer_name,
+                                                                payload, revisit_of)
+
+    async def _download_url_async(self, url, return_warc_records_wo_writing=False, lazy=False, revisit_of=None):
+        if not self._is_new_url(url):
+            return None
+        if url in self._in_flight:
+            self._logger.log('ERROR', 'Not downloading URL, because it is already being downloaded:', url)
+            return None
+
+        self._in_flight.add(url)
+        try:
+            records_and_response = await self._fetch_and_create_records(url, revisit_of)
+            if records_and_response is None:
+                return None
+
+            rec, text = records_and_response
+            if not lazy:  # Backward compatible str return (decoded off the event loop)
+                text = await asyncio.get_running_loop().run_in_executor(None, getattr, text, 'text')
+            if return_warc_records_wo_writing:
+                # Return the WARC records and the text content
+                return rec, text
+
+            # Write the two WARC records and return the text content only
+            await self._write_records_for_url(url, rec)
+            return text
+        finally:
+            self._in_flight.discard(url)
+
+    def _iter_download_urls(self, urls, return_warc_records_wo_writing=False, lazy=False, cached=None):
+        """
+            Download the URLs concurrently and generate the results (as download_url() would) in the order of the URLs
+             as soon as they (and the ones before them) are downloaded
+            The records are written in the order the downloads finish
+            The URLs with cached records (URL -> (reader, reqv, resp)) are downloaded conditionally
+             (see _download_url())
+        """
+        # In the calling thread as the readers are not thread-safe
+        revisits_of = {url: self._read_revisit_info(records) for url, records in (cached or {}).items()}
+        futures = [self._engine.submit(self._download_url_async(url, return_warc_records_wo_writing, lazy,
+                                                                revisits_of.get(url))) for url in urls]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:  # The downloads which are not finished yet are not needed anymore
+            for future in futures:
+                future.cancel()
+
+    def _download_url(self, url, return_warc_records_wo_writing=False, lazy=False, cached=None):
+        revisit_of = self._read_revisit_info(cached)  # In the calling thread as the readers are not thread-safe
+        return self._engine.run(self._download_url_async(url, return_warc_records_wo_writing, lazy, revisit_of))
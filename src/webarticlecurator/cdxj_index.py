@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Sorted CDXJ index (one line per request-response pair) for WARC files created by this program
+#  Format of a line: SURT_KEY TIMESTAMP {JSON}
+#  The first line is a header with the size of the WARC file at indexing: !meta 0 {"warc_size": SIZE}
+#  See: https://specs.webrecorder.net/cdxj/0.1.0/
+
+import os
+import json
+from mmap import mmap, ACCESS_READ
+from urllib.parse import urlparse, quote
+
+from warcio.archiveiterator import ArchiveIterator
+
+default_ports = {'http': '80', 'https': '443'}
+META_KEY = '!meta'  # Sorts before the SURT keys, the lines starting with ! are skipped by the readers (as in pywb)
+REVISIT_MIME = 'warc/revisit'  # The same as pywb
+
+
+def surt_key(url):
+    """
+        Create the Sort-friendly URI Reordering Transform (SURT) form of the URL used as the key in CDXJ files:
+         https://www.index.hu/belfold/?b=2&a=1 -> hu,index)/belfold/?a=1&b=2
+        The transformation is lossy (e.g. lowercasing), the original URL must be checked on lookup!
+        The whitespace and the control characters are percent-encoded as the fields of the CDXJ lines are separated
+         by space, which must sort before the characters of the keys
+    """
+    scheme, netloc, path, params, query, _ = urlparse(url)
+    host = netloc.rsplit('@', maxsplit=1)[-1].lower()  # Strip userinfo
+    host, _, port = host.partition(':')
+    if host.startswith('www.'):
+        host = host[4:]
+    key = ','.join(reversed(host.split('.')))
+    if len(port) > 0 and port != default_ports.get(scheme):
+        key = '{0}:{1}'.format(key, port)
+    key = '{0}){1}'.format(key, path or '/')
+    if len(params) > 0:
+        key = '{0};{1}'.format(key, params)
+    if len(query) > 0:
+        key = '{0}?{1}'.format(key, '&'.join(sorted(query.split('&'))))
+    key = ''.join(quote(c) if c <= ' ' or c.isspace() else c for c in key)
+    return key.lower()
+
+
+def _warc_date_to_timestamp(warc_date):
+    """2020-05-01T12:34:56Z or 2020-05-01T12:34:56.123456Z -> 20200501123456"""
+    return ''.join(c for c in warc_date if c.isdigit())[:14]
+
+
+def gen_cdxj_lines(warc_filename):
+    """
+        Scan the WARC file once and generate the (unsorted) CDXJ lines for all request-response (or revisit) pairs
+         with the following fields: url, mime, status, digest, encoding, offset, length, filename, req_offset, req_length
+    """
+    filename = os.path.basename(warc_filename)
+    with open(warc_filename, 'rb') as stream:
+        archive_it = ArchiveIterator(stream)
+        reqv_data = (None, None, None)
+        for record in archive_it:
+            if record.rec_type == 'request':
+                reqv_data = (record.rec_headers.get_header('WARC-Target-URI'), archive_it.get_record_offset(),
+                             archive_it.get_record_length())
+            elif record.rec_type in {'response', 'revisit'}:  # Revisit records are resolved by WarcReader
+                url = record.rec_headers.get_header('WARC-Target-URI')
+                if url != reqv_data[0]:
+                    raise ValueError('Response without request in {0} for URL: {1}'.format(warc_filename, url))
+                if record.rec_type == 'revisit':
+                    content_type = REVISIT_MIME
+                else:
+                    content_type = record.http_headers.get_header('Content-Type', '')
+                data = {'url': url, 'mime': content_type.split(';', maxsplit=1)[0].strip(),
+                        'status': record.http_headers.get_statuscode(),
+                        'digest': record.rec_headers.get_header('WARC-Payload-Digest'),
+                        'encoding': record.rec_headers.get_header('WARC-X-Detected-Encoding'),
+                        'offset': archive_it.get_record_offset(), 'length': archive_it.get_record_length(),
+                        'filename': filename, 'req_offset': reqv_data[1], 'req_length': reqv_data[2]}
+                yield '{0} {1} {2}'.format(surt_key(url),
+                                           _warc_date_to_timestamp(record.rec_headers.get_header('WARC-Date', '')),
+                                           json.dumps(data, ensure_ascii=False))
+
+
+def write_cdxj_index(warc_filename, cdxj_filename):
+    """Write the sorted CDXJ index of the WARC file atomically and return the number of lines written"""
+    warc_size = os.stat(warc_filename).st_size  # Before reading to detect changes during indexing
+    lines = sorted(gen_cdxj_lines(warc_filename))  # Codepoint order is the same as UTF-8 byte order
+    tmp_filename = '{0}.tmp'.format(cdxj_filename)
+    with open(tmp_filename, 'w', encoding='UTF-8') as fh:
+        print(META_KEY, 0, json.dumps({'warc_size': warc_size}), file=fh)
+        for line in lines:
+            print(line, file=fh)
+    os.replace(tmp_filename, cdxj_filename)
+    return len(lines)
+
+
+class CDXJIndex:
+    """
+        Read-only URL index backed by a sorted CDXJ file
+
+        The file is memory-mapped and looked up with binary search, so it is not loaded into memory.
+        It behaves like the dict-based URL index of WarcReader:
+         url in index, index.get(url) -> ((reqv_offset, reqv_length), (resp_offset, resp_length)), len() and iteration
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._fh = open(filename, 'rb')
+        if os.fstat(self._fh.fileno()).st_size > 0:
+            self._mm = mmap(self._fh.fileno(), 0, access=ACCESS_READ)
+        else:
+            self._mm = b''  # Empty files can not be mapped
+        self._len = None
+        self.meta = {}  # The header of the file (see write_cdxj_index())
+        if self._mm[:len(META_KEY) + 1] == '{0} '.format(META_KEY).encode('UTF-8'):
+            self.meta = self._parse_line(next(self._iter_lines_from(0)))[2]
+
+    def __del__(self):
+        if hasattr(self, '_mm') and not isinstance(self._mm, bytes):
+            self._mm.close()
+        if hasattr(self, '_fh'):  # If the program opened a file, then it should gracefully close it on exit!
+            self._fh.close()
+
+    def _bisect(self, key):
+        """Return the position of the first line which has key greater than or equal to the supplied key (bytes)"""
+        lo, hi = 0, len(self._mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._mm.rfind(b'\n', lo, mid)  # lo is always at the start of a line
+            start = lo if start == -1 else start + 1
+            end = self._mm.find(b'\n', start)
+            end = len(self._mm) if end == -1 else end + 1
+            if self._mm[start:self._mm.find(b' ', start, end)] < key:
+                lo = end
+            else:
+                hi = start
+        return lo
+
+    def _iter_lines_from(self, pos):
+        while pos < len(self._mm):
+            end = self._mm.find(b'\n', pos)
+            if end == -1:
+                end = len(self._mm)
+            yield self._mm[pos:end]
+            pos = end + 1
+
+    def _iter_data_lines(self):
+        """The lines of the index without the header and the empty lines"""
+        for line in self._iter_lines_from(0):
+            if len(line) > 0 and not line.startswith(b'!'):
+                yield line
+
+    @staticmethod
+    def _parse_line(line):
+        key, timestamp, data = line.decode('UTF-8').split(' ', maxsplit=2)
+        return key, timestamp, json.loads(data)
+
+    def iter_prefix(self, prefix):
+        """Range scan: generate (key, timestamp, data) for all lines whose SURT key starts with the prefix (str)"""
+        prefix_bytes = prefix.encode('UTF-8')
+        for line in self._iter_lines_from(self._bisect(prefix_bytes)):
+            if not line.startswith(prefix_bytes):
+                break
+            yield self._parse_line(line)
+
+    def get_line_data(self, url):
+        """Return the JSON data of the line for the URL or None if the URL is not in the index"""
+        key = '{0} '.format(surt_key(url)).encode('UTF-8')
+        # The lines of the exact key come first (space sorts before the other characters of the longer keys)
+        for line in self._iter_lines_from(self._bisect(key[:-1])):
+            if not line.startswith(key):
+                break
+            data = self._parse_line(line)[2]
+            if data['url'] == url:  # SURT is lossy, different URLs may share the same key
+                return data
+        return None
+
+    def revisit_offsets(self):
+        """Return the offsets of the revisit records (only the lines with the revisit mime type are parsed)"""
+        marker = json.dumps({'mime': REVISIT_MIME})[1:-1].encode('UTF-8')  # As written by gen_cdxj_lines()
+        offsets = set()
+        pos = self._mm.find(marker)
+        while pos != -1:
+            start = self._mm.rfind(b'\n', 0, pos) + 1
+            end = self._mm.find(b'\n', pos)
+            if end == -1:
+                end = len(self._mm)
+            data = self._parse_line(self._mm[start:end])[2]
+            if data.get('mime') == REVISIT_MIME:  # Not in a URL
+                offsets.add(data['offset'])
+            pos = self._mm.find(marker, end)
+        return offsets
+
+    def get(self, url, default=None):
+        data = self.get_line_data(url)
+        if data is None:
+            return default
+        return (data['req_offset'], data['req_length']), (data['offset'], data['length'])
+
+    def __contains__(self, url):
+        return self.get_line_data(url) is not None
+
+    def __iter__(self):
+        for line in self._iter_data_lines():
+            yield self._parse_line(line)[2]['url']
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self._iter_data_lines())
+        return self._len
+
+    def keys(self):
+        return self
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Layered charset detection for the payloads without charset in the Content-Type header
+
+import re
+from codecs import lookup, getincrementaldecoder, BOM_UTF8, BOM_UTF16_LE, BOM_UTF16_BE, BOM_UTF32_LE, BOM_UTF32_BE
+
+from chardet import detect
+
+# The declaration (<meta charset>, <meta http-equiv> or <?xml encoding?>) is searched in the first bytes only
+SNIFF_SIZE = 4 * 1024
+# The statistical detector gets only this many bytes from the start of the payload
+STATISTICAL_DETECTION_SIZE = 64 * 1024
+
+# The values of WARC-X-Detected-Encoding-Method (beside the value of WARC-X-Detected-Encoding)
+METHOD_HTTP_HEADER = 'http-header'
+METHOD_BOM = 'bom'
+METHOD_META = 'meta'
+METHOD_UTF8 = 'utf-8-validation'
+METHOD_STATISTICAL = 'chardet'
+
+# UTF-32 must be checked before UTF-16 as BOM_UTF32_LE starts with BOM_UTF16_LE
+BOMS = ((BOM_UTF8, 'utf-8-sig'), (BOM_UTF32_LE, 'utf-32'), (BOM_UTF32_BE, 'utf-32'), (BOM_UTF16_LE, 'utf-16'),
+        (BOM_UTF16_BE, 'utf-16'))  # The utf-16 and utf-32 codecs consume the BOM
+
+# <meta charset="..."> and <meta http-equiv="Content-Type" content="text/html; charset=..."> (and any similar)
+META_CHARSET_RE = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.+-]+)', re.IGNORECASE)
+XML_ENCODING_RE = re.compile(rb'^\s*<\?xml[^>]+?encoding\s*=\s*["\']\s*([a-zA-Z0-9_:.+-]+)', re.IGNORECASE)
+
+
+def detect_bom(data):
+    """Return the encoding from the byte order mark at the start of the data or None"""
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+def sniff_declared_encoding(data):
+    """Return the encoding declared in the (first SNIFF_SIZE bytes of the) HTML or XML document or None"""
+    prefix = data[:SNIFF_SIZE]
+    for regex in (XML_ENCODING_RE, META_CHARSET_RE):
+        m = regex.search(prefix)
+        if m is not None:
+            try:
+                name = lookup(m.group(1).decode('ascii')).name
+            except LookupError:  # Unknown or misspelled encoding: keep searching
+                continue
+            if name.startswith(('utf-16', 'utf-32')):  # The declaration is readable as ASCII, so it can not be true
+                return 'utf-8'
+            return name
+    return None
+
+
+class CharsetDetector:
+    """
+        Detect the encoding of a payload fed chunk-by-chunk (instead of running chardet on the whole payload):
+         1) the byte order mark
+         2) the <meta charset>, <meta http-equiv> or XML declaration in the first SNIFF_SIZE bytes
+         3) strict UTF-8 validation of the whole payload (pure ASCII chunks are skipped quickly)
+         4) chardet on the first STATISTICAL_DETECTION_SIZE bytes as the last resort
+        After close() encoding holds the result (None if nothing is detected) and method the step which found it
+    """
+    def __init__(self):
+        self._prefix = b''
+        self._utf8_decoder = getincrementaldecoder('utf-8')()
+        self._utf8_valid = True
+        self.encoding = None
+        self.method = None
+
+    @property
+    def done(self):  # Ready-only property for shortcut
+        return self.method is not None
+
+    def feed(self, data):
+        if self.done:
+            return
+        if len(self._prefix) < STATISTICAL_DETECTION_SIZE:
+            sniff_before = len(self._prefix) < SNIFF_SIZE
+            self._prefix += data[:STATISTICAL_DETECTION_SIZE - len(self._prefix)]
+            if sniff_before and len(self._prefix) >= SNIFF_SIZE and self._detect_from_prefix():
+                return
+        if self._utf8_valid:
+            try:
+                if not data.isascii() or len(self._utf8_decoder.getstate()[0]) > 0:
+                    self._utf8_decoder.decode(data)
+            except UnicodeDecodeError:
+                self._utf8_valid = False
+
+    def _detect_from_prefix(self):
+        for method, detector in ((METHOD_BOM, detect_bom), (METHOD_META, sniff_declared_encoding)):
+            encoding = detector(self._prefix)
+            if encoding is not None:
+                self.encoding, self.method = encoding, method
+                self._prefix = b''
+                return True
+        return False
+
+    def close(self):
+        """Call when all data is fed"""
+        if self.done or self._detect_from_prefix():
+            return
+        if self._utf8_valid:
+            try:
+                self._utf8_decoder.decode(b'', final=True)  # No truncated sequence at the end
+            except UnicodeDecodeError:
+                self._utf8_valid = False
+        if self._utf8_valid:
+            self.encoding, self.method = 'utf-8', METHOD_UTF8
+        else:
+            self.encoding, self.method = detect(self._prefix)['encoding'], METHOD_STATISTICAL
+        self._prefix = b''
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Crash-safe checkpoints of the crawl state to resume an interrupted crawl (crawl --checkpoint FILE --resume)
+
+import os
+import json
+from time import monotonic, time
+from collections import defaultdict
+
+# The format version of the checkpoint file (bump on incompatible changes)
+CHECKPOINT_VERSION = 2
+
+
+class JournaledUrlSet(set):
+    """
+        A set of URLs which keeps the URLs added since the last checkpoint (pending),
+         so only those are appended to the URL journal of CrawlCheckpoint
+    """
+    def __init__(self, urls=()):
+        super().__init__(urls)
+        self.pending = []
+
+    def add(self, url):
+        if url not in self:
+            super().add(url)
+            self.pending.append(url)
+
+    def update(self, *url_lists):
+        for urls in url_lists:
+            for url in urls:
+                self.add(url)
+
+
+class CrawlCheckpoint:
+    """
+        The state of the crawl saved periodically (at most every interval seconds) to a JSON file
+        The file is replaced atomically, so a crash leaves the previous checkpoint intact
+        The crawlers and the downloaders store their part of the state under their own key
+         and on resume they continue from the loaded state instead of starting from scratch
+        The URL sets of the crawl (see url_set()) are not stored in the file: the URLs added since the previous
+         checkpoint are appended to the URL journal (filename.urls, JSON lines), which is truncated on resume
+         to its size at the checkpoint, so saving costs only the new URLs instead of all of them
+    """
+    def __init__(self, filename, interval=60.0, resume=False):
+        self.filename = filename
+        self.journal_filename = '{0}.urls'.format(filename)
+        self._interval = interval
+        self._last_saved = monotonic()
+        self._url_sets = {}
+        self._journaled_urls = defaultdict(list)  # The URLs read from the journal by key until url_set() takes them
+        if resume:
+            self.state = self.load(filename)
+            self._journal_fh = self._resume_journal(self.state['url_journal_size'])
+        else:
+            self.state = {}
+            self._journal_fh = open(self.journal_filename, 'wb')
+
+    def __del__(self):
+        if hasattr(self, '_journal_fh'):
+            self._journal_fh.close()
+
+    @staticmethod
+    def load(filename):
+        with open(filename, encoding='UTF-8') as fh:
+            state = json.load(fh)
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError('Unsupported checkpoint file version ({0}): {1}'.format(state.get('version'), filename))
+        return state
+
+    def _resume_journal(self, size):
+        """Read the URL journal up to its size at the checkpoint and open it for appending after that"""
+        journal_fh = open(self.journal_filename, 'r+b')
+        if os.fstat(journal_fh.fileno()).st_size < size:
+            journal_fh.close()
+            raise ValueError('The URL journal is shorter than at the checkpoint: {0}'.format(self.journal_filename))
+        journal_fh.truncate(size)  # The URLs added after the checkpoint are processed again
+        for line in journal_fh:
+            key, url = json.loads(line)
+            self._journaled_urls[key].append(url)
+        journal_fh.seek(size)
+        return journal_fh
+
+    def url_set(self, key):
+        """The set of URLs stored under the key in the URL journal (restored from it on resume)"""
+        if key in self._url_sets:
+            raise ValueError('The URL set is already in use: {0}'.format(key))
+        url_set = JournaledUrlSet(self._journaled_urls.pop(key, ()))
+        self._url_sets[key] = url_set
+        return url_set
+
+    @property
+    def due(self):  # Ready-only property for shortcut
+        return monotonic() - self._last_saved >= self._interval
+
+    def save(self, state):
+        """Write the state atomically and durably (the WARC files must be synced before)"""
+        for key, url_set in self._url_sets.items():  # The journal must be synced before the state refers to it
+            for url in url_set.pending:
+                self._journal_fh.write(json.dumps([key, url], ensure_ascii=False).encode('UTF-8') + b'\n')
+            url_set.pending = []
+        self._journal_fh.flush()
+        os.fsync(self._journal_fh.fileno())
+        state = dict(state, version=CHECKPOINT_VERSION, saved_at=time(), url_journal_size=self._journal_fh.tell())
+        tmp_filename = '{0}.tmp'.format(self.filename)
+        with open(tmp_filename, 'w', encoding='UTF-8') as fh:
+            json.dump(state, fh, ensure_ascii=False)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_filename, self.filename)
+        self._last_saved = monotonic()
+        self.state = state
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Memory efficient URL index for WarcReader (for WARC files with tens of millions of URLs)
+
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+from heapq import merge
+
+# The entries are sorted in runs of this size (as Python ints) and the runs are merged (kept in arrays)
+SORT_RUN_SIZE = 1 << 20
+
+
+def _url_hash(url_bytes):
+    """64-bit key of the URL (the full URL is verified on hit, so collisions are harmless)"""
+    return int.from_bytes(blake2b(url_bytes, digest_size=8).digest(), 'little')
+
+
+def _encode_url(url):
+    return url.encode('UTF-8', 'surrogatepass')
+
+
+class CompactURLIndex:
+    """
+        Array-backed replacement of the dict-based URL index of WarcReader
+
+        URLs are hashed to 64-bit keys stored in a sorted array, the offsets and lengths of the request-response pairs
+         are stored in a parallel (flat) integer array, and the URLs are concatenated into one bytes buffer
+         (for verifying the hits and for iteration) instead of millions of str, tuple and int objects.
+        It behaves like the dict-based index: index[url] = ((reqv_offset, reqv_length), (resp_offset, resp_length)),
+         url in index, index.get(url), len(), keys(), items() and iteration on URLs.
+        Elements are appended unsorted and the arrays are sorted (and deduplicated, the last value wins)
+         on the first lookup.
+    """
+    def __init__(self):
+        self._hashes = array('Q')
+        self._positions = array('Q')  # reqv_offset, reqv_length, resp_offset, resp_length for each URL (flat)
+        self._url_ends = array('Q')  # The end of each URL in _urls (the start is the end of the previous one)
+        self._urls = bytearray()
+        self._sorted = True
+
+    def __setitem__(self, url, reqv_resp_pair):
+        url_bytes = _encode_url(url)
+        (reqv_offset, reqv_length), (resp_offset, resp_length) = reqv_resp_pair
+        self._hashes.append(_url_hash(url_bytes))
+        self._positions.extend((reqv_offset, reqv_length, resp_offset, resp_length))
+        self._urls += url_bytes
+        self._url_ends.append(len(self._urls))
+        self._sorted = False
+
+    def _url_bytes(self, i):
+        start = self._url_ends[i - 1] if i > 0 else 0
+        return bytes(self._urls[start:self._url_ends[i]])
+
+    def _reqv_resp_pair(self, i):
+        reqv_offset, reqv_length, resp_offset, resp_length = self._positions[4 * i:4 * i + 4]
+        return (reqv_offset, reqv_length), (resp_offset, resp_length)
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+
+        # Only one run is sorted as a list of ints at a time, the sorted runs are kept in packed arrays
+        #  and merged lazily (both the sort and the merge are stable: they keep the insertion order on equal hashes)
+        key = self._hashes.__getitem__
+        runs = [array('Q', sorted(range(start, min(start + SORT_RUN_SIZE, len(self._hashes))), key=key))
+                for start in range(0, len(self._hashes), SORT_RUN_SIZE)]
+        order = merge(*runs, key=key)
+        hashes, positions, url_ends, urls = array('Q'), array('Q'), array('Q'), bytearray()
+        j = next(order, None)
+        while j is not None:
+            # Entries with the same hash: the last one wins for the same URL (as for dict)
+            curr_hash = self._hashes[j]
+            same_hash = {}
+            while j is not None and self._hashes[j] == curr_hash:
+                same_hash[self._url_bytes(j)] = j
+                j = next(order, None)
+            for url_bytes, k in same_hash.items():
+                hashes.append(curr_hash)
+                positions.extend(self._positions[4 * k:4 * k + 4])
+                urls += url_bytes
+                url_ends.append(len(urls))
+
+        self._hashes, self._positions, self._url_ends, self._urls = hashes, positions, url_ends, urls
+        self._sorted = True
+
+    def _find(self, url):
+        self._ensure_sorted()
+        url_bytes = _encode_url(url)
+        url_hash = _url_hash(url_bytes)
+        i = bisect_left(self._hashes, url_hash)
+        while i < len(self._hashes) and self._hashes[i] == url_hash:
+            if self._url_bytes(i) == url_bytes:
+                return i
+            i += 1
+        return None
+
+    def get(self, url, default=None):
+        i = self._find(url)
+        if i is None:
+            return default
+        return self._reqv_resp_pair(i)
+
+    def __contains__(self, url):
+        return self._find(url) is not None
+
+    def __iter__(self):
+        self._ensure_sorted()
+        for i in range(len(self._hashes)):
+            yield self._url_bytes(i).decode('UTF-8', 'surrogatepass')
+
+    def __len__(self):
+        self._ensure_sorted()
+        return len(self._hashes)
+
+    def keys(self):
+        return self
+
+    def items(self):
+        for i, url in enumerate(self):
+            yield url, self._reqv_resp_pair(i)
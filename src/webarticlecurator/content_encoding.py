@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# HTTP content codings (Content-Encoding) of the payloads: the WARC response records hold the bytes from the wire
+#  and the content coding is removed only to detect the encoding and to decode the text
+
+import zlib
+
+try:
+    import brotli  # The same module as warcio uses to read the records
+except ImportError:  # Optional dependency, br is not requested without it (pip install webarticlecurator[brotli])
+    brotli = None
+
+# The value of the Accept-Encoding request header when HTTP compression is enabled
+if brotli is not None:
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+else:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class ContentDecodingError(ValueError):
+    pass
+
+
+class _GzipDecoder:
+    """Decompress gzip data which may consist of several members"""
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        ret = []
+        while len(data) > 0:
+            ret.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data
+            if len(data) > 0:  # The next member starts
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return b''.join(ret)
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+class _DeflateDecoder:
+    """Decompress zlib wrapped or raw deflate data (both are sent as deflate by the servers)"""
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+        self._first_data = b''  # Kept until it is known which one is used
+
+    def decompress(self, data):
+        if self._first_data is None:
+            return self._decompressor.decompress(data)
+        self._first_data += data
+        try:
+            ret = self._decompressor.decompress(self._first_data)
+        except zlib.error:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            ret = self._decompressor.decompress(self._first_data)
+        self._first_data = None
+        return ret
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+class _BrotliDecoder:
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self._decompressor.process(data)
+
+    @staticmethod
+    def flush():
+        return b''
+
+
+DECODERS = {'gzip': _GzipDecoder, 'x-gzip': _GzipDecoder, 'deflate': _DeflateDecoder}
+if brotli is not None:
+    DECODERS['br'] = _BrotliDecoder
+
+
+def parse_content_encoding(value):
+    """Return the content codings in the order they were applied from the value of the Content-Encoding header"""
+    if value is None:
+        return []
+    return [coding for coding in (c.strip().lower() for c in value.split(',')) if coding not in {'', 'identity'}]
+
+
+class ContentDecoder:
+    """Remove the content codings (e.g. gzip, br) from the payload chunk-by-chunk"""
+    def __init__(self, codings):
+        self._decoders = [DECODERS[coding]() for coding in reversed(codings)]
+
+    def decompress(self, data):
+        try:
+            for decoder in self._decoders:
+                data = decoder.decompress(data)
+        except Exception as err:  # zlib.error or brotli.error
+            raise ContentDecodingError('Can not remove the content coding: {0}'.format(err)) from err
+        return data
+
+    def flush(self):
+        data = b''
+        try:
+            for decoder in self._decoders:
+                data = decoder.decompress(data) + decoder.flush()
+        except Exception as err:  # zlib.error or brotli.error
+            raise ContentDecodingError('Can not remove the content coding: {0}'.format(err)) from err
+        return data
+
+
+def new_content_decoder(content_encoding):
+    """
+        Return a ContentDecoder for the value of the Content-Encoding header
+         or None if the payload has no content coding or it is not supported (the payload is used as is)
+    """
+    codings = parse_content_encoding(content_encoding)
+    if len(codings) == 0 or any(coding not in DECODERS for coding in codings):
+        return None
+    return ContentDecoder(codings)
+
+
+def decode_content(data, content_encoding):
+    """Remove the content codings from the whole payload (the payload is returned as is if it is not supported)"""
+    decoder = new_content_decoder(content_encoding)
+    if decoder is None:
+        return data
+    return decoder.decompress(data) + decoder.flush()
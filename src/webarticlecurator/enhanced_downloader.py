@@ -5,10 +5,21 @@
 
 import os
 import sys
-from io import BytesIO
-from collections import Counter
+import json
+import zlib
+from codecs import getincrementaldecoder
+from tempfile import SpooledTemporaryFile
+from mmap import mmap, ACCESS_READ
+from functools import partial
+from collections import Counter, defaultdict
+from itertools import repeat, chain, zip_longest
+from time import monotonic
+from threading import Lock, local
+from multiprocessing import Pool, Manager
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, quote, urlunparse
 
+from warcio.utils import Digester
 from warcio.warcwriter import WARCWriter
 from warcio.exceptions import ArchiveLoadFailed
 from warcio.archiveiterator import ArchiveIterator
@@ -20,11 +31,31 @@ from requests.exceptions import RequestException
 from urllib3 import disable_warnings
 from urllib3.exceptions import ProtocolError, InsecureRequestWarning, LocationParseError
 
-from chardet import detect
-from ratelimit import limits, sleep_and_retry
+from .cdxj_index import CDXJIndex
+from .charset_detector import CharsetDetector, METHOD_HTTP_HEADER
+from .content_encoding import ACCEPT_ENCODING, ContentDecodingError, new_content_decoder, decode_content
+from .rate_limiter import HostRateLimiter, SharedHostRateLimiter, parse_retry_after, parse_crawl_delay
+from .compact_index import CompactURLIndex
+from .utils import expand_warc_filenames, warc_segment_sort_key
 
 respv_str = {10: '1.0', 11: '1.1'}
 
+# The magic bytes of gzip members (every record is a separate gzip member in .warc.gz files)
+GZIP_MAGIC = b'\x1f\x8b'
+
+# The format version of the index file written next to the WARC files (bump on incompatible changes)
+INDEX_FILE_VERSION = 3
+
+# Downloaded payloads larger than this (in bytes) are spooled to a temporary file instead of memory
+SPOOL_MAX_SIZE = 1024 * 1024
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+# Longer Retry-After delays (in seconds) are not waited for, the download fails instead
+MAX_RETRY_AFTER = 600
+
+# The WARC-Profile of the revisit records written on HTTP 304 Not Modified (the default is identical-payload-digest)
+REVISIT_PROFILE_NOT_MODIFIED = 'http://netpreserve.org/warc/1.1/revisit/server-not-modified'
+
 # Patch get_encoding_from_headers in requests
 
 
@@ -93,31 +124,88 @@ class WarcCachingDownloader:
     def __init__(self, existing_warc_filenames, new_warc_filename, _logger, just_cache=False, download_params=None):
         self._logger = _logger
         if download_params is not None:
+            download_params = dict(download_params)  # Do not modify the caller's dict (it may be shared)
             strict_mode = download_params.pop('strict_mode', False)
             check_digest = download_params.pop('check_digest', False)
+            use_index_file = download_params.pop('use_index_file', True)
+            index_jobs = download_params.pop('index_jobs', None)
+            compact_index = download_params.pop('compact_index', False)
+            use_mmap = download_params.pop('use_mmap', False)
+            download_engine = download_params.pop('download_engine', 'requests')
         else:
             strict_mode = False
             check_digest = False
+            use_index_file = True
+            index_jobs = None
+            compact_index = False
+            use_mmap = False
+            download_engine = 'requests'
             download_params = {}
 
-        self.url_index = set()
+        self._cached_downloads = []
         info_record_data = None
         if existing_warc_filenames is not None:  # Setup the supplied existing warc archive file as cache
             if isinstance(existing_warc_filenames, str):  # Transform it to list
                 existing_warc_filenames = [existing_warc_filenames]
-            self._cached_downloads = []
-            for ex_warc_filename in existing_warc_filenames:
-                cached_downloads = WarcReader(ex_warc_filename, _logger, strict_mode, check_digest)
+            # Directories and glob patterns (e.g. the segments of a rotated WARC file)
+            existing_warc_filenames = expand_warc_filenames(existing_warc_filenames)
+            # The order of the readers must be kept as the last WARC wins when an URL is in more than one WARC
+            for ex_warc_filename, preloaded_index in \
+                    zip(existing_warc_filenames, self._preload_indices(existing_warc_filenames, strict_mode,
+                                                                       check_digest, use_index_file, compact_index,
+                                                                       index_jobs)):
+                cached_downloads = WarcReader(ex_warc_filename, _logger, strict_mode, check_digest, use_index_file,
+                                              compact_index, preloaded_index, use_mmap=use_mmap)
+                # The original captures of the revisit records are searched in the previous WARC files
+                cached_downloads.revisit_resolver = partial(self._resolve_revisit, len(self._cached_downloads))
                 self._cached_downloads.append(cached_downloads)
-                self.url_index |= cached_downloads.url_index
                 info_record_data = cached_downloads.info_record_data
+        # Built once: URL -> the records from the last source WARC where the URL is found in
+        self.url_index = MergedURLIndex(self._cached_downloads)
 
         if just_cache:
             self._new_downloads = WarcDummyDownloader()
-        else:
+        elif download_engine == 'async':
+            from .async_downloader import AsyncWarcDownloader  # Optional dependency (aiohttp)
+            self._new_downloads = AsyncWarcDownloader(new_warc_filename, _logger, info_record_data, **download_params)
+        elif download_engine == 'requests':
+            download_params.pop('max_concurrency_per_host', None)  # Requests are sent one by one
             self._new_downloads = WarcDownloader(new_warc_filename, _logger, info_record_data, **download_params)
+        else:
+            raise ValueError('Unknown download engine: {0}'.format(download_engine))
 
-    def download_url(self, url, ignore_cache=False, return_warc_records_wo_writing=False):
+    def _preload_indices(self, existing_warc_filenames, strict_mode, check_digest, use_index_file, compact_index,
+                         index_jobs):
+        """
+            Create the URL index for the WARC files which must be scanned in parallel (index_jobs processes,
+             0 for all CPUs, default 1: no parallel indexing) and return them in the original order
+             (None for the files which should be indexed in this process, e.g. the ones with an index file)
+        """
+        if index_jobs is None:
+            index_jobs = 1
+        elif index_jobs == 0:
+            index_jobs = os.cpu_count() or 1
+        to_scan = [filename for filename in existing_warc_filenames
+                   if not use_index_file or check_digest or not WarcReader.has_index_file(filename)]
+        index_jobs = min(index_jobs, len(to_scan))
+        if index_jobs <= 1:
+            return [None] * len(existing_warc_filenames)
+
+        self._logger.log('INFO', 'Creating index for', len(to_scan), 'WARC files in', index_jobs, 'processes...')
+        with Manager() as man:
+            log_queue = man.Queue()
+            with self._logger.init_mp_logging_context(log_queue) as mplogger, Pool(index_jobs) as pool:
+                preloaded_indices = pool.map(_create_warc_reader_index,
+                                             zip(to_scan, repeat(strict_mode), repeat(check_digest),
+                                                 repeat(use_index_file), repeat(compact_index), repeat(mplogger)))
+        preloaded_indices = dict(zip(to_scan, preloaded_indices))
+        return [preloaded_indices.get(filename) for filename in existing_warc_filenames]
+
+    def download_url(self, url, ignore_cache=False, return_warc_records_wo_writing=False, lazy=False):
+        """
+            Return the decoded text of the URL from the cache or by downloading it (or the WarcResponse with lazy=True,
+             which is decoded only when its text is accessed) or None
+        """
         # 1) Check if the URL is explicitly marked as bad...
         if url in self._new_downloads.bad_urls:
             self._logger.log('WARNING', url, 'Skipping URL explicitly marked as bad!', sep='\t')
@@ -130,42 +218,131 @@ class WarcCachingDownloader:
         # 3) Check if the URL presents in the cached_content...
         elif url in self.url_index:
             # 3a) ...retrieve it! (from the last source WARC where the URL is found in)
-            cache, reqv, resp = self.get_records_offset(url)
-            # 3b) Get content even if the URL is a duplicate, because ignore_cache knows better what to do with it
-            cached_content = cache.download_url(url)
-            # 3c) Decide to return the records with the content XOR write the records and return the content only
+            cached = self.get_records_offset(url)
+            # 3b) If we explicitly ignore the cache, download the URL conditionally
+            #     (the unchanged page is stored as a revisit record which refers to the cached one)
+            if ignore_cache:
+                self._logger.log('INFO', 'Ignoring cached_content for URL:', url)
+                return self._new_downloads.download_url(url, return_warc_records_wo_writing, lazy, cached=cached)
+            # 3c) Get content (decoded when needed)
+            cached_content = CachedResponse(url, cached)
+            if not lazy:
+                cached_content = cached_content.text
+            # 3d) Decide to return the records with the content XOR write the records and return the content only
             if return_warc_records_wo_writing:
-                cached_content = ((cache, reqv, resp), cached_content)
+                return cached, cached_content
             else:
-                self._new_downloads.write_records_for_url(url, (cache, reqv, resp))
-        else:
-            cached_content = None
-
-        # 4) If we have the URL cached...
-        if cached_content is not None:
-            if not ignore_cache:
-                # 4a) and we do not explicitly ignore the cache, return the cached content!
+                self._new_downloads.write_records_for_url(url, cached)
                 return cached_content
-            else:
-                # 4b) Log that we ignored the cached_content and do noting!
-                self._logger.log('INFO', 'Ignoring cached_content for URL:', url)
 
-        # 5) Really download the URL! (url not in cached_content or cached_content is ignored)
+        # 4) Really download the URL! (url not in cached_content)
         #    Still check if the URL is already downloaded!
-        return self._new_downloads.download_url(url, return_warc_records_wo_writing)
+        return self._new_downloads.download_url(url, return_warc_records_wo_writing, lazy)
+
+    def download_urls(self, urls, ignore_cache=False, return_warc_records_wo_writing=False, lazy=False,
+                      speculative_urls=()):
+        """
+            Batch version of download_url(): the URLs which are not in the cache (or all of them with ignore_cache,
+             conditionally as in download_url()) are downloaded concurrently (if the downloader supports it)
+             and the records are written in the order of the URLs
+            The failed downloads of the speculative URLs (which may not exist) are not counted as errors
+        """
+        return list(self.iter_download_urls(urls, ignore_cache, return_warc_records_wo_writing, lazy,
+                                            speculative_urls))
+
+    def iter_download_urls(self, urls, ignore_cache=False, return_warc_records_wo_writing=False, lazy=False,
+                           speculative_urls=()):
+        """
+            Generator version of download_urls(): the result of an URL is generated as soon as it (and the ones
+             before it) is downloaded, while the following URLs are still downloading
+        """
+        urls = list(urls)
+        # The URLs which are bad, duplicate or cached (unless ignore_cache) are handled by download_url() as usual
+        to_download = [url for url in dict.fromkeys(urls)
+                       if url not in self._new_downloads.bad_urls and url not in self._new_downloads.good_urls and
+                       (ignore_cache or url not in self.url_index)]
+        downloaded = None
+        if len(to_download) > 0:
+            cached = {}
+            if ignore_cache:
+                for url in to_download:
+                    if url in self.url_index:
+                        self._logger.log('INFO', 'Ignoring cached_content for URL:', url)
+                        cached[url] = self.get_records_offset(url)
+            downloaded = self._new_downloads.iter_download_urls(to_download, return_warc_records_wo_writing=True,
+                                                                lazy=lazy, cached=cached)
+        # Until their downloads are finished (the downloader threads check it)
+        speculative_urls = set(speculative_urls).intersection(to_download)
+        self._new_downloads.speculative_urls |= speculative_urls
+        to_download = set(to_download)
+        try:
+            for url in urls:
+                if url not in to_download:
+                    yield self.download_url(url, ignore_cache, return_warc_records_wo_writing, lazy)
+                    continue
+                to_download.remove(url)
+                records_and_text = next(downloaded)
+                self._new_downloads.speculative_urls.discard(url)
+                if records_and_text is not None and not return_warc_records_wo_writing:
+                    rec, records_and_text = records_and_text
+                    self._new_downloads.write_records_for_url(url, rec)
+                yield records_and_text
+        finally:
+            self._new_downloads.speculative_urls -= speculative_urls
+            if downloaded is not None:  # Stop the downloads which are not needed anymore
+                downloaded.close()
 
     def write_records_for_url(self, url, rec):
         self._new_downloads.write_records_for_url(url, rec)
 
+    def checkpoint_state(self):
+        """The state of the output WARC file for CrawlCheckpoint (None if there is no output WARC file)"""
+        return self._new_downloads.checkpoint_state()
+
     def get_records_offset(self, url):
-        for cache in reversed(self._cached_downloads):
-            if url in cache.url_index:
-                reqv, resp = cache.get_record_data(url)
-                break
-        else:
+        """Return the reader and the request-response pair of the URL (revisit records are resolved to the original)"""
+        records_offset = self.url_index.get(url)
+        if records_offset is None:
             raise ValueError('INTERNAL ERROR: {0} not found in any supplied source WARC file,'
                              ' but is in the URL index!'.format(url))
-        return cache, reqv, resp
+        cache, reqv, resp = records_offset
+        return cache.resolve_records(reqv, resp)
+
+    def _resolve_revisit(self, reader_no, url, payload_digest):
+        """Return the original capture of a revisit record in the reader_no-th source WARC from the previous ones"""
+        for cache in reversed(self._cached_downloads[:reader_no]):
+            reqv_resp_pair = cache.url_index_get(url)
+            if reqv_resp_pair is not None:
+                reqv, resp = reqv_resp_pair
+                if payload_digest is None or cache.get_payload_digest(resp[0]) == payload_digest:
+                    return cache.resolve_records(reqv, resp)  # It can be a revisit record too
+        return None
+
+    def iter_urls_by_offset(self, urls, readahead=16):
+        """
+            Generate the URLs ordered by source WARC and ascending offset to read the source WARCs sequentially
+             instead of seeking randomly (URLs which are not in the cache are generated at the end alphabetically)
+            The kernel is advised to read the records of the next readahead URLs in advance
+        """
+        reader_nos = {id(reader): reader_no for reader_no, reader in enumerate(self._cached_downloads)}
+        cached_urls, not_cached_urls = [], []
+        for url in urls:
+            records_offset = self.url_index.get(url)
+            if records_offset is None:
+                not_cached_urls.append(url)
+            else:
+                cache, (reqv_offset, _), (resp_offset, resp_length) = records_offset
+                cached_urls.append((reader_nos[id(cache)], reqv_offset, resp_offset + resp_length, url))
+        cached_urls.sort()
+
+        for cache in self._cached_downloads:
+            cache.advise_sequential()
+        for i, (_, _, _, url) in enumerate(cached_urls):
+            if i % readahead == 0:
+                for reader_no, start, end, _ in cached_urls[i:i + readahead]:
+                    self._cached_downloads[reader_no].advise_willneed(start, end - start)
+            yield url
+        yield from sorted(not_cached_urls)
 
     def get_records(self, url):
         cache, reqv, resp = self.get_records_offset(url)
@@ -173,6 +350,10 @@ class WarcCachingDownloader:
         resp_rec = cache.get_record(resp[0])
         return cache, reqv_rec, resp_rec
 
+    @property
+    def concurrency(self):  # Ready-only property for shortcut
+        return self._new_downloads.concurrency
+
     @property
     def bad_urls(self):  # Ready-only property for shortcut
         return self._new_downloads.bad_urls
@@ -182,18 +363,94 @@ class WarcCachingDownloader:
         return self._new_downloads.good_urls
 
 
+class MergedURLIndex:
+    """
+        URL index for multiple WarcReaders: URL -> (reader, (reqv_offset, reqv_length), (resp_offset, resp_length))
+         from the last reader (source WARC) where the URL is found in
+
+        The dict-based indices of the readers are merged into one dict at creation time (the URL strings and the offset
+         tuples are shared with the readers, not copied), so lookups cost O(1) regardless of the number of readers.
+        The memory efficient indices (compact, CDXJ) are not loaded into memory, they are queried in reverse order.
+    """
+    def __init__(self, readers):
+        self._readers = readers
+        self._merged_index = {}  # URL -> (reader_no, ((reqv_offset, reqv_length), (resp_offset, resp_length)))
+        self._lazy_reader_nos = []
+        for reader_no, reader in enumerate(readers):
+            if reader.has_dict_index:
+                for url, reqv_resp_pair in reader.index_items():
+                    self._merged_index[url] = (reader_no, reqv_resp_pair)  # The last reader wins
+            else:
+                self._lazy_reader_nos.append(reader_no)
+        self._len = None
+
+    def _get_lazy(self, url, min_reader_no):
+        """Return the reader_no and the records from the last lazy reader after min_reader_no or None"""
+        for reader_no in reversed(self._lazy_reader_nos):
+            if reader_no <= min_reader_no:
+                break
+            reqv_resp_pair = self._readers[reader_no].url_index_get(url)
+            if reqv_resp_pair is not None:
+                return reader_no, reqv_resp_pair
+        return None
+
+    def _get(self, url):
+        hit = self._merged_index.get(url)
+        if len(self._lazy_reader_nos) > 0:
+            hit = self._get_lazy(url, -1 if hit is None else hit[0]) or hit
+        return hit
+
+    def get(self, url, default=None):
+        hit = self._get(url)
+        if hit is None:
+            return default
+        reader_no, (reqv, resp) = hit
+        return self._readers[reader_no], reqv, resp
+
+    def __contains__(self, url):
+        return self._get(url) is not None
+
+    def __iter__(self):
+        yield from self._merged_index.keys()
+        for i, reader_no in enumerate(self._lazy_reader_nos):
+            prev_lazy_readers = [self._readers[prev_reader_no] for prev_reader_no in self._lazy_reader_nos[:i]]
+            for url in self._readers[reader_no].url_index:
+                # Every URL only once: skip the ones which are already yielded
+                if url not in self._merged_index and all(url not in prev_reader.url_index
+                                                         for prev_reader in prev_lazy_readers):
+                    yield url
+
+    def __len__(self):
+        if len(self._lazy_reader_nos) == 0:
+            return len(self._merged_index)
+        if self._len is None:
+            self._len = sum(1 for _ in self)
+        return self._len
+
+
 class WarcDummyDownloader:
     """
         I.e. When want to use only the cache...
     """
+    concurrency = 1
+
     def __init__(self, *_, **__):
         self.bad_urls = set()
         self.good_urls = set()
+        self.speculative_urls = set()
 
     @staticmethod
     def download_url(*_, **__):
         return None
 
+    @staticmethod
+    def download_urls(urls, *_, **__):
+        return [None for _ in urls]
+
+    @staticmethod
+    def iter_download_urls(urls, *_, **__):
+        return (None for _ in urls)
+
     @staticmethod
     def write_records_for_url(*_, **__):
         return None
@@ -202,96 +459,310 @@ class WarcDummyDownloader:
     def write_record(*_, **__):
         return None
 
+    @staticmethod
+    def checkpoint_state():
+        return None
+
 
 class WarcDownloader:
     """
-        Download URL with HTTP GET, save to a WARC file and return the decoded text
+        Download URL with HTTP GET, save to a WARC file and return the decoded text (or the lazy DownloadedResponse)
     """
     def __init__(self, expected_filename, _logger, warcinfo_record_data=None, program_name='WebArticleCurator',
                  user_agent=None, overwrite_warc=True, err_threshold=10, known_bad_urls=None,
                  max_no_of_calls_in_period=2, limit_period=1, proxy_url=None, allow_cookies=False, verify_request=True,
-                 stay_offline=False, max_retries=3):
+                 stay_offline=False, max_retries=3, raw_copy=True, download_workers=1, burst=None,
+                 honor_retry_after=True, honor_crawl_delay=False, rate_limit_state=None, http_compression=False,
+                 max_warc_size=None, max_warc_records=None, max_warc_age=None, resume_state=None, good_urls=None,
+                 bad_urls=None):
         # Store variables
         self._logger = _logger
-        self._req_headers = {'Accept-Encoding': 'identity', 'User-agent': user_agent}
+        self._raw_copy = raw_copy  # Copy cached records byte-by-byte (gzip members) instead of parsing and rewriting
+        # With HTTP compression the compressed bytes are stored in the WARC file (see PayloadSpool)
+        self._req_headers = {'Accept-Encoding': ACCEPT_ENCODING if http_compression else 'identity',
+                             'User-agent': user_agent}
         self._error_count = 0
+        self._error_lock = Lock()  # The downloader threads count the errors together
         self._error_threshold = err_threshold  # Set the error threshold which cause aborting to prevent denial
         self._max_retries = max_retries
+        self._proxy_url = proxy_url
 
         # Setup download function
         if not stay_offline:
             self.download_url = self._download_url
+            self.iter_download_urls = self._iter_download_urls
         else:
             self.download_url = self._dummy_download_url
+            self.iter_download_urls = self._dummy_iter_download_urls
 
+        # The URL sets can be supplied (e.g. the views of UrlStateStore) else they are kept in memory
+        self._own_good_urls = good_urls is None
+        if bad_urls is None:
+            bad_urls = set()
+        self.bad_urls = bad_urls
         if known_bad_urls is not None:  # Setup the list of cached bad URLs to prevent trying to download them again
             with open(known_bad_urls, encoding='UTF-8') as fh:
-                self.bad_urls = {line.strip() for line in fh}
+                self.bad_urls.update(line.strip() for line in fh)
+
+        if good_urls is None:
+            good_urls = set()
+        self.good_urls = good_urls
+        self.speculative_urls = set()  # Their failed downloads are not errors (e.g. the pages after the last one)
+
+        # Setup target file handle (rotated to numbered segments if any of the limits is set)
+        self._expected_filename = expected_filename
+        self._overwrite_warc = overwrite_warc
+        self._max_warc_size = max_warc_size
+        self._max_warc_records = max_warc_records
+        self._max_warc_age = max_warc_age
+        self._rotate = any(limit is not None for limit in (max_warc_size, max_warc_records, max_warc_age))
+        self._segment_num = 0
+        self.warc_filenames = []
+
+        # Setup sessions for speeding up downloads: Session is not thread-safe, so each downloader thread has its own
+        #  (see _session), but the allowed cookies are shared (the cookie jar is thread-safe)
+        self._thread_local = local()
+        self._cookie_jar = Session().cookies
+        self._download_workers = download_workers
+        if download_workers > 1:  # Concurrent downloading
+            self._executor = ThreadPoolExecutor(download_workers, thread_name_prefix='WarcDownloader')
         else:
-            self.bad_urls = set()
-
-        self.good_urls = set()
-
-        # Setup target file handle
-        filename = self._set_target_filename(expected_filename, overwrite_warc)
-        self._logger.log('INFO', 'Creating archivefile:', filename)
-        self._output_file = open(filename, 'wb')
-
-        self._session = Session()  # Setup session for speeding up downloads
-        if proxy_url is not None:  # Set socks proxy if provided
-            self._session.proxies['http'] = proxy_url
-            self._session.proxies['https'] = proxy_url
+            self._executor = None
 
         self._allow_cookies = allow_cookies
         self._verify_request = verify_request
         if not self._verify_request:
             disable_warnings(InsecureRequestWarning)
 
-        # Setup rate limiting to prevent hammering the server
-        self._requests_get = sleep_and_retry(limits(calls=max_no_of_calls_in_period,
-                                                    period=limit_period)(self._http_get_w_cookie_handling))
+        # Setup rate limiting (per host) to prevent hammering the server
+        if rate_limit_state is not None:  # Shared with the other processes using the same state file
+            self._rate_limiter = SharedHostRateLimiter(rate_limit_state, max_no_of_calls_in_period, limit_period,
+                                                       burst)
+        else:
+            self._rate_limiter = HostRateLimiter(max_no_of_calls_in_period, limit_period, burst)
+        self._honor_retry_after = honor_retry_after
+        self._honor_crawl_delay = honor_crawl_delay
+        self._robots_checked_hosts = set()
+        self._robots_host_locks = defaultdict(Lock)  # Only the threads of the host wait for its robots.txt
+        self._robots_lock = Lock()  # Guards _robots_host_locks
 
-        self._writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
         if warcinfo_record_data is None:  # Or use the parsed else custom headers will not be copied
             # INFO RECORD
             # Some custom information about the warc writer program and its settings
             warcinfo_record_data = {'software': program_name, 'arguments': ' '.join(sys.argv[1:]),
                                     'format': 'WARC File Format 1.1',
                                     'conformsTo': 'http://bibnum.bnf.fr/WARC/WARC_ISO_28500_version1-1_latestdraft.pdf'}
-        info_record = self._writer.create_warcinfo_record(filename, warcinfo_record_data)
+        self._warcinfo_record_data = warcinfo_record_data
+        if resume_state is not None:  # Continue the WARC file of the interrupted crawl (see checkpoint_state())
+            self._resume_warc_file(resume_state)
+        else:
+            self._open_warc_file()
+
+    def _open_warc_file(self):
+        """Open the next WARC file (segment) and write its warcinfo record"""
+        if self._rotate:
+            filename = self._next_segment_filename()
+        else:
+            filename = self._set_target_filename(self._expected_filename, self._overwrite_warc)
+        self._logger.log('INFO', 'Creating archivefile:', filename)
+        self._output_file = open(filename, 'wb')
+        self.warc_filenames.append(filename)
+        self._segment_records = 0
+        self._segment_started = monotonic()
+
+        self._writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
+        info_record = self._writer.create_warcinfo_record(filename, self._warcinfo_record_data)
         self._writer.write_record(info_record)
 
+    def _resume_warc_file(self, state):
+        """
+            Truncate the WARC file (segment) of the checkpoint to its last complete record (the checkpoint's offset)
+             and append to it (the segments created after the checkpoint are removed)
+        """
+        filename, offset = state['filename'], state['offset']
+        self._logger.log('INFO', 'Resuming archivefile:', filename, 'at offset', offset)
+        self._output_file = open(filename, 'r+b')
+        if os.fstat(self._output_file.fileno()).st_size < offset:
+            self._output_file.close()
+            raise ValueError('The WARC file is shorter than at the checkpoint: {0}'.format(filename))
+        self._output_file.truncate(offset)  # The records written after the checkpoint are downloaded again
+        self._output_file.seek(offset)
+        self.warc_filenames = state['warc_filenames']
+        if self._own_good_urls:  # Else they are already restored (e.g. by UrlStateStore)
+            self.good_urls = set(state['good_urls'])
+        self._error_count = state['error_count']
+        self._segment_num = state['segment_num']
+        self._segment_records = state['segment_records']
+        self._segment_started = monotonic() - state['segment_age']
+        self._writer = WARCWriter(self._output_file, gzip=True, warc_version='WARC/1.1')
+
+        if self._rotate:  # The segments from segment_num are written after the checkpoint
+            if self._overwrite_warc:  # Rotation overwrites the segments contiguously
+                to_remove = []
+                num = self._segment_num
+                filename = self._numbered_filename(self._expected_filename, num)
+                while os.path.exists(filename):
+                    to_remove.append(filename)
+                    num += 1
+                    filename = self._numbered_filename(self._expected_filename, num)
+            else:  # Rotation skips the segments which existed at the checkpoint (e.g. from other crawls)
+                existing_segments = set(state['existing_segments'])
+                to_remove = [filename for num, filename in self._existing_segments(self._segment_num).items()
+                             if num not in existing_segments]
+            for filename in to_remove:
+                self._logger.log('WARNING', 'Removing segment created after the checkpoint:', filename)
+                os.remove(filename)
+
+    def _existing_segments(self, min_num):
+        """Return the existing numbered segments of the WARC file from min_num (number -> filename)"""
+        base, ext, _ = warc_segment_sort_key(self._expected_filename)
+        dirname = os.path.dirname(self._expected_filename)
+        segments = {}
+        for filename in os.listdir(dirname or os.curdir):
+            filename = os.path.join(dirname, filename)
+            filename_base, filename_ext, num = warc_segment_sort_key(filename)
+            if filename_base == base and filename_ext == ext and num >= min_num:
+                segments[num] = filename
+        return segments
+
+    def checkpoint_state(self):
+        """Sync the WARC file and return the state needed to resume writing it (see CrawlCheckpoint)"""
+        self._output_file.flush()
+        os.fsync(self._output_file.fileno())
+        return {'filename': self.warc_filenames[-1], 'offset': self._output_file.tell(),
+                'warc_filenames': self.warc_filenames,
+                'good_urls': list(self.good_urls) if self._own_good_urls else None,
+                'error_count': self._error_count, 'segment_num': self._segment_num,
+                'segment_records': self._segment_records, 'segment_age': monotonic() - self._segment_started,
+                'existing_segments': sorted(self._existing_segments(self._segment_num))
+                if self._rotate and not self._overwrite_warc else None}
+
+    def _next_segment_filename(self):
+        """Return the next numbered segment filename (the existing ones are skipped unless overwrite_warc is set)"""
+        while True:
+            filename = self._numbered_filename(self._expected_filename, self._segment_num)
+            self._segment_num += 1
+            if self._overwrite_warc or not os.path.exists(filename):
+                return filename
+
+    def _rotate_if_needed(self):
+        """Continue in a new segment if the current one reached any of the limits (called before writing a pair)"""
+        if not self._rotate or self._segment_records == 0:
+            return
+        if (self._max_warc_size is not None and self._output_file.tell() >= self._max_warc_size) or \
+                (self._max_warc_records is not None and self._segment_records >= self._max_warc_records) or \
+                (self._max_warc_age is not None and monotonic() - self._segment_started >= self._max_warc_age):
+            self._output_file.close()
+            self._open_warc_file()
+
     @staticmethod
-    def _set_target_filename(filename, overwrite_warc):
+    def _numbered_filename(filename, num):
+        """filename.warc.gz -> filename-num.warc.gz (with five digits)"""
+        filename2, ext = os.path.splitext(filename)  # Should be filename.warc.gz
+        if ext == '.gz' and filename2.endswith('.warc'):
+            filename2, ext2 = os.path.splitext(filename2)  # Should be filename.warc
+            ext = ext2 + ext  # Should be .warc.gz
+        return '{0}-{1:05d}{2}'.format(filename2, num, ext)
+
+    @classmethod
+    def _set_target_filename(cls, filename, overwrite_warc):
         if not overwrite_warc:  # Find out next nonexisting warc filename
             num = 0
-            while os.path.exists(filename):
-                filename2, ext = os.path.splitext(filename)  # Should be filename.warc.gz
-                if ext == '.gz' and filename2.endswith('.warc'):
-                    filename2, ext2 = os.path.splitext(filename2)  # Should be filename.warc
-                    ext = ext2 + ext  # Should be .warc.gz
-
-                filename = '{0}-{1:05d}{2}'.format(filename2, num, ext)
+            target_filename = filename
+            while os.path.exists(target_filename):
+                target_filename = cls._numbered_filename(filename, num)
                 num += 1
+            filename = target_filename
         return filename
 
     def __del__(self):
+        if getattr(self, '_executor', None) is not None:
+            self._executor.shutdown(wait=False)
         if hasattr(self, '_output_file'):  # If the program opened a file, then it should gracefully close it on exit!
             self._output_file.close()
 
+    @property
+    def concurrency(self):  # Ready-only property for shortcut
+        """The number of URLs worth supplying to download_urls() at once"""
+        return self._download_workers
+
+    @property
+    def _session(self):
+        """The Session of the calling thread (created on first use)"""
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = Session()
+            if self._allow_cookies:
+                session.cookies = self._cookie_jar
+            if self._proxy_url is not None:  # Set socks proxy if provided
+                session.proxies['http'] = self._proxy_url
+                session.proxies['https'] = self._proxy_url
+            self._thread_local.session = session
+        return session
+
     def _http_get_w_cookie_handling(self, *args, **kwargs):
         """
-            Extend requests.get with optional cookie purging
+            Extend requests.get with optional cookie purging (the cookies of the session of the calling thread)
         """
         if not self._allow_cookies:
             self._session.cookies.clear()
         return self._session.get(*args, **kwargs)
 
+    def _requests_get(self, url, *args, **kwargs):
+        """
+            Wait for the rate limit of the host and GET the URL (the requests to the other hosts are not blocked)
+        """
+        scheme, netloc = urlparse(url)[:2]
+        if self._honor_crawl_delay:
+            with self._robots_lock:
+                host_lock = self._robots_host_locks[netloc]
+            with host_lock:  # The other threads of the host must wait for its Crawl-delay
+                if netloc not in self._robots_checked_hosts:
+                    self._robots_checked_hosts.add(netloc)
+                    crawl_delay = self._get_crawl_delay(scheme, netloc, kwargs.get('verify', True))
+                    if crawl_delay is not None:
+                        self._rate_limiter.set_crawl_delay(netloc, crawl_delay)
+        self._rate_limiter.wait(netloc)
+        return self._http_get_w_cookie_handling(url, *args, **kwargs)
+
+    def _get_crawl_delay(self, scheme, netloc, verify):
+        """Download robots.txt of the host and return its Crawl-delay or None"""
+        self._rate_limiter.wait(netloc)
+        try:
+            resp = self._http_get_w_cookie_handling('{0}://{1}/robots.txt'.format(scheme, netloc),
+                                                    headers=self._req_headers, verify=verify)
+        except RequestException as err:
+            self._logger.log('WARNING', netloc, f'Could not download robots.txt: {err}', sep='\t')
+            return None
+        if resp.status_code != 200:
+            return None
+        crawl_delay = parse_crawl_delay(resp.text, self._req_headers['User-agent'])
+        if crawl_delay is not None:
+            self._logger.log('INFO', netloc, f'Using Crawl-delay from robots.txt: {crawl_delay}', sep='\t')
+        return crawl_delay
+
+    def _get_retry_after(self, url, status_code, headers):
+        """Return the delay requested by the server (429 or 503 with Retry-After) if it is honored else None"""
+        if not self._honor_retry_after or status_code not in {429, 503}:
+            return None
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after is None or retry_after > MAX_RETRY_AFTER:
+            return None
+        self._logger.log('WARNING', url, f'Server asked to retry after {retry_after:.0f} seconds ({status_code})',
+                         sep='\t')
+        return retry_after
+
     def _handle_request_exception(self, url, msg):
+        if url in self.speculative_urls:
+            self._logger.log('DEBUG', url, msg, sep='\t')
+            return
+
         self._logger.log('WARNING', url, msg, sep='\t')
 
-        self._error_count += 1
-        if self._error_count >= self._error_threshold:
+        with self._error_lock:
+            self._error_count += 1
+            error_count = self._error_count
+        if error_count >= self._error_threshold:
             raise NameError('Too many error happened! Threshold exceeded! See log for details!')
 
     @staticmethod
@@ -315,24 +786,121 @@ class WarcDownloader:
     def _dummy_download_url(self, *_, **__):
         raise NotImplementedError
 
-    def _download_url(self, url, return_warc_records_wo_writing=False):
+    def _dummy_iter_download_urls(self, urls, *_, **__):
+        """Offline the URLs which are not in the cache are not downloaded (see WarcCachingDownloader.download_urls())"""
+        for url in urls:
+            self._logger.log('WARNING', url, 'Not downloading URL, because staying offline!', sep='\t')
+            yield None
+
+    def _is_new_url(self, url):
         if url in self.bad_urls:
             self._logger.log('DEBUG', 'Not downloading known bad URL:', url)
-            return None
+            return False
 
         if url in self.good_urls:  # This should not happen!
             self._logger.log('ERROR', 'Not downloading URL, because it is already downloaded in this session:', url)
-            return None
+            return False
+        return True
 
+    @staticmethod
+    def _reparse_url(url):
+        """Return the urlencoded URL for downloading, the netloc and the request target for the WARC request record"""
         scheme, netloc, path, params, query, fragment = urlparse(url)
         # For safety urlencode the generated URL... (The URL might be modified in this step.)
         path = quote(path, safe='/%')
         url_reparsed = urlunparse((scheme, netloc, path, params, query, fragment))
+        return url_reparsed, netloc, urlunparse(('', '', path, params, query, fragment))
+
+    def _download_url(self, url, return_warc_records_wo_writing=False, lazy=False, cached=None):
+        """
+            Download the URL and write its records (or return them with return_warc_records_wo_writing)
+             and return the decoded text (or the WarcResponse with lazy=True) or None if the download failed
+            With the cached records (reader, reqv, resp) of the URL the download is conditional
+             and a revisit record is written instead of the response if the page is not changed (see _fetch_records())
+        """
+        if not self._is_new_url(url):
+            return None
+
+        revisit_of = self._read_revisit_info(cached)  # In the calling thread as the readers are not thread-safe
+        return self._commit_records(url, self._fetch_records(url, revisit_of), return_warc_records_wo_writing, lazy)
+
+    @staticmethod
+    def _read_revisit_info(cached):
+        """
+            Return the cached records with the WARC headers of the cached response and the conditional request headers
+             (If-None-Match and If-Modified-Since from its ETag and Last-Modified headers) or None
+        """
+        if cached is None:
+            return None
+        cache, _, (resp_offset, _) = cached
+        resp_record = cache.get_record(resp_offset)
+        conditional_headers = {}
+        if resp_record.http_headers is not None:
+            for resp_header, reqv_header in (('ETag', 'If-None-Match'), ('Last-Modified', 'If-Modified-Since')):
+                value = resp_record.http_headers.get_header(resp_header)
+                if value is not None:
+                    conditional_headers[reqv_header] = value
+        return cached, resp_record.rec_headers, conditional_headers
+
+    def download_urls(self, urls, return_warc_records_wo_writing=False, lazy=False, cached=None):
+        """
+            Download the URLs on the thread pool (download_workers threads) and return the results
+             (as download_url() would) in the order of the URLs
+            The records are committed to the WARC file only by the calling thread in the order of the URLs
+             (not in the order the downloads finish) to keep the WARC file and good_urls deterministic
+            The URLs with cached records (URL -> (reader, reqv, resp)) are downloaded conditionally
+             (see _download_url())
+        """
+        return list(self.iter_download_urls(urls, return_warc_records_wo_writing, lazy, cached))
+
+    def _iter_download_urls(self, urls, return_warc_records_wo_writing=False, lazy=False, cached=None):
+        """
+            Generator version of download_urls(): the result of an URL is committed and generated as soon as
+             it (and the ones before it) is downloaded, while the following URLs are still downloading
+        """
+        urls = list(urls)
+        new_urls = [url for url in dict.fromkeys(urls) if self._is_new_url(url)]
+        # In the calling thread as the readers are not thread-safe
+        revisits_of = {url: self._read_revisit_info(records) for url, records in (cached or {}).items()}
+        futures = {}
+        if self._executor is not None:
+            # Submit the URLs of the hosts alternately to keep the workers busy while a host is rate limited
+            urls_by_host = defaultdict(list)
+            for url in new_urls:
+                urls_by_host[urlparse(url).netloc].append(url)
+            futures = {url: self._executor.submit(self._fetch_records, url, revisits_of.get(url))
+                       for url in chain.from_iterable(zip_longest(*urls_by_host.values())) if url is not None}
+            fetched = (futures[url].result() for url in new_urls)
+        else:
+            fetched = (self._fetch_records(url, revisits_of.get(url)) for url in new_urls)
+        new_urls = set(new_urls)
+        try:
+            # The downloads go on while the finished ones are committed
+            for url in urls:
+                if url not in new_urls:  # Duplicates are not returned again
+                    yield None
+                    continue
+                new_urls.remove(url)
+                yield self._commit_records(url, next(fetched), return_warc_records_wo_writing, lazy)
+        finally:  # The downloads which are not started yet are not needed anymore
+            for future in futures.values():
+                future.cancel()
+
+    def _fetch_records(self, url, revisit_of=None):
+        """
+            Download the URL and return the WARC records and the response or None (thread-safe, does not write)
+            With revisit_of (see _read_revisit_info()) the request is conditional and a revisit record is created
+             instead of the response record on HTTP 304 Not Modified or when the payload digest is unchanged
+        """
+        url_reparsed, netloc, request_target = self._reparse_url(url)
+        req_headers = self._req_headers
+        if revisit_of is not None:
+            req_headers = dict(req_headers, **revisit_of[2])
 
         # Try to resolve network errors with retries
         for i in range(1, self._max_retries+1):
             try:  # The actual request (on the reparsed URL, everything else is made on the original URL)
-                resp = self._requests_get(url_reparsed, headers=self._req_headers, stream=True,
+                resp = self._requests_get(url_reparsed, headers=req_headers, stream=True,
                                           verify=self._verify_request)
             except RequestException as err:
                 self._handle_request_exception(url, f'RequestException happened during downloading: {err} \n\n'
@@ -345,8 +913,12 @@ class WarcDownloader:
                 return None
 
             if resp is not None:
-                if resp.status_code == 200:
+                if resp.status_code == 200 or (resp.status_code == 304 and revisit_of is not None):
                     break
+                retry_after = self._get_retry_after(url, resp.status_code, resp.headers)
+                if retry_after is not None:  # Retry if there is retries left (after the server allows it)...
+                    resp.close()
+                    self._rate_limiter.pause(netloc, retry_after)
                 else:  # Not HTTP 200 OK
                     self._handle_request_exception(url, f'Downloading failed with status code: {resp.status_code} '
                                                         f'{resp.reason}')
@@ -361,9 +933,6 @@ class WarcDownloader:
         reqv_headers['Host'] = netloc
 
         proto = 'HTTP/{0}'.format(respv_str[resp.raw.version])  # Friendly protocol name
-        reqv_http_headers = StatusAndHeaders('GET {0} {1}'.format(urlunparse(('', '', path, params, query, fragment)),
-                                                                  proto), reqv_headers.items(), is_http_request=True)
-        reqv_record = self._writer.create_warc_record(url, 'request', http_headers=reqv_http_headers)
 
         # RESPONSE
         # resp_status need to be stripped else warcio strips the spaces and digest verification will fail!
@@ -372,83 +941,428 @@ class WarcDownloader:
         # Must get peer_name before the content is read
         peer_name = self._get_peer_name(resp)
 
-        try:
-            data = resp.raw.read()  # To be able to return decoded and also write warc
-        except ProtocolError as err:
-            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
-                                                ' The program ignores it and jumps to the next one.'.format(err))
-            return None
+        if resp.status_code == 304:  # Not Modified
+            resp.close()
+            return self._create_not_modified_records(url, request_target, proto, reqv_headers.items(), peer_name,
+                                                     resp_status, resp_headers_list, revisit_of)
 
-        if len(data) == 0:
-            err = 'Response data has zero length!'
+        payload = self._new_payload_spool(proto, resp_status, resp_headers_list, resp.headers)
+        try:  # To be able to return decoded and also write warc without holding more than one copy of the data
+            for chunk in resp.raw.stream(SPOOL_CHUNK_SIZE, decode_content=False):
+                payload.write(chunk)
+        except ProtocolError as err:
+            payload.close()
             self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
                                                 ' The program ignores it and jumps to the next one.'.format(err))
             return None
 
-        # warcio hack as \r\n is the record separator and trailing ones will be split and digest will eventually fail!
-        if data.endswith(b'\r\n'):  # TODO: Warcio bugreport!
-            data = data.rstrip()
+        return self._create_records(url, request_target, proto, reqv_headers.items(), peer_name, payload, revisit_of)
 
-        # Get or detect encoding to decode the bytes of the text to str
-        enc = patched_get_encoding_from_headers(resp.headers)
-        if enc is None:
-            enc = detect(data)['encoding']
-        try:
-            text = data.decode(enc)  # Normal decode process
-        except UnicodeDecodeError:
-            self._logger.log('WARNING', 'DECODE ERROR RETRYING IN \'IGNORE\' MODE:', url, enc, sep='\t')
-            text = data.decode(enc, 'ignore')
-        data_stream = BytesIO(data)  # Need the original byte stream to write the payload to the warc file
+    def _commit_records(self, url, records_and_response, return_warc_records_wo_writing, lazy):
+        if records_and_response is None:
+            return None
 
-        resp_http_headers = StatusAndHeaders(resp_status, resp_headers_list, protocol=proto)
-        # Add extra headers like encoding because it is not stored any other way...
-        resp_record = self._writer.create_warc_record(url, 'response', payload=data_stream,
-                                                      http_headers=resp_http_headers,
-                                                      warc_headers_dict={'WARC-IP-Address': peer_name,
-                                                                         'WARC-X-Detected-Encoding': enc})
         # Everything is OK
+        rec, text = records_and_response
+        if not lazy:
+            text = text.text  # Backward compatible str return
         if return_warc_records_wo_writing:
             # Return the WARC records and the text content
-            return (None, reqv_record, resp_record), text
+            return rec, text
         else:
             # Write the two WARC records and return the text content only
-            self.write_records_for_url(url, (None, reqv_record, resp_record))
+            self.write_records_for_url(url, rec)
 
             return text
 
+    def _new_payload_spool(self, proto, resp_status, resp_headers_list, resp_headers):
+        """Create the spool for the payload of a response (independent of the HTTP client library)"""
+        resp_http_headers = StatusAndHeaders(resp_status, resp_headers_list, protocol=proto)
+        # Get (or detect later) encoding to decode the bytes of the text to str
+        return PayloadSpool(resp_http_headers, self._writer.header_filter,
+                            patched_get_encoding_from_headers(resp_headers), resp_headers.get('Content-Encoding'))
+
+    def _create_request_record(self, url, request_target, proto, reqv_headers_list):
+        reqv_http_headers = StatusAndHeaders('GET {0} {1}'.format(request_target, proto), reqv_headers_list,
+                                             is_http_request=True)
+        return self._writer.create_warc_record(url, 'request', http_headers=reqv_http_headers)
+
+    def _create_revisit_record(self, url, peer_name, http_headers, revisit_of, not_modified):
+        """Create the revisit record which refers to the cached response (revisit_of, see _read_revisit_info())"""
+        _, orig_headers, _ = revisit_of
+        warc_headers_dict = {'WARC-IP-Address': peer_name, 'WARC-Refers-To': orig_headers.get_header('WARC-Record-ID'),
+                             'WARC-X-Detected-Encoding': orig_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')}
+        revisit_record = self._writer.create_revisit_record(url, orig_headers.get_header('WARC-Payload-Digest'),
+                                                            orig_headers.get_header('WARC-Target-URI'),
+                                                            orig_headers.get_header('WARC-Date'),
+                                                            http_headers=http_headers,
+                                                            warc_headers_dict=warc_headers_dict)
+        if not_modified:
+            revisit_record.rec_headers.replace_header('WARC-Profile', REVISIT_PROFILE_NOT_MODIFIED)
+        return revisit_record
+
+    def _create_not_modified_records(self, url, request_target, proto, reqv_headers_list, peer_name, resp_status,
+                                     resp_headers_list, revisit_of):
+        """
+            Create the WARC request-revisit pair for HTTP 304 Not Modified (independent of the HTTP client library)
+             and return them with the CachedResponse of the cached records
+        """
+        reqv_record = self._create_request_record(url, request_target, proto, reqv_headers_list)
+        resp_http_headers = StatusAndHeaders(resp_status, resp_headers_list, protocol=proto)
+        revisit_record = self._create_revisit_record(url, peer_name, resp_http_headers, revisit_of, True)
+        rec = (None, reqv_record, revisit_record)
+        return rec, CachedResponse(url, rec, revisit_of[0])
+
+    def _create_records(self, url, request_target, proto, reqv_headers_list, peer_name, payload, revisit_of=None):
+        """
+            Create the WARC request-response pair from the downloaded payload (independent of the HTTP client library)
+             and return them with the (not yet decoded) DownloadedResponse or None if the data is not usable
+            If the payload digest is the same as the one of the cached response (revisit_of) a revisit record is
+             created instead of the response record
+        """
+        payload.finish()
+        if payload.received == 0:
+            payload.close()
+            err = 'Response data has zero length!'
+            self._handle_request_exception(url, 'RequestException happened during downloading: {0} \n\n'
+                                                ' The program ignores it and jumps to the next one.'.format(err))
+            return None
+
+        # REQUEST
+        reqv_record = self._create_request_record(url, request_target, proto, reqv_headers_list)
+
+        # RESPONSE
+        digests = payload.digests  # Computed while downloading, so warcio does not read it again
+        if revisit_of is not None and \
+                digests['WARC-Payload-Digest'] == revisit_of[1].get_header('WARC-Payload-Digest'):
+            resp_record = self._create_revisit_record(url, peer_name, payload.http_headers, revisit_of, False)
+        else:
+            # Add extra headers like encoding because it is not stored any other way...
+            warc_headers_dict = {'WARC-IP-Address': peer_name, 'WARC-X-Detected-Encoding': payload.encoding,
+                                 'WARC-X-Detected-Encoding-Method': payload.encoding_method}
+            warc_headers_dict.update(digests)
+            resp_record = self._writer.create_warc_record(url, 'response', payload=payload.file,
+                                                          length=payload.length, http_headers=payload.http_headers,
+                                                          warc_headers_dict=warc_headers_dict)
+        rec = (None, reqv_record, resp_record)
+        return rec, DownloadedResponse(url, rec, payload, self._logger)  # Decoded only when the text is needed
+
     def write_records_for_url(self, url, rec):
         self.good_urls.add(url)
+        self._rotate_if_needed()  # The request-response pair is never split between the segments
+        self._segment_records += 2
         if rec[0] is not None:
-            cache, (reqv_offset, _), (resp_offset, _) = rec
-            reqv_record = cache.get_record(reqv_offset)  # Seek to the appropriate pos in the WARC to retrive the record
-            self._writer.write_record(reqv_record)       # else random zlib errors happen when the payload is removed
-            resp_record = cache.get_record(resp_offset)  # from the cache
-            self._writer.write_record(resp_record)
+            cache, (reqv_offset, reqv_length), (resp_offset, resp_length) = rec
+            if self._raw_copy and cache.is_gzip_member(reqv_offset) and cache.is_gzip_member(resp_offset):
+                # Fast path: the gzip members of the records are copied unchanged from the source WARC
+                cache.copy_raw_record(reqv_offset, reqv_length, self._output_file)
+                cache.copy_raw_record(resp_offset, resp_length, self._output_file)
+            else:
+                reqv_record = cache.get_record(reqv_offset)  # Seek to the appropriate pos in the WARC to retrive
+                self._writer.write_record(reqv_record)       # the record else random zlib errors happen when
+                resp_record = cache.get_record(resp_offset)  # the payload is removed from the cache
+                self._writer.write_record(resp_record)
         else:
             _, reqv_record, resp_record = rec
             self._writer.write_record(reqv_record)
-            self._writer.write_record(resp_record)
+            self._writer.write_record(resp_record)  # The spooled payload is freed with the record and the response
+
+
+class PayloadSpool:
+    """
+        Spool the payload of a response to memory (up to max_size) or to a temporary file while the digests, the length
+         and the encoding (if it is not known from the headers, see CharsetDetector) are computed on the fly,
+         so only one copy of the data is kept and the payload is not read again to write the WARC record
+
+        The payload is stored as received (e.g. compressed with HTTP compression), the content coding is removed
+         only to detect the encoding, to decode the text and to read the content
+
+        Trailing whitespace is held back and dropped if the payload ends with \r\n (the same as data.rstrip())
+         warcio hack as \r\n is the record separator and trailing ones will be split and digest will eventually fail!
+         TODO: Warcio bugreport!
+         (Not for payloads with content coding as the compressed data can end with these bytes)
+    """
+    def __init__(self, http_headers, header_filter, encoding=None, content_encoding=None, max_size=SPOOL_MAX_SIZE):
+        self.http_headers = http_headers
+        http_headers.compute_headers_buffer(header_filter)  # The same buffer is computed by the WARCWriter
+        self._block_digester = Digester('sha1')
+        self._block_digester.update(http_headers.headers_buff)
+        self._payload_digester = Digester('sha1')
+        self.encoding = encoding
+        self.encoding_method = METHOD_HTTP_HEADER if encoding is not None else None
+        self._detector = CharsetDetector() if encoding is None else None
+        self._content_encoding = content_encoding
+        self._detector_content_decoder = new_content_decoder(content_encoding)  # The detector needs the content
+        self._has_content_coding = self._detector_content_decoder is not None
+        self.file = SpooledTemporaryFile(max_size)
+        self.received = 0  # Before stripping the trailing whitespace
+        self.length = 0
+        self._tail = b''
+
+    def write(self, chunk):
+        self.received += len(chunk)
+        if self._has_content_coding:
+            self._write(chunk)
+            return
+        stripped = chunk.rstrip()
+        if len(stripped) == 0:  # Whitespace only
+            self._tail += chunk
+        else:
+            self._write(self._tail + stripped)
+            self._tail = chunk[len(stripped):]
+
+    def _write(self, data):
+        self.file.write(data)
+        self._block_digester.update(data)
+        self._payload_digester.update(data)
+        self.length += len(data)
+        if self._detector is not None and not self._detector.done:
+            self._feed_detector(data)
+
+    def _feed_detector(self, data):
+        if self._detector_content_decoder is not None:
+            try:
+                data = self._detector_content_decoder.decompress(data)
+            except ContentDecodingError:  # Detect from the content decoded so far (the error is reported at decoding)
+                self._detector_content_decoder = None
+                self._detector.close()
+                return
+        self._detector.feed(data)
+
+    def finish(self):
+        """Call when all data is written"""
+        if not self._tail.endswith(b'\r\n'):
+            self._write(self._tail)
+        self._tail = b''
+        if self._detector is not None:
+            if self._detector_content_decoder is not None and not self._detector.done:
+                self._feed_detector(self._detector_content_decoder.flush())
+            self._detector.close()
+            self.encoding, self.encoding_method = self._detector.encoding, self._detector.method
+            self._detector = None
+        self.file.seek(0)
+
+    @property
+    def digests(self):  # Ready-only property for shortcut
+        return {'WARC-Payload-Digest': str(self._payload_digester), 'WARC-Block-Digest': str(self._block_digester)}
+
+    def _iter_content(self, errors='strict'):
+        """
+            Yield the spooled payload chunk-by-chunk without content coding and rewind it for writing
+            Stop at the first content coding error if errors is not strict
+        """
+        content_decoder = new_content_decoder(self._content_encoding)
+        self.file.seek(0)
+        try:
+            for chunk in iter(lambda: self.file.read(SPOOL_CHUNK_SIZE), b''):
+                if content_decoder is not None:
+                    chunk = content_decoder.decompress(chunk)
+                yield chunk
+            if content_decoder is not None:
+                yield content_decoder.flush()
+        except ContentDecodingError:
+            if errors == 'strict':
+                raise
+        finally:
+            self.file.seek(0)
+
+    def decode(self, errors='strict'):
+        """Decode the spooled payload chunk-by-chunk (raises UnicodeDecodeError or ContentDecodingError)"""
+        decoder = getincrementaldecoder(self.encoding)(errors)
+        parts = [decoder.decode(chunk) for chunk in self._iter_content(errors)]
+        parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts)
+
+    def read(self):
+        """Return the spooled payload without content coding as bytes"""
+        return b''.join(self._iter_content())
+
+    def close(self):
+        self.file.close()
+
+
+class WarcResponse:
+    """
+        A downloaded or cached response which carries the raw payload (content), its encoding, the HTTP headers and
+         the handle of the WARC records (rec, as accepted by write_records_for_url()) and decodes the payload lazily:
+         the text is decoded on its first access and memoized, so the callers which only copy the records
+         (e.g. sample without plus-function) never decode it
+        download_url() and download_urls() return it with lazy=True, else they return the text (str) as before
+    """
+    def __init__(self, url, rec):
+        self.url = url
+        self.rec = rec
+        self._text = None
+
+    @property
+    def content(self):  # Ready-only property for shortcut
+        """The payload without content coding (e.g. HTTP compression)"""
+        raise NotImplementedError
+
+    @property
+    def encoding(self):  # Ready-only property for shortcut
+        raise NotImplementedError
+
+    @property
+    def http_headers(self):  # Ready-only property for shortcut
+        raise NotImplementedError
+
+    def _decode(self):
+        raise NotImplementedError
+
+    @property
+    def text(self):  # Ready-only property for shortcut
+        if self._text is None:
+            self._text = self._decode()
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+
+class DownloadedResponse(WarcResponse):
+    """WarcResponse for a newly downloaded URL backed by the PayloadSpool of the response record"""
+    def __init__(self, url, rec, payload, _logger):
+        super().__init__(url, rec)
+        self._payload = payload
+        self._logger = _logger
+
+    @property
+    def content(self):  # Ready-only property for shortcut
+        return self._payload.read()
+
+    @property
+    def encoding(self):  # Ready-only property for shortcut
+        return self._payload.encoding
+
+    @property
+    def http_headers(self):  # Ready-only property for shortcut
+        return self._payload.http_headers
+
+    def _decode(self):
+        try:
+            return self._payload.decode()  # Normal decode process
+        except (UnicodeDecodeError, ContentDecodingError):
+            self._logger.log('WARNING', 'DECODE ERROR RETRYING IN \'IGNORE\' MODE:', self.url, self.encoding, sep='\t')
+            return self._payload.decode('ignore')
+
+
+class CachedResponse(WarcResponse):
+    """
+        WarcResponse for a URL found in a source WARC: the response record is read on the first access
+        The records of the original capture are read if they are not the same as rec (e.g. rec is a new revisit record)
+    """
+    def __init__(self, url, rec, original=None):
+        super().__init__(url, rec)
+        if original is None:
+            original = rec
+        self._original = original
+        self._data_and_enc = None
+
+    def _read_payload(self):
+        if self._data_and_enc is None:
+            cache, _, (resp_offset, resp_length) = self._original
+            self._data_and_enc = cache.read_payload(resp_offset, resp_length)
+        return self._data_and_enc
+
+    @property
+    def content(self):  # Ready-only property for shortcut
+        return self._read_payload()[0]
+
+    @property
+    def encoding(self):  # Ready-only property for shortcut
+        return self._read_payload()[1]
+
+    @property
+    def http_headers(self):  # Ready-only property for shortcut
+        cache, _, (resp_offset, _) = self._original
+        return cache.get_record(resp_offset).http_headers
+
+    def _decode(self):
+        cache, _, (resp_offset, resp_length) = self._original
+        return cache.read_text(resp_offset, resp_length, self._data_and_enc)
 
 
 class WarcReader:
-    def __init__(self, filename, _logger, strict_mode=False, check_digest=False):
+    """
+        Read the request-response pairs from a WARC file (created by this program) by URL
+
+        The URL index is created by scanning the WARC file once and it is stored in an index file next to the WARC
+         (filename.idx) to be loaded instantly next time. The index file is used only if it is not older than the WARC
+         (the size and the modification time of the WARC file must match with the stored values),
+         else the WARC file is scanned again. When validating (check_digest) the index file is not read.
+        If a sorted CDXJ index (filename.cdxj, see the index command) exists, it is newer than the WARC file
+         and the size of the WARC file matches with the one stored in it,
+         it is used as the URL index with binary search lookups instead of loading every URL into memory.
+        The index can also be created elsewhere (e.g. in a worker process) and supplied as preloaded_index.
+        With compact_index the URL index is stored in arrays (see CompactURLIndex) instead of a dict to save memory.
+        With use_mmap the WARC file is memory-mapped and the responses are inflated directly from the mapped memory
+         instead of seeking in the file and parsing the record with ArchiveIterator (when it is possible).
+        Revisit records (written by conditional re-fetching) are indexed as responses and resolved to the original
+         capture when read (see resolve_records()). Their offsets are recorded in the index, so the other responses
+         are not read to check their type.
+    """
+    def __init__(self, filename, _logger, strict_mode=False, check_digest=False, use_index_file=True,
+                 compact_index=False, preloaded_index=None, use_mmap=False):
         self.filename = filename
+        self.index_filename = '{0}.idx'.format(filename)
+        self.cdxj_filename = '{0}.cdxj'.format(filename)
         self._stream = open(filename, 'rb')
-        self._internal_url_index = {}
+        self._stream_stat = os.fstat(self._stream.fileno())  # Before reading to detect changes during indexing
+        if use_mmap:
+            self._mm = mmap(self._stream.fileno(), 0, access=ACCESS_READ)
+            self._mm_view = memoryview(self._mm)  # Slices without copying
+        else:
+            self._mm, self._mm_view = None, None
+        self._compact_index = compact_index
+        self._internal_url_index = self._new_url_index()
         self._logger = _logger
         self.info_record_data = None
         self._strict_mode = strict_mode
         if check_digest:
             check_digest = 'raise'
         self._check_digest = check_digest
+        self._use_index_file = use_index_file
+        self.revisit_resolver = None  # See resolve_records()
+        self._revisit_offsets = set()  # The offsets of the revisit records among the responses
+        if preloaded_index is not None:
+            self.info_record_data, self._internal_url_index, self._revisit_offsets = preloaded_index
+            return
+
         try:
-            self._create_index()
+            if not self._load_cdxj_file() and not self._load_index_file():
+                self._create_index()
+                self._write_index_file()
         except KeyError as e:
             if self._strict_mode:
                 raise e
             self._logger.log('ERROR', 'Ignoring exception:', e)
 
+    @staticmethod
+    def has_index_file(filename):
+        """
+            The WARC file has an index file (CDXJ or .idx) which is not older than it, so it probably does not need
+             to be scanned (the index file is checked thoroughly when it is loaded)
+        """
+        warc_mtime_ns = os.stat(filename).st_mtime_ns
+        for index_filename in ('{0}.cdxj'.format(filename), '{0}.idx'.format(filename)):
+            try:
+                if os.stat(index_filename).st_mtime_ns >= warc_mtime_ns:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def export_index(self):
+        """Return the index in a picklable form to be used as preloaded_index or None if it can not be exported"""
+        if isinstance(self._internal_url_index, CDXJIndex):  # Memory-mapped, cheap to open again
+            return None
+        return self.info_record_data, self._internal_url_index, self._revisit_offsets
+
     def __del__(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm_view.release()  # Must be released before closing the mmap
+            self._mm.close()
         if hasattr(self, '_stream'):  # If the program opened a file, then it should gracefully close it on exit!
             self._stream.close()
 
@@ -456,9 +1370,23 @@ class WarcReader:
     def url_index(self):  # Ready-only property for shortcut
         return self._internal_url_index.keys()
 
-    def _create_index(self):
-        self._logger.log('INFO', 'Creating index for {0}...'.format(self.filename))
-        archive_it = ArchiveIterator(self._stream, check_digests=self._check_digest)
+    @property
+    def has_dict_index(self):  # Ready-only property for shortcut
+        return isinstance(self._internal_url_index, dict)
+
+    def index_items(self):
+        return self._internal_url_index.items()
+
+    def url_index_get(self, url):
+        """Return the request-response pair for the URL or None if the URL is not in the index"""
+        return self._internal_url_index.get(url)
+
+    def _new_url_index(self):
+        if self._compact_index:
+            return CompactURLIndex()
+        return {}
+
+    def _read_info_record(self, archive_it):
         info_rec = next(archive_it)
         # First record should be an info record, then it should be followed by the request-response pairs
         assert info_rec.rec_type == 'warcinfo'
@@ -480,6 +1408,11 @@ class WarcReader:
                              'is corrupt! Continuing with a fresh one!')
             self.info_record_data = None
 
+    def _create_index(self):
+        self._logger.log('INFO', 'Creating index for {0}...'.format(self.filename))
+        archive_it = ArchiveIterator(self._stream, check_digests=self._check_digest)
+        self._read_info_record(archive_it)
+
         archive_load_failed = False
         count = 0
         double_urls = Counter()
@@ -493,7 +1426,7 @@ class WarcReader:
                 except ArchiveLoadFailed as e:
                     self._logger.log('ERROR', 'REQUEST:', e.msg, 'for', reqv_data[0])
                     archive_load_failed = True
-            if record.rec_type == 'response':
+            if record.rec_type in {'response', 'revisit'}:  # Revisit records are resolved when read
                 assert i % 2 == 1
                 resp_url = record.rec_headers.get_header('WARC-Target-URI')
                 assert resp_url == reqv_data[0]
@@ -502,6 +1435,8 @@ class WarcReader:
                     self._internal_url_index[resp_url] = (reqv_data[1],  # Request-response pair
                                                           (archive_it.get_record_offset(),
                                                            archive_it.get_record_length()))
+                    if record.rec_type == 'revisit':
+                        self._revisit_offsets.add(archive_it.get_record_offset())
                 except ArchiveLoadFailed as e:
                     self._logger.log('ERROR', 'RESPONSE:', e.msg, 'for', resp_url)
                     archive_load_failed = True
@@ -517,6 +1452,85 @@ class WarcReader:
         self._stream.seek(0)
         self._logger.log('INFO', 'Index successfully created.')
 
+    def _load_cdxj_file(self):
+        """Use the sorted CDXJ file as URL index if it exists and it is newer than the WARC file"""
+        if not self._use_index_file or self._check_digest:
+            return False
+
+        try:
+            cdxj_stat = os.stat(self.cdxj_filename)
+        except FileNotFoundError:
+            return False
+
+        if cdxj_stat.st_mtime_ns < self._stream_stat.st_mtime_ns:
+            self._logger.log('INFO', 'CDXJ file', self.cdxj_filename, 'is older than the WARC file, ignoring it!')
+            return False
+
+        cdxj_index = CDXJIndex(self.cdxj_filename)
+        if cdxj_index.meta.get('warc_size') != self._stream_stat.st_size:  # Missing in the files of older versions
+            self._logger.log('INFO', 'CDXJ file', self.cdxj_filename, 'is stale (the size of the WARC file differs),'
+                                                                      ' ignoring it! (Create it again with index)')
+            return False
+
+        # Only the warcinfo record is read from the WARC file
+        self._read_info_record(ArchiveIterator(self._stream, check_digests=self._check_digest))
+        self._stream.seek(0)
+        self._internal_url_index = cdxj_index
+        self._revisit_offsets = cdxj_index.revisit_offsets()
+        self._logger.log('INFO', 'Using CDXJ index', self.cdxj_filename)
+        return True
+
+    def _load_index_file(self):
+        """Load the URL index and the warcinfo data from the index file if it exists and it is up to date"""
+        if not self._use_index_file or self._check_digest:
+            return False
+
+        # The header is the first line, the URLs follow line by line (read one by one, e.g. into CompactURLIndex)
+        try:
+            with open(self.index_filename, encoding='UTF-8') as fh:
+                header = json.loads(fh.readline())
+                if not isinstance(header, dict) or header.get('version') != INDEX_FILE_VERSION or \
+                        header.get('warc_size') != self._stream_stat.st_size or \
+                        header.get('warc_mtime_ns') != self._stream_stat.st_mtime_ns:
+                    self._logger.log('INFO', 'Index file', self.index_filename, 'is stale, ignoring it!')
+                    return False
+
+                # Stored as [url, reqv_offset, reqv_length, resp_offset, resp_length]
+                url_index = self._new_url_index()
+                for line in fh:
+                    url, reqv_offset, reqv_length, resp_offset, resp_length = json.loads(line)
+                    url_index[url] = ((reqv_offset, reqv_length), (resp_offset, resp_length))
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self._logger.log('WARNING', 'Could not read index file', self.index_filename, ':', e)
+            return False
+
+        self.info_record_data = header['info_record_data']
+        self._internal_url_index = url_index
+        self._revisit_offsets = set(header['revisit_offsets'])
+        self._logger.log('INFO', 'Index loaded from', self.index_filename)
+        return True
+
+    def _write_index_file(self):
+        """Write the URL index and the warcinfo data atomically to the index file for later use"""
+        if not self._use_index_file:
+            return
+
+        header = {'version': INDEX_FILE_VERSION, 'warc_size': self._stream_stat.st_size,
+                  'warc_mtime_ns': self._stream_stat.st_mtime_ns, 'info_record_data': self.info_record_data,
+                  'revisit_offsets': sorted(self._revisit_offsets)}
+        tmp_filename = '{0}.tmp'.format(self.index_filename)
+        try:
+            with open(tmp_filename, 'w', encoding='UTF-8') as fh:
+                print(json.dumps(header, ensure_ascii=False), file=fh)
+                for url, ((reqv_offset, reqv_length), (resp_offset, resp_length)) in self._internal_url_index.items():
+                    print(json.dumps([url, reqv_offset, reqv_length, resp_offset, resp_length], ensure_ascii=False),
+                          file=fh)
+            os.replace(tmp_filename, self.index_filename)  # Readers never see a half-written index file
+        except OSError as e:  # E.g. read-only directory, the index is still usable from memory
+            self._logger.log('WARNING', 'Could not write index file', self.index_filename, ':', e)
+
     def get_record_data(self, url):
         reqv_resp_pair = self._internal_url_index.get(url)
         if reqv_resp_pair is not None:
@@ -529,18 +1543,189 @@ class WarcReader:
         rec = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
         return rec
 
-    def download_url(self, url):
+    def advise_sequential(self):
+        """Advise the kernel that the WARC file is read sequentially (larger readahead)"""
+        if hasattr(os, 'posix_fadvise'):  # Not available on Windows
+            os.posix_fadvise(self._stream.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def advise_willneed(self, offset, length):
+        """Advise the kernel to read the range of the WARC file in advance"""
+        if hasattr(os, 'posix_fadvise'):  # Not available on Windows
+            os.posix_fadvise(self._stream.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+
+    def _pread(self, length, offset):
+        """Read at most length bytes from the offset of the WARC file"""
+        if hasattr(os, 'pread'):  # Not available on Windows
+            return os.pread(self._stream.fileno(), length, offset)
+        self._stream.seek(offset)
+        return self._stream.read(length)
+
+    def is_gzip_member(self, offset):
+        """Check whether the record at the offset is a separate gzip member (can be copied with copy_raw_record)"""
+        return self._pread(len(GZIP_MAGIC), offset) == GZIP_MAGIC
+
+    def copy_raw_record(self, offset, length, out_fh):
+        """
+            Copy the record at the offset byte-by-byte to the end of out_fh (without decompressing and parsing it)
+             with copy_file_range() in the kernel where it is available else through a buffer
+        """
+        out_fh.flush()  # The buffered content must precede the copied bytes
+        src_fd, dst_fd = self._stream.fileno(), out_fh.fileno()
+        try:
+            while length > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, length, offset)  # Does not modify the src file position
+                if copied == 0:
+                    break
+                offset += copied
+                length -= copied
+        except (AttributeError, OSError):  # Not available (non-Linux) or not supported (e.g. filesystem)
+            pass
+        while length > 0:  # Fallback for the rest (if any)
+            chunk = self._pread(min(length, 1024 * 1024), offset)
+            if len(chunk) == 0:
+                raise EOFError('Unexpected end of file in {0} at offset {1}!'.format(self.filename, offset))
+            os.write(dst_fd, chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+        out_fh.seek(0, os.SEEK_END)  # Synchronise the position of the buffered file object with the file descriptor
+
+    def _read_payload_mmap(self, offset, length):
+        """
+            Inflate the gzip member of the response record from the mapped memory and split the WARC and HTTP headers
+             Return the payload and the detected encoding or None if the record needs the full parser
+             (not a gzip member, revisit record, the payload has unsupported content coding or it is really chunked)
+        """
+        record_view = self._mm_view[offset:offset + length]
+        if record_view[:len(GZIP_MAGIC)] != GZIP_MAGIC:
+            return None
+        raw_record = zlib.decompress(record_view, wbits=16 + zlib.MAX_WBITS)  # gzip member
+
+        warc_headers_end = raw_record.index(b'\r\n\r\n')
+        warc_headers = self._parse_warc_headers(raw_record[:warc_headers_end])
+        if warc_headers.get('warc-type') == 'revisit':
+            return None
+        block_start = warc_headers_end + 4
+        block = raw_record[block_start:block_start + int(warc_headers['content-length'])]
+
+        http_headers_end = block.index(b'\r\n\r\n')
+        payload = block[http_headers_end + 4:]
+        content_encoding = None
+        for line in block[:http_headers_end].split(b'\r\n')[1:]:
+            name, _, value = line.partition(b':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == b'transfer-encoding' and value == b'chunked' and self._looks_chunked(payload):
+                return None
+            elif name == b'content-encoding':
+                content_encoding = value.decode('latin-1')
+        if new_content_decoder(content_encoding) is not None:  # E.g. HTTP compression
+            try:
+                payload = decode_content(payload, content_encoding)
+            except ContentDecodingError:
+                return None
+        elif content_encoding not in {None, '', 'identity'}:  # Not supported: warcio decides what to do
+            return None
+        return payload, warc_headers.get('warc-x-detected-encoding', 'UTF-8')
+
+    @staticmethod
+    def _parse_warc_headers(raw_headers):
+        """Parse the WARC headers (without the trailing empty line) into a dict with lowercase names"""
+        warc_headers = dict(line.split(b': ', maxsplit=1) for line in raw_headers.split(b'\r\n')[1:] if b': ' in line)
+        return {k.decode('UTF-8').lower(): v.decode('UTF-8').strip() for k, v in warc_headers.items()}
+
+    def _read_warc_headers(self, offset, chunk_size=4096):
+        """Return the WARC headers of the record at the offset (see _parse_warc_headers()) reading only its beginning"""
+        data = self._pread(chunk_size, offset)
+        decompressor = None
+        if data[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        raw = b''
+        while len(data) > 0:
+            offset += len(data)
+            raw += decompressor.decompress(data) if decompressor is not None else data
+            if b'\r\n\r\n' in raw or (decompressor is not None and decompressor.eof):
+                break
+            data = self._pread(chunk_size, offset)
+        return self._parse_warc_headers(raw.split(b'\r\n\r\n', maxsplit=1)[0])
+
+    def resolve_records(self, reqv, resp):
+        """
+            Return the reader and the request-response pair of the original capture if the response is a revisit record
+             (found by revisit_resolver(url, payload_digest) in the other WARC files, see WarcCachingDownloader)
+             else this reader and the supplied pair (only the indexed revisit records are read)
+        """
+        if resp[0] not in self._revisit_offsets:
+            return self, reqv, resp
+
+        warc_headers = self._read_warc_headers(resp[0])
+
+        url = warc_headers.get('warc-refers-to-target-uri', warc_headers.get('warc-target-uri'))
+        original = None
+        if self.revisit_resolver is not None:
+            original = self.revisit_resolver(url, warc_headers.get('warc-payload-digest'))
+        if original is None:
+            raise KeyError('The original capture of the revisit record is missing for URL: {0}'
+                           ' (supply the WARC file which contains it)'.format(url))
+        return original
+
+    def get_payload_digest(self, offset):
+        """Return the WARC-Payload-Digest of the record at the offset or None"""
+        return self._read_warc_headers(offset).get('warc-payload-digest')
+
+    @staticmethod
+    def _looks_chunked(payload):
+        """
+            The payload is stored dechunked, but the Transfer-Encoding header is kept,
+             so warcio treats the payload as chunked only if it starts with a valid chunk length line (same check)
+        """
+        first_line = payload[:64].split(b'\n', maxsplit=1)[0] + b'\n'
+        try:
+            return first_line[-2:] == b'\r\n' and int(first_line[:-2].split(b';')[0], 16) <= 2**31
+        except ValueError:
+            return False
+
+    def _read_payload_stream(self, offset):
+        """Parse the response record at the offset and return the payload and the detected encoding"""
+        self._stream.seek(offset)  # Can not be cached as we also want to write it out to the new archive!
+        record = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
+        data = record.content_stream().read()
+        enc = record.rec_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')
+        return data, enc
+
+    def read_payload(self, offset, length=None):
+        """Return the raw payload and the detected encoding of the response record at the offset"""
+        data_and_enc = None
+        if self._mm_view is not None and length is not None and not self._check_digest:  # Digest needs the parser
+            data_and_enc = self._read_payload_mmap(offset, length)
+        if data_and_enc is None:
+            data_and_enc = self._read_payload_stream(offset)
+        return data_and_enc
+
+    def read_text(self, offset, length=None, data_and_enc=None):
+        """
+            Return the decoded payload of the response record at the offset
+            The payload is read only if it is not supplied (data_and_enc as returned by read_payload())
+        """
+        if data_and_enc is None:
+            data_and_enc = self.read_payload(offset, length)
+        data, enc = data_and_enc
+        assert len(data) > 0
+        return data.decode(enc, 'ignore')
+
+    def download_url(self, url, lazy=False):
+        """Return the decoded text of the URL (or the CachedResponse with lazy=True) or None if it is not found"""
         text = None
         reqv_resp_pair = self._internal_url_index.get(url)
         if reqv_resp_pair is not None:
-            offset = reqv_resp_pair[1][0]  # Only need the offset of the response part
-            self._stream.seek(offset)  # Can not be cached as we also want to write it out to the new archive!
-            record = next(iter(ArchiveIterator(self._stream, check_digests=self._check_digest)))
-            data = record.content_stream().read()
-            assert len(data) > 0
-            enc = record.rec_headers.get_header('WARC-X-Detected-Encoding', 'UTF-8')
-            text = data.decode(enc, 'ignore')
+            text = CachedResponse(url, self.resolve_records(*reqv_resp_pair))
+            if not lazy:
+                text = text.text  # Only need the offset and length of the response part
         else:
             self._logger.log('CRITICAL', url, 'URL not found in WARC!', sep='\t')
 
         return text
+
+
+def _create_warc_reader_index(params):
+    """Worker function to create the URL index of a WARC file in a separate process"""
+    filename, strict_mode, check_digest, use_index_file, compact_index, mplogger = params
+    return WarcReader(filename, mplogger, strict_mode, check_digest, use_index_file, compact_index).export_index()
@@ -3,10 +3,13 @@
 
 from datetime import timedelta
 from calendar import monthrange, isleap
+from itertools import chain
 
 from mplogger import Logger
 
+from .utils import batched
 from .enhanced_downloader import WarcCachingDownloader
+from .url_store import UrlStatus
 
 
 def add_and_write_factory(attr, fname):
@@ -23,6 +26,18 @@ def add_and_write_factory(attr, fname):
         return fh, add_fun
 
 
+def new_url_set(url_store, status, checkpoint=None):
+    """
+        A set of URLs in memory or the view of the status in the URL store (see UrlStateStore) if it is supplied
+         (the set is journaled by the checkpoint if it is supplied, see CrawlCheckpoint.url_set())
+    """
+    if url_store is not None:
+        return url_store.view(status)
+    if checkpoint is not None:
+        return checkpoint.url_set(status.name.lower())
+    return set()
+
+
 class NewsArchiveCrawler:
     """
         Using the provided regexes
@@ -30,7 +45,9 @@ class NewsArchiveCrawler:
         2) Extracts URLs of articles from these lists (with helper functions and config)
     """
     def __init__(self, settings, existing_archive_filenames, new_archive_filename, archive_just_cache=False,
-                 known_article_urls=None, debug_params=None, downloader_params=None):
+                 known_article_urls=None, debug_params=None, downloader_params=None, checkpoint=None,
+                 archive_workers=1, archive_prefetch=0, probe_archive_end=False, pagination_stats=None,
+                 adaptive_pagination=False, url_store=None):
 
         # List the used properties
         self._archive_page_urls_by_date = None
@@ -45,6 +62,19 @@ class NewsArchiveCrawler:
         self._extract_article_urls_from_page_fun = None
         self._find_next_page_url = None
         self._max_tries = None
+        self._next_url_by_pagenum = None
+        self._extract_next_page_url_fun = None
+        self._max_pagenum = None
+        self._selected_column = None
+        # The pagination chains crawled at once with their article URLs not yet generated (for the checkpoints)
+        self._position = None
+        self._archive_workers = archive_workers
+        self._archive_prefetch = archive_prefetch
+        self._probe_archive_end = probe_archive_end
+        self._probed_pages = {}  # The probed pages with new articles by URL until they are crawled
+        # Record the finished chains and predict their pagination from the previous crawls (see PaginationStats)
+        self._pagination_stats = pagination_stats
+        self._adaptive_pagination = adaptive_pagination and pagination_stats is not None
 
         # Save the original settings for using it with all columns
         self._settings = settings
@@ -56,12 +86,13 @@ class NewsArchiveCrawler:
             debug_params = {}
         self._logger = Logger(settings['log_file_archive'], **debug_params)
 
-        # Open files for writing gathered URLs if needed,
-        self.good_urls = set()
+        # Open files for writing gathered URLs if needed (the URL sets are kept on disk if url_store is supplied)
+        self._url_store = url_store
+        self.good_urls = new_url_set(url_store, UrlStatus.ARCHIVE_GOOD, checkpoint)
         self._new_good_archive_urls_fh, self._good_urls_add = \
             add_and_write_factory(self.good_urls, settings.get('new_good_archive_urls'))
 
-        self.problematic_urls = set()
+        self.problematic_urls = new_url_set(url_store, UrlStatus.ARCHIVE_PROBLEMATIC, checkpoint)
         self._new_problematic_archive_urls_fh, self._problematic_urls_add = \
             add_and_write_factory(self.problematic_urls, settings.get('new_problematic_archive_urls'))
 
@@ -69,11 +100,34 @@ class NewsArchiveCrawler:
         self.known_article_urls = set()
         if known_article_urls is not None:
             if isinstance(known_article_urls, str):
+                self.known_article_urls = new_url_set(url_store, UrlStatus.KNOWN_ARTICLE)
                 with open(known_article_urls, encoding='UTF-8') as fh:
-                    self.known_article_urls = {line.strip() for line in fh}
-            elif isinstance(known_article_urls, set):
+                    self.known_article_urls.update(line.strip() for line in fh)
+            else:  # Set or URL index
                 self.known_article_urls = known_article_urls
 
+        # Continue the interrupted crawl from the checkpoint (if it is resumed) and save it periodically
+        self._checkpoint = checkpoint
+        resume_state = None
+        if checkpoint is not None:
+            resume_state = checkpoint.state.get('archive')
+        if resume_state is not None:
+            self._logger.log('INFO', 'Resuming archive crawling from checkpoint', checkpoint.filename)
+            self._position = resume_state['position']
+            # The URLs are restored already by the URL store or the checkpoint (only written to the output files again)
+            for url in self.good_urls:
+                self._good_urls_add(url)
+            for url in self.problematic_urls:
+                self._problematic_urls_add(url)
+            if resume_state['downloader'] is not None:
+                downloader_params = dict(downloader_params or {}, resume_state=resume_state['downloader'])
+        if url_store is not None:
+            downloader_params = dict(downloader_params or {}, good_urls=url_store.view(UrlStatus.ARCHIVE_DOWNLOADED),
+                                     bad_urls=url_store.view(UrlStatus.BAD))
+        elif checkpoint is not None:
+            downloader_params = dict(downloader_params or {},
+                                     good_urls=new_url_set(None, UrlStatus.ARCHIVE_DOWNLOADED, checkpoint))
+
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(existing_archive_filenames, new_archive_filename, self._logger,
                                                  archive_just_cache, downloader_params)
@@ -81,6 +135,11 @@ class NewsArchiveCrawler:
         self.bad_urls = self._downloader.bad_urls
         # Known good URLs (read-only, available at __init__ time from cache)
         self.url_index = self._downloader.url_index
+        if self._archive_prefetch > 0 and self._downloader.concurrency <= 1:
+            # The prefetched pages would be downloaded one after another before the next page could be processed
+            self._logger.log('WARNING', 'Archive prefetch is disabled as the downloader downloads one page at a time'
+                                        ' (see --download-workers and --download-engine)!')
+            self._archive_prefetch = 0
 
     def _store_settings(self, column_spec_settings):
         # Settings for URL iterator
@@ -92,12 +151,16 @@ class NewsArchiveCrawler:
             self._date_until = column_spec_settings['DATE_UNTIL']
             self._go_reverse_in_archive = self._settings['go_reverse_in_archive']
 
-        # Settings for gen_article_urls_including_subpages()
+        # Settings for _process_archive_page()
         self._min_pagenum = column_spec_settings['min_pagenum']
         self._initial_page_num = column_spec_settings['INITIAL_PAGENUM']
         self._ignore_archive_cache = self._settings['ignore_archive_cache']
         self._infinite_scrolling = self._settings['infinite_scrolling']
         self._extract_article_urls_from_page_fun = self._settings['EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN']
+        # Settings for _prefetch_page_urls()
+        self._next_url_by_pagenum = self._settings['next_url_by_pagenum']
+        self._extract_next_page_url_fun = self._settings['EXTRACT_NEXT_PAGE_URL_FUN']
+        self._max_pagenum = column_spec_settings['max_pagenum']
 
         # Store the constant parameters for the actual function used later
         self._find_next_page_url = \
@@ -118,6 +181,21 @@ class NewsArchiveCrawler:
         if hasattr(self, '_new_problematic_archive_urls_fh') and hasattr(self, 'close'):
             self._new_problematic_archive_urls_fh.close()
 
+    def checkpoint_state(self):
+        """
+            The state of archive crawling after the last URL generated by url_iterator() (see CrawlCheckpoint)
+             The URL sets are stored by the URL store or the checkpoint itself (see new_url_set())
+        """
+        return {'position': self._position, 'downloader': self._downloader.checkpoint_state()}
+
+    def save_checkpoint(self, force=False):
+        """Save the checkpoint if it is due (call between the URLs of url_iterator() when crawling only the archive)"""
+        if self._checkpoint is not None and (force or self._checkpoint.due):
+            state = {'archive': self.checkpoint_state()}
+            if self._url_store is not None:
+                state['url_store'] = self._url_store.checkpoint_state()
+            self._checkpoint.save(state)
+
     def url_iterator(self):
         """
             The URL generation logic. We have one or more base URL to the archive (or column archives if there is more)
@@ -127,11 +205,74 @@ class NewsArchiveCrawler:
             Pagination can be implemented in various ways, see the appropriate function for details
         :return: Every page of the archive contain multiple URL to the actual articles, which are extracted and
          then returned as an iterator based on URLs.
+        The pagination chains of archive_workers archive page URLs (e.g. days or columns) are crawled at once:
+         their next pages are downloaded together (concurrently if the downloader supports it, see download_urls())
+         and processed as soon as they are downloaded
+         and the article URLs are generated in the same order as they would be crawled one after another
+         (the URLs of the chains after the first one are kept until the previous chains are finished)
+        When resumed from a checkpoint the archive pages before the chains of its position are skipped
         """
+        archive_page_urls = self._gen_archive_page_urls()
+        if self._position is None:
+            chains = []
+        else:
+            chains = self._position
+            self._skip_to_chains(archive_page_urls, chains)
+        self._position = chains  # Updated in place for the checkpoints
+        while True:
+            # 1) Start new chains until enough of them are running (the finished ones are kept only for their URLs)
+            while sum(chain['next_page_url'] is not None for chain in chains) < self._archive_workers and \
+                    len(chains) < self._archive_workers * 4:
+                column_name_and_url = next(archive_page_urls, None)
+                if column_name_and_url is None:
+                    break
+                chains.append(self._new_chain(*column_name_and_url))
+            if len(chains) == 0:
+                break
+            # 2) Generate the URLs of the first chain, which is removed when finished
+            yield from self._gen_article_urls_of_chain(chains[0])
+            if chains[0]['next_page_url'] is None:
+                self._add_chain_stats(chains[0])
+                del chains[0]
+                continue
+            # 3) Download the next page of the running chains (and the following pages speculatively
+            #    or the probed page while the last page is searched for) and extract the article URLs of them
+            running_chains = [chain for chain in chains if chain['next_page_url'] is not None]
+            page_urls_by_chain = [self._probe_page_urls(chain) if chain['probe'] is not None
+                                  else self._prefetch_page_urls(chain) for chain in running_chains]
+            to_download = [page_url for page_urls in page_urls_by_chain for page_url in page_urls
+                           if page_url not in self._probed_pages]
+            speculative_urls = [page_url for chain, page_urls in zip(running_chains, page_urls_by_chain)
+                                for page_url in (page_urls if chain['probe'] is not None else page_urls[1:])]
+            if len(to_download) == 1 and len(speculative_urls) == 0:  # Sequential crawl (one chain, no prefetch)
+                archive_pages = iter([self._downloader.download_url(to_download[0], self._ignore_archive_cache, True)])
+            else:
+                # The pages are processed as soon as they are downloaded while the following ones are downloading
+                archive_pages = self._downloader.iter_download_urls(to_download, self._ignore_archive_cache, True,
+                                                                    speculative_urls=speculative_urls)
+            for chain, page_urls in zip(running_chains, page_urls_by_chain):
+                for page_url in page_urls:
+                    if page_url in self._probed_pages:
+                        records_and_text = self._probed_pages.pop(page_url)
+                    else:
+                        records_and_text = next(archive_pages)
+                    if chain['probe'] is not None:
+                        self._process_probed_page(chain, records_and_text)
+                        continue
+                    if page_url != chain['next_page_url']:  # After the end of the chain: not written to the WARC
+                        self._logger.log('DEBUG', page_url, 'Discarding prefetched archive page!', sep='\t')
+                        continue
+                    archive_page_raw_html = None
+                    if records_and_text is not None:
+                        rec, archive_page_raw_html = records_and_text
+                        self._downloader.write_records_for_url(page_url, rec)
+                    self._process_archive_page(chain, archive_page_raw_html)
+
+    def _gen_archive_page_urls(self):
+        """Generate the column names and the archive page URLs (the base of the pagination chains) in order"""
         for column_name, params in self._columns.items():
-            self._logger.log('INFO', 'Starting column:', column_name)
             # 1) Set params for the actual column
-            self._store_settings(params)
+            self._select_column(column_name)
             # 2) By date with optional pagination (that is handled separately)
             if self._archive_page_urls_by_date:
                 # a) Unique the generated archive page URLs using every day from date_from to the end of date_until
@@ -144,9 +285,33 @@ class NewsArchiveCrawler:
             else:
                 archive_page_urls = [self._archive_url_format]  # Only the base URL is added
 
-            # 4) Iterate the archive URLs and process them, while generating the required page URLs on demand
+            # 4) Iterate the archive URLs to process them, while generating the required page URLs on demand
+            self._logger.log('INFO', 'Starting column:', column_name)
             for archive_page_url in archive_page_urls:
-                yield from self._gen_article_urls_including_subpages(archive_page_url)
+                yield column_name, archive_page_url
+
+    @staticmethod
+    def _skip_to_chains(archive_page_urls, chains):
+        """Skip the archive page URLs before and including the chains of the checkpoint (they are consecutive)"""
+        if len(chains) == 0:  # The crawl was finished
+            for _ in archive_page_urls:
+                pass
+            return
+        for chain in chains:
+            column_name_and_url = None
+            for column_name_and_url in archive_page_urls:
+                # The archive page URLs before the first chain are skipped, the others must follow it directly
+                if column_name_and_url == (chain['column'], chain['archive_page_url']) or chain is not chains[0]:
+                    break
+            if column_name_and_url != (chain['column'], chain['archive_page_url']):
+                raise ValueError('The archive page URL of the checkpoint is not generated for column {0}: {1}'
+                                 ' (the configuration has changed?)'.format(chain['column'], chain['archive_page_url']))
+
+    def _select_column(self, column_name):
+        """Store the settings of the column if they are not stored already"""
+        if self._selected_column != column_name:
+            self._store_settings(self._columns[column_name])
+            self._selected_column = column_name
 
     @staticmethod
     def _gen_url_from_date(curr_date, url_format):
@@ -179,45 +344,163 @@ class NewsArchiveCrawler:
             replace('#next-day', '{0:02d}'.format(next_date.day))
         return art_list_url
 
-    def _gen_article_urls_including_subpages(self, archive_page_url_base):
+    def _prefetch_page_urls(self, chain):
         """
-            Generates article URLs from a supplied URL including the on-demand sub-pages that contains article URLs
+            The next page URL of the chain followed by the URLs of the next archive_prefetch pages if they are
+             generated by page numbering (see find_nex_page_url_spec() Method #4 and #5) and can be downloaded
+             speculatively (the pages after the end of the chain are discarded)
         """
-        page_num = self._min_pagenum
-        tries_left = self._max_tries
-        first_page = True
-        next_page_url = archive_page_url_base.replace('#pagenum', self._initial_page_num)
-        while next_page_url is not None or tries_left > 0:
-            archive_page_raw_html = self._downloader.download_url(next_page_url, self._ignore_archive_cache)
-            tries_left -= 1
-            curr_page_url = next_page_url
-            next_page_url = None
-            if archive_page_raw_html is not None:  # Download succeeded
-                self._good_urls_add(curr_page_url)
-                # 1) We need article URLs here to reliably determine the end of pages in some cases
-                article_urls = self._extract_article_urls_from_page_fun(archive_page_raw_html)
-                if len(article_urls) == 0 and (not self._infinite_scrolling or first_page):
-                    self._logger.log('WARNING', curr_page_url, 'Could not extract URLs from the archive!', sep='\t')
-                # 2) Generate next-page URL or None if there should not be any
-                next_page_url = self._find_next_page_url(archive_page_url_base, page_num, archive_page_raw_html,
-                                                         article_urls)
-                if next_page_url is not None:
-                    tries_left = self._max_tries  # Restore tries_left
-                else:
-                    tries_left = 0  # We have arrived to the end
-                page_num += 1  # Bump pagenum for next round
-                first_page = False
-                self._logger.log('DEBUG', 'URLs/ARCHIVE PAGE', curr_page_url, len(article_urls), sep='\t')
-                yield from article_urls
-            elif tries_left == 0:  # Download failed
-                if curr_page_url not in self.bad_urls and curr_page_url not in self._downloader.good_urls and \
-                        curr_page_url not in self._downloader.url_index:  # URLs in url_index should not be a problem
-                    self._problematic_urls_add(curr_page_url)  # New possibly bad URL
-                    self._logger.log('ERROR', curr_page_url, f'There are no tries left for URL!', sep='\t')
-            else:  # Retry download
-                self._logger.log('WARNING',
-                                 curr_page_url, f'Retrying URL ({self._max_tries - tries_left})!', sep='\t')
-                next_page_url = curr_page_url  # Restore URL for retrying
+        self._select_column(chain['column'])
+        page_urls = [chain['next_page_url']]
+        if self._archive_prefetch > 0 and self._next_url_by_pagenum and self._extract_next_page_url_fun is None and \
+                (self._infinite_scrolling or self._max_pagenum is not None) and \
+                not (self._probe_archive_end and chain['first_page']):  # The probing starts after the first page
+            last_page_num = chain['page_num'] + self._archive_prefetch
+            if not self._infinite_scrolling:
+                last_page_num = min(last_page_num, self._max_pagenum + 1)
+            if chain['last_page_num'] is not None:
+                last_page_num = min(last_page_num, chain['last_page_num'] + 1)
+            if self._adaptive_pagination:  # Not after the predicted number of pages (the first page is not numbered)
+                predicted_pages = self._predict_pagination(chain).pages
+                if predicted_pages is not None:
+                    last_page_num = min(last_page_num, self._min_pagenum + predicted_pages - 1)
+            page_urls.extend(chain['archive_page_url'].replace('#pagenum', str(page_num))
+                             for page_num in range(chain['page_num'], last_page_num))
+        return page_urls
+
+    @staticmethod
+    def _probe_page_num(probe):
+        """Gallop (1, 2, 4, 8, ... pages after the last page with new articles) then binary search"""
+        if probe['high'] is None:
+            return probe['low'] + probe['step']
+        return (probe['low'] + probe['high']) // 2
+
+    def _probe_page_urls(self, chain):
+        page_url = chain['archive_page_url'].replace('#pagenum', str(self._probe_page_num(chain['probe'])))
+        self._logger.log('DEBUG', page_url, 'Probing archive page!', sep='\t')
+        return [page_url]
+
+    def _is_known_archive_page(self, article_urls):
+        """The page has no new articles: it is empty or it is made up entirely of known articles"""
+        return all(url in self.known_article_urls for url in article_urls)
+
+    def _process_probed_page(self, chain, records_and_text):
+        """
+            Search for the last page with new articles with probe_archive_end (supposing that the newer articles are
+             on the lower page numbers), the pages after it are not crawled
+            The probed pages with new articles are kept until they are crawled (their records are written then),
+             the other ones are discarded (the failed downloads are considered to be after the end of the archive)
+        """
+        self._select_column(chain['column'])
+        probe = chain['probe']
+        page_num = self._probe_page_num(probe)
+        if records_and_text is not None and \
+                not self._is_known_archive_page(self._extract_article_urls_from_page_fun(records_and_text[1])):
+            probe['low'] = page_num
+            if probe['high'] is None:
+                probe['step'] *= 2
+            page_url = chain['archive_page_url'].replace('#pagenum', str(page_num))
+            self._probed_pages[page_url] = records_and_text
+            chain['probed_urls'].append(page_url)
+        else:
+            probe['high'] = page_num
+
+        if probe['high'] is not None and probe['high'] - probe['low'] <= 1:  # Found
+            chain['probe'] = None
+            chain['last_page_num'] = probe['low']
+            self._logger.log('INFO', chain['archive_page_url'], 'The last archive page with new articles:',
+                             probe['low'], sep='\t')
+            if chain['page_num'] - 1 > chain['last_page_num']:  # The next page (page_num - 1) is after it
+                chain['next_page_url'] = None
+                chain['tries_left'] = 0
+                self._discard_probed_pages(chain)
+
+    def _discard_probed_pages(self, chain):
+        for page_url in chain['probed_urls']:
+            self._probed_pages.pop(page_url, None)
+        chain['probed_urls'] = []
+
+    def _new_chain(self, column_name, archive_page_url_base):
+        """
+            The pagination chain of the archive page URL (the state of _process_archive_page()) as a dict
+             to be saved with the checkpoints as is
+        """
+        self._select_column(column_name)
+        return {'column': column_name, 'archive_page_url': archive_page_url_base, 'page_num': self._min_pagenum,
+                'tries_left': self._max_tries, 'first_page': True,
+                'next_page_url': archive_page_url_base.replace('#pagenum', self._initial_page_num),
+                'article_urls': [], 'probe': None, 'last_page_num': None, 'probed_urls': [], 'page_stats': []}
+
+    def _add_chain_stats(self, chain):
+        if self._pagination_stats is not None and len(chain['page_stats']) > 0:
+            self._pagination_stats.add_chain(self._settings['site_name'], chain['column'], chain['archive_page_url'],
+                                             chain['page_stats'])
+
+    def _predict_pagination(self, chain):
+        return self._pagination_stats.predict(self._settings['site_name'], chain['column'], chain['archive_page_url'])
+
+    def _process_archive_page(self, chain, archive_page_raw_html):
+        """
+            Extracts the article URLs from the downloaded page of the chain (None if the download failed)
+             and determines the next page of the chain on demand (None if the chain is finished)
+        """
+        self._select_column(chain['column'])
+        chain['tries_left'] -= 1
+        curr_page_url = chain['next_page_url']
+        chain['next_page_url'] = None
+        if archive_page_raw_html is not None:  # Download succeeded
+            self._good_urls_add(curr_page_url)
+            # 1) We need article URLs here to reliably determine the end of pages in some cases
+            article_urls = self._extract_article_urls_from_page_fun(archive_page_raw_html)
+            if len(article_urls) == 0 and (not self._infinite_scrolling or chain['first_page']):
+                self._logger.log('WARNING', curr_page_url, 'Could not extract URLs from the archive!', sep='\t')
+            chain['page_stats'].append([len(article_urls),  # For PaginationStats
+                                        sum(url not in self.known_article_urls for url in article_urls),
+                                        self._max_tries - chain['tries_left']])
+            # 2) Generate next-page URL or None if there should not be any
+            chain['next_page_url'] = self._find_next_page_url(chain['archive_page_url'], chain['page_num'],
+                                                              archive_page_raw_html, article_urls)
+            if chain['last_page_num'] is not None and chain['page_num'] > chain['last_page_num']:
+                chain['next_page_url'] = None  # After the last page with new articles (see _process_probed_page())
+            elif chain['first_page'] and chain['next_page_url'] is not None and self._probe_archive_end and \
+                    self._infinite_scrolling and self._next_url_by_pagenum and \
+                    self._extract_next_page_url_fun is None:
+                if self._is_known_archive_page(article_urls):
+                    chain['next_page_url'] = None  # Even the first page has no new articles
+                else:  # Search for the last page with new articles after the first page
+                    chain['probe'] = {'low': self._min_pagenum - 1, 'high': None, 'step': 1}
+            elif self._adaptive_pagination and chain['next_page_url'] is not None and len(article_urls) > 0 and \
+                    self._is_known_archive_page(article_urls) and self._predict_pagination(chain).known_rest:
+                self._logger.log('INFO', curr_page_url, 'Stopping pagination: the next archive pages are predicted'
+                                                        ' to hold only known articles', sep='\t')
+                chain['next_page_url'] = None
+            if chain['next_page_url'] is not None:
+                chain['tries_left'] = self._max_tries  # Restore tries_left
+            else:
+                chain['tries_left'] = 0  # We have arrived to the end
+                self._discard_probed_pages(chain)
+            chain['page_num'] += 1  # Bump pagenum for next round
+            chain['first_page'] = False
+            self._logger.log('DEBUG', 'URLs/ARCHIVE PAGE', curr_page_url, len(article_urls), sep='\t')
+            chain['article_urls'].extend(article_urls)
+        elif chain['tries_left'] == 0:  # Download failed
+            self._discard_probed_pages(chain)
+            chain['page_stats'].append([None, None, self._max_tries])
+            if curr_page_url not in self.bad_urls and curr_page_url not in self._downloader.good_urls and \
+                    curr_page_url not in self._downloader.url_index:  # URLs in url_index should not be a problem
+                self._problematic_urls_add(curr_page_url)  # New possibly bad URL
+                self._logger.log('ERROR', curr_page_url, f'There are no tries left for URL!', sep='\t')
+        else:  # Retry download
+            self._logger.log('WARNING',
+                             curr_page_url, f'Retrying URL ({self._max_tries - chain["tries_left"]})!', sep='\t')
+            chain['next_page_url'] = curr_page_url  # Restore URL for retrying
+
+    @staticmethod
+    def _gen_article_urls_of_chain(chain):
+        """Generate the article URLs of the chain extracted so far (the not yet generated ones are kept in it)"""
+        article_urls = chain['article_urls']
+        while len(article_urls) > 0:
+            yield article_urls.pop(0)
 
     @staticmethod
     def _find_next_page_url_factory(extract_next_page_url_fun, next_url_by_pagenum, infinite_scrolling, max_pagenum,
@@ -268,6 +551,10 @@ class NewsArchiveDummyCrawler:
     def url_iterator(self):
         return self._url_index_keys
 
+    @staticmethod
+    def checkpoint_state():
+        return None
+
 
 class NewsArticleCrawler:
     """
@@ -281,17 +568,20 @@ class NewsArticleCrawler:
 
     def __init__(self, settings, articles_existing_warc_filenames, articles_new_warc_filename,
                  archive_existing_warc_filenames, archive_new_warc_filename, articles_just_cache=False,
-                 archive_just_cache=False, known_article_urls=None, debug_params=None, download_params=None):
+                 archive_just_cache=False, known_article_urls=None, debug_params=None, download_params=None,
+                 checkpoint=None, archive_workers=1, archive_prefetch=0, probe_archive_end=False,
+                 pagination_stats=None, adaptive_pagination=False, url_store=None):
 
         # Initialise the logger
         self._logger = Logger(settings['log_file_articles'])
 
-        # Open files for writing gathered URLs if needed
-        self._new_urls = set()
+        # Open files for writing gathered URLs if needed (the URL sets are kept on disk if url_store is supplied)
+        self._url_store = url_store
+        self._new_urls = new_url_set(url_store, UrlStatus.ARTICLE_NEW, checkpoint)
         self._new_good_urls_fh, self._new_urls_add = \
             add_and_write_factory(self._new_urls, settings.get('new_good_urls'))
 
-        self.problematic_article_urls = set()
+        self.problematic_article_urls = new_url_set(url_store, UrlStatus.ARTICLE_PROBLEMATIC, checkpoint)
         self._new_problematic_urls_fh, self._problematic_article_urls_add = \
             add_and_write_factory(self.problematic_article_urls, settings.get('new_problematic_urls'))
 
@@ -305,9 +595,35 @@ class NewsArticleCrawler:
         self._converter = settings['CORPUS_CONVERTER']
         self._converter.logger = self._logger
 
+        # Continue the interrupted crawl from the checkpoint (if it is resumed) and save it periodically
+        self._checkpoint = checkpoint
+        self._pending_urls = []  # The URLs to process before the ones from the archive
+        resume_state = None
+        if checkpoint is not None:
+            resume_state = checkpoint.state.get('articles')
+        articles_download_params = download_params
+        if resume_state is not None:
+            self._logger.log('INFO', 'Resuming article crawling from checkpoint', checkpoint.filename)
+            self._pending_urls = resume_state['pending_urls']
+            # The URLs are restored already by the URL store or the checkpoint (only written to the output files again)
+            for url in self._new_urls:
+                self._new_urls_add(url)
+            for url in self.problematic_article_urls:
+                self._problematic_article_urls_add(url)
+            if resume_state['downloader'] is not None:
+                articles_download_params = dict(download_params or {}, resume_state=resume_state['downloader'])
+            self._resume_converter(resume_state.get('converter'))
+        if url_store is not None:
+            articles_download_params = dict(articles_download_params or {},
+                                            good_urls=url_store.view(UrlStatus.ARTICLE_DOWNLOADED),
+                                            bad_urls=url_store.view(UrlStatus.BAD))
+        elif checkpoint is not None:
+            articles_download_params = dict(articles_download_params or {},
+                                            good_urls=new_url_set(None, UrlStatus.ARTICLE_DOWNLOADED, checkpoint))
+
         # Create new archive while downloading, or simulate download and read the archive
         self._downloader = WarcCachingDownloader(articles_existing_warc_filenames, articles_new_warc_filename,
-                                                 self._logger, articles_just_cache, download_params)
+                                                 self._logger, articles_just_cache, articles_download_params)
 
         if known_article_urls is None:  # If None is supplied copy the ones from the article archive
             known_article_urls = self._downloader.url_index  # All URLs in the archive are known good!
@@ -319,7 +635,10 @@ class NewsArticleCrawler:
             # For downloading the articles from a (possibly read-only) archive
             self._archive_downloader = NewsArchiveCrawler(settings, archive_existing_warc_filenames,
                                                           archive_new_warc_filename, archive_just_cache,
-                                                          known_article_urls, debug_params, download_params)
+                                                          known_article_urls, debug_params, download_params,
+                                                          checkpoint, archive_workers, archive_prefetch,
+                                                          probe_archive_end, pagination_stats, adaptive_pagination,
+                                                          url_store)
 
     def __del__(self):
         if hasattr(self, '_archive_downloader'):  # Make sure that the previous files are closed...
@@ -344,15 +663,67 @@ class NewsArticleCrawler:
         return url in self._downloader.good_urls or url in self._archive_downloader.good_urls
 
     def download_and_extract_all_articles(self):
-        self.process_urls(self._archive_downloader.url_iterator())
+        self.process_urls(chain(self._pending_urls, self._archive_downloader.url_iterator()))
+        self._save_checkpoint((), force=True)  # The finished crawl is not continued on resume
+
+    def _save_checkpoint(self, pending_urls, force=False):
+        """
+            Save the checkpoint if it is due: the URLs taken from the archive but not yet processed
+             (including the followed links) are stored to be processed first on resume
+        """
+        if self._checkpoint is not None and (force or self._checkpoint.due):
+            converter_checkpoint_state = getattr(self._converter, 'checkpoint_state', None)
+            state = {'articles': {'pending_urls': list(pending_urls),
+                                  'downloader': self._downloader.checkpoint_state(),
+                                  'converter': converter_checkpoint_state() if converter_checkpoint_state else None},
+                     'archive': self._archive_downloader.checkpoint_state()}
+            if self._url_store is not None:
+                state['url_store'] = self._url_store.checkpoint_state()
+            self._checkpoint.save(state)
+
+    def _resume_converter(self, converter_state):
+        """
+            Continue the output of the corpus converter from the checkpoint if it supports it
+             (checkpoint_state() and resume_from_checkpoint(state) methods, see DummyConverter)
+        """
+        resume_from_checkpoint = getattr(self._converter, 'resume_from_checkpoint', None)
+        if resume_from_checkpoint is not None:
+            resume_from_checkpoint(converter_state)
+        else:
+            self._logger.log('WARNING', 'The corpus converter ({0}) does not support checkpoints: the articles'
+                                        ' processed after the checkpoint will be converted AGAIN, remove the'
+                                        ' duplicates from its output!'.format(type(self._converter).__name__))
+
+    def _prefetch_articles(self, batch):
+        """
+            Download the new URLs of the batch concurrently (the records are written in the order of the URLs)
+             and return the results by URL for step (2) of process_urls()
+        """
+        if self._downloader.concurrency <= 1:
+            return {}
+        new_urls = [url for url in dict.fromkeys(batch)
+                    if not self._is_processed_good_url(url) and not self._is_problematic_url(url)]
+        return dict(zip(new_urls, self._downloader.download_urls(new_urls)))
 
     def process_urls(self, it):
         urls = set()
-        for url in it:
-            urls.add(url)
-            while len(urls) > 0:
-                # This loop runs only one iteration if no URLs are extracted in step (6) else it consumes them first
-                url = urls.pop()
+        for batch in batched(it, self._downloader.concurrency * 4):
+            self._save_checkpoint(batch)  # The batch is already taken from the archive
+            prefetched_articles = self._prefetch_articles(batch)
+            for i, url in enumerate(batch):
+                urls.add(url)
+                self._process_url_and_followed_links(urls, prefetched_articles, batch[i + 1:])
+
+    def _process_url_and_followed_links(self, urls, prefetched_articles, rest_of_batch=()):
+        while len(urls) > 0:
+            # The prefetched articles are already written to the WARC file, but they are not processed yet
+            if len(prefetched_articles) == 0:
+                self._save_checkpoint(chain(urls, rest_of_batch))
+            # This loop runs only one iteration if no URLs are extracted in step (6) else it consumes them first
+            url = urls.pop()
+            if url in prefetched_articles:  # Already checked and downloaded in this batch
+                article_raw_html = prefetched_articles.pop(url)
+            else:
                 # 1) Check if the URL is
                 # 1a) Explicitly marked as bad URL (either Article or Archive) -> Skip it, only INFO log!
                 if url in self._downloader.bad_urls or url in self._archive_downloader.bad_urls:
@@ -369,34 +740,34 @@ class NewsArticleCrawler:
 
                 # 2) "Download" article
                 article_raw_html = self._downloader.download_url(url)
-                if article_raw_html is None:  # Download failed, must be investigated!
-                    self._logger.log('ERROR', url, 'Article was not processed because download failed!', sep='\t')
-                    self._problematic_article_urls_add(url)  # New problematic URL for manual checking
+            if article_raw_html is None:  # Download failed, must be investigated!
+                self._logger.log('ERROR', url, 'Article was not processed because download failed!', sep='\t')
+                self._problematic_article_urls_add(url)  # New problematic URL for manual checking
+                continue
+            self._new_urls_add(url)  # New article URLs
+
+            # 3) Identify the site scheme of the article to be able to look up the appropriate extracting method
+            scheme = self._converter.identify_site_scheme(url, article_raw_html)
+
+            # 4) Filter: time filtering when archive page URLs are not generated by date if needed
+            if self._filter_by_date:
+                # a) Retrieve the date
+                article_date = self._converter.extract_article_date(url, article_raw_html, scheme)
+                if article_date is None:
+                    self._logger.log('ERROR', url, 'DATE COULD NOT BE PARSED!', sep='\t')
+                    continue
+                # b) Check date interval
+                elif not self._date_from <= article_date <= self._date_until:
+                    self._logger.log('WARNING', url, 'Date ({0}) is not in the specified interval: {1}-{2}'
+                                                     ' didn\'t use it in the corpus'.
+                                     format(article_date, self._date_from, self._date_until), sep='\t')
                     continue
-                self._new_urls_add(url)  # New article URLs
-
-                # 3) Identify the site scheme of the article to be able to look up the appropriate extracting method
-                scheme = self._converter.identify_site_scheme(url, article_raw_html)
-
-                # 4) Filter: time filtering when archive page URLs are not generated by date if needed
-                if self._filter_by_date:
-                    # a) Retrieve the date
-                    article_date = self._converter.extract_article_date(url, article_raw_html, scheme)
-                    if article_date is None:
-                        self._logger.log('ERROR', url, 'DATE COULD NOT BE PARSED!', sep='\t')
-                        continue
-                    # b) Check date interval
-                    elif not self._date_from <= article_date <= self._date_until:
-                        self._logger.log('WARNING', url, 'Date ({0}) is not in the specified interval: {1}-{2}'
-                                                         ' didn\'t use it in the corpus'.
-                                         format(article_date, self._date_from, self._date_until), sep='\t')
-                        continue
 
-                # 5) Extract text to corpus
-                self._converter.article_to_corpus(url, article_raw_html, scheme)
+            # 5) Extract text to corpus
+            self._converter.article_to_corpus(url, article_raw_html, scheme)
 
-                # 6) Extract links to other articles and check for already extracted urls (also in the archive)?
-                urls_to_follow = self._converter.follow_links_on_page(url, article_raw_html, scheme)
-                # Only add those which has not been already handled to avoid loops!
-                urls |= {url for url in urls_to_follow
-                         if not self._is_processed_good_url(url) and not self._is_problematic_url(url)}
+            # 6) Extract links to other articles and check for already extracted urls (also in the archive)?
+            urls_to_follow = self._converter.follow_links_on_page(url, article_raw_html, scheme)
+            # Only add those which has not been already handled to avoid loops!
+            urls |= {url for url in urls_to_follow
+                     if not self._is_processed_good_url(url) and not self._is_problematic_url(url)}
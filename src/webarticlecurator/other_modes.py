@@ -4,17 +4,28 @@
 from itertools import groupby
 from collections import defaultdict
 
+from .cdxj_index import write_cdxj_index
 from .enhanced_downloader import WarcCachingDownloader
-from .utils import create_or_check_clean_dir, write_content_to_url_named_file
+from .utils import create_or_check_clean_dir, write_content_to_url_named_file, batched, expand_warc_filenames
 
 
-def validate_warc_file(source_warcfiles, validator_logger):
+def validate_warc_file(source_warcfiles, validator_logger, compact_index=False, index_jobs=1):
     reader = WarcCachingDownloader(source_warcfiles, None, validator_logger, True,
-                                   download_params={'stay_offline': True, 'strict_mode': True, 'check_digest': True})
+                                   download_params={'stay_offline': True, 'strict_mode': True, 'check_digest': True,
+                                                    'compact_index': compact_index, 'index_jobs': index_jobs})
     validator_logger.log('INFO', 'OK!', len(reader.url_index), 'records read!')
     return reader.url_index
 
 
+def index_warc_files(source_warcfiles, index_logger):
+    """ Write sorted CDXJ index next to the supplied warc files (filename.cdxj) to be used instead of the warc files """
+    for warc_filename in expand_warc_filenames(source_warcfiles):
+        cdxj_filename = '{0}.cdxj'.format(warc_filename)
+        index_logger.log('INFO', 'Creating CDXJ index for', warc_filename, '...')
+        no_of_lines = write_cdxj_index(warc_filename, cdxj_filename)
+        index_logger.log('INFO', 'OK!', no_of_lines, 'records written to', cdxj_filename)
+
+
 def online_test(url='https://index.hu/belfold/2018/08/27/fidesz_media_helyreigazitas/', filename='example.warc.gz',
                 test_logger=None):
     w = WarcCachingDownloader(None, filename, test_logger)
@@ -24,15 +35,19 @@ def online_test(url='https://index.hu/belfold/2018/08/27/fidesz_media_helyreigaz
 
 def sample_warc_by_urls(source_warcfiles, new_urls, sampler_logger, target_warcfile=None, out_dir=None, offline=True,
                         just_cache=False, negative=False, extract_article_urls_from_page_plus_fun=None, max_tries=3,
-                        allow_cookies=False, max_no_of_calls_in_period=2, limit_period=1):
-    """ Create new warc file for the supplied list of URLs from an existing warc file """
+                        allow_cookies=False, max_no_of_calls_in_period=2, limit_period=1, bulk=False,
+                        download_workers=1, rate_limit_state=None, index_jobs=1):
+    """ Create new warc file for the supplied list of URLs from an existing warc file
+         (in bulk mode the URLs are processed in the order of their offsets in the source WARCs instead of sorted)
+         (with more download workers the first tries of the URLs are downloaded concurrently in batches)
+         (with index_jobs > 1 or 0 for all CPUs the source WARCs without an index file are indexed in parallel) """
     is_out_dir_mode = out_dir is not None
     if is_out_dir_mode:
         create_or_check_clean_dir(out_dir)
 
     if extract_article_urls_from_page_plus_fun is not None:
         def test_raw_html(cont, ulrs_already_seen):
-            article_urls_w_meta = set(extract_article_urls_from_page_plus_fun(cont))
+            article_urls_w_meta = set(extract_article_urls_from_page_plus_fun(cont.text))
             ok = len(ulrs_already_seen & article_urls_w_meta) == 0
             ulrs_already_seen |= article_urls_w_meta
             return ok
@@ -43,36 +58,53 @@ def sample_warc_by_urls(source_warcfiles, new_urls, sampler_logger, target_warcf
     w = WarcCachingDownloader(source_warcfiles, target_warcfile, sampler_logger, just_cache=just_cache,
                               download_params={'stay_offline': offline, 'allow_cookies': allow_cookies,
                                                'max_no_of_calls_in_period': max_no_of_calls_in_period,
-                                               'limit_period': limit_period})
+                                               'limit_period': limit_period, 'download_workers': download_workers,
+                                               'rate_limit_state': rate_limit_state,
+                                               'index_jobs': index_jobs})
 
     new_urls = {url.strip() for url in new_urls}
     if negative:
-        new_urls = w.url_index - new_urls
+        new_urls = {url for url in w.url_index if url not in new_urls}
+
+    if bulk:
+        new_urls = w.iter_urls_by_offset(new_urls)
+    else:
+        new_urls = sorted(new_urls)
 
     already_seen_urls = set()
-    for url in sorted(new_urls):
-        sampler_logger.log('INFO', 'Adding url', url)
-        if not offline or url in w.url_index:
-            url_ok = False
-            tries_left = max_tries
-            while not url_ok and tries_left > 0:
-                resp = w.download_url(url, ignore_cache=tries_left < max_tries, return_warc_records_wo_writing=True)
-                tries_left -= 1
-                if resp is not None:
-                    rec, raw_html = resp
-                    url_ok = test_raw_html(raw_html, already_seen_urls)
-                    if url_ok:
-                        w.write_records_for_url(url, rec)
-                        if is_out_dir_mode and raw_html is not None:
-                            fname = write_content_to_url_named_file(url, raw_html, out_dir)
-                            sampler_logger.log('INFO', 'Creating file', fname)
-                    elif tries_left == 0:
-                        sampler_logger.log('ERROR', url, f'There are no tries left for URL!', sep='\t')
-                        w.write_records_for_url(url, rec)  # Keep the URL anyway
-                    else:
-                        sampler_logger.log('WARNING', url, f'Retrying URL ({max_tries - tries_left})!', sep='\t')
+    for batch in batched(new_urls, w.concurrency * 4):
+        if not offline and w.concurrency > 1:
+            # The first tries of the batch are downloaded concurrently (the records are written below in order)
+            first_tries = dict(zip(batch, w.download_urls(batch, return_warc_records_wo_writing=True, lazy=True)))
         else:
-            sampler_logger.log('ERROR', 'URL not present in archive and can not be downloaded (offline True)', url)
+            first_tries = {}
+        for url in batch:
+            sampler_logger.log('INFO', 'Adding url', url)
+            if not offline or url in w.url_index:
+                url_ok = False
+                tries_left = max_tries
+                while not url_ok and tries_left > 0:
+                    if url in first_tries:
+                        resp = first_tries.pop(url)
+                    else:
+                        resp = w.download_url(url, ignore_cache=tries_left < max_tries,
+                                              return_warc_records_wo_writing=True, lazy=True)
+                    tries_left -= 1
+                    if resp is not None:
+                        rec, lazy_resp = resp  # Decoded only if the text is needed below
+                        url_ok = test_raw_html(lazy_resp, already_seen_urls)
+                        if url_ok:
+                            w.write_records_for_url(url, rec)
+                            if is_out_dir_mode:
+                                fname = write_content_to_url_named_file(url, lazy_resp.text, out_dir)
+                                sampler_logger.log('INFO', 'Creating file', fname)
+                        elif tries_left == 0:
+                            sampler_logger.log('ERROR', url, f'There are no tries left for URL!', sep='\t')
+                            w.write_records_for_url(url, rec)  # Keep the URL anyway
+                        else:
+                            sampler_logger.log('WARNING', url, f'Retrying URL ({max_tries - tries_left})!', sep='\t')
+            else:
+                sampler_logger.log('ERROR', 'URL not present in archive and can not be downloaded (offline True)', url)
 
 
 def archive_page_contains_article_url(extract_article_urls_from_page_plus_fun, source_warcfiles, checked_urls,
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Statistics of the pagination of the archive pages per column kept between the crawls (crawl --pagination-stats FILE)
+
+import sqlite3
+from time import time
+from collections import namedtuple
+
+# The prediction of the pagination of an archive page URL from the previous crawls (see PaginationStats.predict())
+PaginationPrediction = namedtuple('PaginationPrediction', ['pages', 'known_rest'])
+
+
+class PaginationStats:
+    """
+        Record the pagination chains of the archive page URLs (the number of article URLs, the new article URLs
+         which are not in known_article_urls and the tries of each page) in an SQLite database
+         to predict the pagination of the same archive page URLs (or the column if they are new, e.g. days)
+         in the later crawls of the portal
+    """
+    def __init__(self, filename, history=10, min_chains=2):
+        self.filename = filename
+        self._history = history  # The number of the latest chains used for the predictions
+        self._min_chains = min_chains  # The number of chains ending with known articles to predict known_rest
+        self._predictions = {}
+        self._db = sqlite3.connect(filename, timeout=60)
+        self._db.execute('CREATE TABLE IF NOT EXISTS chains (id INTEGER PRIMARY KEY, site TEXT NOT NULL,'
+                         ' column_name TEXT NOT NULL, archive_page_url TEXT NOT NULL, crawled_at REAL NOT NULL,'
+                         ' pages INTEGER NOT NULL, article_urls INTEGER NOT NULL, new_article_urls INTEGER NOT NULL,'
+                         ' retries INTEGER NOT NULL, failed INTEGER NOT NULL, first_known_page INTEGER,'
+                         ' last_new_page INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS chains_by_url ON chains (site, column_name, archive_page_url)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS pages (chain_id INTEGER NOT NULL REFERENCES chains (id),'
+                         ' page INTEGER NOT NULL, article_urls INTEGER, new_article_urls INTEGER,'
+                         ' tries INTEGER NOT NULL, PRIMARY KEY (chain_id, page))')
+        self._db.commit()
+
+    def __del__(self):
+        if hasattr(self, '_db'):
+            self._db.close()
+
+    def add_chain(self, site, column_name, archive_page_url, page_stats):
+        """
+            Store the finished pagination chain: page_stats is the list of [article_urls, new_article_urls, tries]
+             of its pages in order (the URL counts are None for the failed page at the end of the chain)
+        """
+        pages = [page for page in page_stats if page[0] is not None]
+        first_known_page, last_new_page = None, None
+        for page_num, (article_urls, new_article_urls, _) in enumerate(page_stats, start=1):
+            if article_urls is None:
+                continue
+            if new_article_urls > 0:
+                last_new_page = page_num
+            elif article_urls > 0 and first_known_page is None:
+                first_known_page = page_num
+        with self._db:
+            chain_id = self._db.execute('INSERT INTO chains (site, column_name, archive_page_url, crawled_at, pages,'
+                                        ' article_urls, new_article_urls, retries, failed, first_known_page,'
+                                        ' last_new_page) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        (site, column_name, archive_page_url, time(), len(pages),
+                                         sum(page[0] for page in pages), sum(page[1] for page in pages),
+                                         sum(page[2] - 1 for page in page_stats), len(pages) < len(page_stats),
+                                         first_known_page, last_new_page)).lastrowid
+            self._db.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?)',
+                                 ((chain_id, page_num, *page) for page_num, page in enumerate(page_stats, start=1)))
+        self._predictions.pop((site, column_name, archive_page_url), None)
+
+    def predict(self, site, column_name, archive_page_url):
+        """
+            Predict from the latest chains of the archive page URL (or of the column if it has not been crawled yet):
+             pages: the number of pages (the maximum) or None if there are no chains to predict from
+             known_rest: the pages after a page with only known articles have held only known articles
+              in all of these chains (at least min_chains of them had such a page)
+        """
+        key = (site, column_name, archive_page_url)
+        prediction = self._predictions.get(key)
+        if prediction is None:
+            rows = self._db.execute('SELECT pages, first_known_page, last_new_page FROM chains'
+                                    ' WHERE site = ? AND column_name = ? AND archive_page_url = ? AND NOT failed'
+                                    ' ORDER BY id DESC LIMIT ?', (*key, self._history)).fetchall()
+            if len(rows) == 0:
+                rows = self._db.execute('SELECT pages, first_known_page, last_new_page FROM chains'
+                                        ' WHERE site = ? AND column_name = ? AND NOT failed ORDER BY id DESC LIMIT ?',
+                                        (site, column_name, self._history)).fetchall()
+            pages = max((row[0] for row in rows), default=None)
+            known_rest = sum(row[1] is not None for row in rows) >= self._min_chains and \
+                all(row[1] is None or row[2] is None or row[2] < row[1] for row in rows)
+            prediction = PaginationPrediction(pages, known_rest)
+            self._predictions[key] = prediction
+        return prediction
+
+    def summary(self, site=None, column_name=None, by_archive_page_url=False):
+        """
+            Aggregate the chains per column (or per archive page URL) for the stats command
+             with the prediction of the next crawl
+        """
+        group_by = ['site', 'column_name']
+        if by_archive_page_url:
+            group_by.append('archive_page_url')
+        group_by = ', '.join(group_by)
+        where, params = [], []
+        for field, value in (('site', site), ('column_name', column_name)):
+            if value is not None:
+                where.append('{0} = ?'.format(field))
+                params.append(value)
+        where = 'WHERE {0}'.format(' AND '.join(where)) if len(where) > 0 else ''
+        query = ('SELECT {0}, COUNT(*), SUM(failed), AVG(pages), MAX(pages),'
+                 ' CAST(SUM(article_urls) AS REAL) / MAX(SUM(pages), 1),'
+                 ' CAST(SUM(new_article_urls) AS REAL) / MAX(SUM(pages), 1), SUM(retries), MAX(page_retries)'
+                 ' FROM chains LEFT JOIN (SELECT chain_id, MAX(tries) - 1 AS page_retries FROM pages GROUP BY chain_id)'
+                 ' ON chain_id = id {1} GROUP BY {0} ORDER BY {0}').format(group_by, where)
+        for row in self._db.execute(query, params).fetchall():
+            if by_archive_page_url:
+                prediction = self.predict(*row[:3])
+            else:  # The same as for a new archive page URL of the column
+                prediction = self.predict(row[0], row[1], None)
+            yield row + tuple(prediction)
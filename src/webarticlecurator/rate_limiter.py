@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Token-bucket rate limiter keyed by host for the downloaders
+
+import sqlite3
+from threading import Lock
+from time import monotonic, sleep, time
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds from the value of a Retry-After header (delay-seconds or HTTP-date) or None"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0.0, retry_date.timestamp() - time())
+
+
+def parse_crawl_delay(robots_txt, user_agent=None):
+    """
+        Return the Crawl-delay for the user agent (or for *) from the content of robots.txt or None
+        (urllib.robotparser accepts only whole seconds)
+    """
+    user_agent = (user_agent or '*').split('/')[0].lower()
+    delays = {}
+    agents, in_rules = [], False
+    for line in robots_txt.splitlines():
+        key, sep, value = line.split('#', maxsplit=1)[0].partition(':')
+        if len(sep) == 0:
+            continue
+        key, value = key.strip().lower(), value.strip()
+        if key == 'user-agent':
+            if in_rules:  # A new group starts
+                agents, in_rules = [], False
+            agents.append(value.lower())
+        else:
+            in_rules = True
+            if key == 'crawl-delay':
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for agent in agents:
+                    delays.setdefault(agent, delay)
+
+    for agent, delay in delays.items():
+        if agent != '*' and agent in user_agent:
+            return delay
+    return delays.get('*')
+
+
+class TokenBucket:
+    """
+        Allow rate calls per second on average and at most capacity calls at once (burst)
+        The tokens are stored as of timestamp, which is in the future when the host is paused
+        The tokens can go negative: the callers reserve the tokens in order and sleep outside of the lock
+    """
+    __slots__ = ('rate', 'capacity', 'tokens', 'timestamp')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = now
+
+    def reserve(self, now):
+        """Take a token and return the seconds to wait before using it"""
+        if now > self.timestamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+        self.tokens -= 1
+        return max(0.0, self.timestamp - now + max(0.0, -self.tokens) / self.rate)
+
+    def pause(self, now, seconds):
+        self.timestamp = max(self.timestamp, now + seconds)
+        self.tokens = min(self.tokens, 1)  # The first request after the pause can go immediately
+
+    def limit(self, rate, capacity):
+        self.rate = min(self.rate, rate)
+        self.capacity = min(self.capacity, capacity)
+        self.tokens = min(self.tokens, self.capacity)
+
+
+class HostRateLimiter:
+    """
+        Token-bucket rate limiter keyed by host (thread-safe): each host is allowed max_calls requests per period
+         seconds on average (fractional rates are allowed) and at most burst requests at once (default: max_calls)
+        Only the requests to the same host wait for each other
+    """
+    def __init__(self, max_calls, period, burst=None):
+        if max_calls <= 0 or period <= 0:
+            raise ValueError('The number of calls and the period must be positive: {0}/{1}'.format(max_calls, period))
+        self._rate = max_calls / period
+        if burst is None:
+            burst = max(1, max_calls)
+        self._burst = burst
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _get_bucket(self, host, now):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self._rate, self._burst, now)
+            self._buckets[host] = bucket
+        return bucket
+
+    def _update_bucket(self, host, update):
+        """Call update(bucket, now) on the bucket of the host atomically and return its result"""
+        with self._lock:
+            now = monotonic()
+            return update(self._get_bucket(host, now), now)
+
+    def reserve(self, host):
+        """Take a token for the host and return the seconds to wait before sending the request (e.g. for asyncio)"""
+        return self._update_bucket(host, TokenBucket.reserve)
+
+    def wait(self, host):
+        """Block until a request can be sent to the host"""
+        delay = self.reserve(host)
+        if delay > 0:
+            sleep(delay)
+
+    def pause(self, host, seconds):
+        """Do not send requests to the host for the given seconds (e.g. Retry-After)"""
+        self._update_bucket(host, lambda bucket, now: bucket.pause(now, seconds))
+
+    def set_crawl_delay(self, host, seconds):
+        """Send at most one request per the given seconds to the host (e.g. Crawl-delay in robots.txt)"""
+        if seconds > 0:
+            self._update_bucket(host, lambda bucket, _: bucket.limit(1 / seconds, 1))
+
+
+class SharedHostRateLimiter(HostRateLimiter):
+    """
+        HostRateLimiter which keeps its state in an SQLite database (on a local filesystem), so the processes
+         of the machine (e.g. one crawl per portal configuration) share one budget per host and can use it fully
+        All processes should be started with the same limits, the Crawl-delay found by any of them is used by all
+    """
+    def __init__(self, state_filename, max_calls, period, burst=None):
+        super().__init__(max_calls, period, burst)
+        self._db = sqlite3.connect(state_filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')  # The readers do not block the writer
+        self._db.execute('CREATE TABLE IF NOT EXISTS buckets (host TEXT PRIMARY KEY, tokens REAL NOT NULL,'
+                         ' timestamp REAL NOT NULL, max_rate REAL)')
+
+    def __del__(self):
+        if hasattr(self, '_db'):
+            self._db.close()
+
+    def _update_bucket(self, host, update):
+        with self._lock:  # The connection is shared by the threads of the process
+            self._db.execute('BEGIN IMMEDIATE')  # Lock the database for the other processes
+            try:
+                now = time()  # Wall clock time is comparable between the processes
+                bucket = TokenBucket(self._rate, self._burst, now)
+                max_rate = None
+                row = self._db.execute('SELECT tokens, timestamp, max_rate FROM buckets WHERE host = ?',
+                                       (host,)).fetchone()
+                if row is not None:
+                    tokens, bucket.timestamp, max_rate = row
+                    bucket.tokens = min(tokens, self._burst)
+                    if max_rate is not None:
+                        bucket.limit(max_rate, 1)
+                ret = update(bucket, now)
+                if bucket.rate < self._rate:  # Limited by Crawl-delay
+                    max_rate = bucket.rate
+                self._db.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                                 (host, bucket.tokens, bucket.timestamp, max_rate))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return ret
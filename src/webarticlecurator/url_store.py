@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+# Disk-backed state of the URLs of the crawl with an in-memory Bloom filter (crawl --url-store FILE)
+
+import sqlite3
+from threading import RLock
+from enum import IntEnum
+from collections import Counter
+from hashlib import blake2b
+from math import ceil, log
+
+# Commit the added URLs to the database after this many (the checkpoints commit them anyway)
+COMMIT_INTERVAL = 10000
+# Read the URLs of a status from the database in chunks of this size when iterating over them
+ITER_CHUNK_SIZE = 1000
+
+
+class UrlStatus(IntEnum):
+    """The sets of URLs of the crawlers and the downloaders (an URL can be in more than one of them)"""
+    KNOWN_ARTICLE = 1  # --known-article-urls
+    BAD = 2  # --known-bad-urls
+    ARCHIVE_DOWNLOADED = 3  # Written to the archive WARC file
+    ARCHIVE_GOOD = 4  # Archive page processed
+    ARCHIVE_PROBLEMATIC = 5  # Archive page failed (no tries left)
+    ARTICLE_DOWNLOADED = 6  # Written to the articles WARC file
+    ARTICLE_NEW = 7  # Article processed
+    ARTICLE_PROBLEMATIC = 8  # Article failed
+
+
+# The URLs written to the output WARC files belong to the current crawl only (a new crawl writes new WARC files)
+CURRENT_CRAWL_STATUSES = (UrlStatus.ARCHIVE_DOWNLOADED, UrlStatus.ARTICLE_DOWNLOADED)
+
+
+class BloomFilter:
+    """
+        Set membership with false positives (with about error_rate probability up to capacity elements)
+         in capacity * 1.44 * log2(1 / error_rate) bits (e.g. 9.6 bits per element for 1%)
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self._num_bits = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self._num_hashes = max(1, round(self._num_bits / capacity * log(2)))
+        self._bits = bytearray((self._num_bits + 7) // 8)
+
+    def _bit_positions(self, key):
+        digest = blake2b(key.encode('UTF-8'), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self._num_bits for i in range(self._num_hashes))
+
+    def add(self, key):
+        for pos in self._bit_positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._bit_positions(key))
+
+
+class UrlStateView:
+    """
+        The URLs of one status as a set-like object (add, update, in, len and iteration)
+         to be used in place of the in-memory sets of the crawlers and the downloaders
+    """
+    def __init__(self, store, status):
+        self._store = store
+        self._status = status
+
+    def add(self, url):
+        self._store.add(self._status, url)
+
+    def update(self, urls):
+        for url in urls:
+            self._store.add(self._status, url)
+
+    def __contains__(self, url):
+        return self._store.contains(self._status, url)
+
+    def __len__(self):
+        return self._store.count(self._status)
+
+    def __iter__(self):
+        return self._store.iter_urls(self._status)
+
+
+class UrlStateStore:
+    """
+        The state of the URLs of the crawl (see UrlStatus) in an SQLite database with a Bloom filter in memory,
+         which answers most of the lookups of the URLs not in the database, so the memory usage does not grow
+         with the size of the archive
+        The state remains in the database between the crawls: the URLs of the previous crawls are known
+         to the new crawls unless the database is reset, except the URLs written to the output WARC files
+         (CURRENT_CRAWL_STATUSES), which are cleared by the new crawls as they write new WARC files.
+         A crawl resumed from a checkpoint continues from the state of the checkpoint
+         (the URLs added after it are removed)
+    """
+    def __init__(self, filename, capacity=10000000, error_rate=0.01, resume_state=None, reset=False):
+        self.filename = filename
+        self._lock = RLock()  # The connection is shared by the threads (e.g. the WARC writer of the async engine)
+        self._db = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS urls (status INTEGER NOT NULL, url TEXT NOT NULL,'
+                         ' seq INTEGER NOT NULL, PRIMARY KEY (status, url)) WITHOUT ROWID')
+        self._db.execute('CREATE INDEX IF NOT EXISTS urls_by_seq ON urls (seq)')
+        if reset:  # Forget the previous crawls
+            if resume_state is not None:
+                raise ValueError('Can not reset the URL store when resuming from a checkpoint: {0}'.format(filename))
+            self._seq = 0
+            self._db.execute('DELETE FROM urls')
+        elif resume_state is None:  # A new crawl continues the sequence of the previous ones with new WARC files
+            self._seq = self._db.execute('SELECT COALESCE(MAX(seq), 0) FROM urls').fetchone()[0]
+            self._db.executemany('DELETE FROM urls WHERE status = ?', ((status,) for status in CURRENT_CRAWL_STATUSES))
+        else:  # Continue the interrupted crawl (see checkpoint_state())
+            self._seq = resume_state['seq']
+            self._db.execute('DELETE FROM urls WHERE seq > ?', (self._seq,))
+        self._db.commit()
+        self._uncommitted = 0
+
+        self._bloom_filter = BloomFilter(capacity, error_rate)
+        self._counts = Counter()  # The number of URLs by status
+        for status, url in self._db.execute('SELECT status, url FROM urls'):
+            self._bloom_filter.add(self._key(status, url))
+            self._counts[status] += 1
+
+    def __del__(self):
+        if hasattr(self, '_db'):
+            self._db.commit()
+            self._db.close()
+
+    @staticmethod
+    def _key(status, url):
+        return '{0:d} {1}'.format(status, url)
+
+    def view(self, status):
+        return UrlStateView(self, status)
+
+    def add(self, status, url):
+        key = self._key(status, url)
+        with self._lock:
+            if key in self._bloom_filter and self.contains(status, url):
+                return
+            self._seq += 1
+            self._db.execute('INSERT INTO urls VALUES (?, ?, ?)', (status, url, self._seq))
+            self._bloom_filter.add(key)
+            self._counts[status] += 1
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_INTERVAL:
+                self.commit()
+
+    def contains(self, status, url):
+        if self._key(status, url) not in self._bloom_filter:  # Surely not in the database
+            return False
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM urls WHERE status = ? AND url = ?', (status, url)).fetchone() \
+                is not None
+
+    def count(self, status):
+        return self._counts[status]
+
+    def iter_urls(self, status):
+        """The URLs of the status in alphabetical order (read in chunks, the URLs can be added meanwhile)"""
+        last_url = ''
+        while True:
+            with self._lock:
+                urls = [url for url, in self._db.execute('SELECT url FROM urls WHERE status = ? AND url > ?'
+                                                         ' ORDER BY url LIMIT ?',
+                                                         (status, last_url, ITER_CHUNK_SIZE))]
+            yield from urls
+            if len(urls) < ITER_CHUNK_SIZE:
+                break
+            last_url = urls[-1]
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def checkpoint_state(self):
+        """Commit the URLs and return the state needed to resume (see CrawlCheckpoint)"""
+        self.commit()
+        return {'seq': self._seq}
@@ -2,9 +2,12 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 import os
+import re
 import sys
 import importlib.util
+from glob import glob, escape as glob_escape
 from argparse import Namespace
+from itertools import islice
 from datetime import datetime, date, timedelta
 from os.path import join as os_path_join, exists as os_path_exists, dirname as os_path_dirname, \
     split as os_path_split, abspath, splitext
@@ -196,6 +199,49 @@ def write_content_to_url_named_file(url, cont, out_dir):
     return fname
 
 
+def batched(iterable, n):
+    """Generate lists of n elements from the iterable (the last one may be shorter)"""
+    it = iter(iterable)
+    batch = list(islice(it, n))
+    while len(batch) > 0:
+        yield batch
+        batch = list(islice(it, n))
+
+
+# name.warc.gz, name-00000.warc.gz, ... (see WarcDownloader._numbered_filename())
+WARC_SEGMENT_RE = re.compile(r'^(.*?)(?:-(\d+))?(\.warc(?:\.gz)?)$')
+
+
+def warc_segment_sort_key(filename):
+    """Sort the WARC files by name, the numbered segments of the same name by number after the unnumbered file"""
+    m = WARC_SEGMENT_RE.match(filename)
+    if m is None:
+        return filename, '', -1
+    base, num, ext = m.groups()
+    return base, ext, int(num) if num is not None else -1
+
+
+def expand_warc_filenames(filenames):
+    """
+        Replace the directories (their .warc.gz and .warc files) and the glob patterns in the list of WARC files
+         with the matching files in sorted order (e.g. the numbered segments of a rotated WARC file in their order)
+    """
+    expanded = []
+    for filename in filenames:
+        if os.path.isdir(filename):
+            matches = sorted((fname for fname in glob(os_path_join(glob_escape(filename), '*'))
+                              if fname.endswith(('.warc.gz', '.warc'))), key=warc_segment_sort_key)
+        elif any(c in filename for c in '*?['):  # Glob pattern
+            matches = sorted(glob(filename), key=warc_segment_sort_key)
+        else:
+            expanded.append(filename)
+            continue
+        if len(matches) == 0:
+            raise FileNotFoundError('No WARC files found for: {0}'.format(filename))
+        expanded.extend(matches)
+    return expanded
+
+
 def create_or_check_clean_dir(out_dir):
     os.makedirs(out_dir, exist_ok=True)
     if len(os.listdir(out_dir)) != 0:
@@ -237,6 +283,16 @@ class DummyConverter:  # No output corpus
         _ = url, article_raw_html, scheme  # Silence dummy IDE
         return set()
 
+    @staticmethod
+    def checkpoint_state():
+        """ returns the position of the output for the checkpoint of the crawl (JSON serialisable, optional) """
+        return None
+
+    @staticmethod
+    def resume_from_checkpoint(state):
+        """ continues the output from the position of the checkpoint (see checkpoint_state(), optional) """
+        _ = state  # Silence dummy IDE
+
     def __del__(self):
         pass
 
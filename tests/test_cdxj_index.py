@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from io import BytesIO
+
+from warcio.warcwriter import WARCWriter
+from warcio.statusandheaders import StatusAndHeaders
+
+from webarticlecurator.cdxj_index import CDXJIndex, surt_key, write_cdxj_index
+
+# The URLs with whitespace and control characters are surrounded by the URLs which are sorted next to them
+#  (warcio replaces the spaces of the URLs read from the WARC files with %20, the other characters are kept)
+URLS = ['http://example.com/a', 'http://example.com/a%20b', 'http://example.com/a\rb', 'http://example.com/a\x0bb',
+        'http://example.com/a\x1cb', 'http://example.com/a\x01b', 'http://example.com/a\xa0b',
+        'http://example.com/a\u3000b', 'http://example.com/a\u2028b', 'http://example.com/a?q=x\xa0y&p=1',
+        'http://example.com/a?q=x&p=1', 'http://example.com/ab', 'http://example.com/b']
+
+
+def write_warc(filename, urls):
+    with open(filename, 'wb') as fh:
+        writer = WARCWriter(fh, gzip=True)
+        for url in urls:
+            reqv_headers = StatusAndHeaders('GET / HTTP/1.1', [('Host', 'example.com')], protocol='HTTP/1.1',
+                                            is_http_request=True)
+            writer.write_record(writer.create_warc_record(url, 'request', http_headers=reqv_headers))
+            payload = '<html>{0}</html>'.format(url).encode('UTF-8')
+            resp_headers = StatusAndHeaders('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                                                       ('Content-Length', str(len(payload)))], protocol='HTTP/1.1')
+            writer.write_record(writer.create_warc_record(url, 'response', payload=BytesIO(payload),
+                                                          http_headers=resp_headers))
+
+
+def test_surt_key_escapes_whitespace():
+    assert surt_key('https://www.index.hu/belfold/?b=2&a=1') == 'hu,index)/belfold/?a=1&b=2'
+    assert surt_key('http://example.com/a b') == 'com,example)/a%20b'
+    assert surt_key('http://example.com/a?q=x y&p=1') == 'com,example)/a?p=1&q=x%20y'
+    for url in URLS + ['http://example.com/a b', 'http://example.com/a\tb', 'http://example.com/a\nb']:
+        key = surt_key(url)
+        assert not any(c <= ' ' or c.isspace() for c in key), key
+
+
+def test_lookup_of_urls_with_whitespace(tmp_path):
+    warc_filename = str(tmp_path / 'whitespace.warc.gz')
+    cdxj_filename = '{0}.cdxj'.format(warc_filename)
+    write_warc(warc_filename, URLS)
+    assert write_cdxj_index(warc_filename, cdxj_filename) == len(URLS)
+
+    index = CDXJIndex(cdxj_filename)
+    assert len(index) == len(URLS)
+    assert sorted(index) == sorted(URLS)
+    offsets = set()
+    for url in URLS:
+        assert url in index
+        data = index.get_line_data(url)
+        assert data['url'] == url
+        offsets.add(data['offset'])
+    assert len(offsets) == len(URLS)
+    assert 'http://example.com/a b' not in index  # Only its %20 form is stored (see URLS)
+    assert 'http://example.com/a\x0cb' not in index
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import re
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from warcio.archiveiterator import ArchiveIterator
+
+from webarticlecurator.news_crawler import NewsArticleCrawler
+from webarticlecurator.url_store import UrlStateStore, UrlStatus
+
+# The articles on the archive pages of the portal (the second crawl finds a new one on the first page)
+ARCHIVE_PAGES = {1: ['/a1.html', '/a2.html'], 2: ['/a3.html']}
+NEW_ARTICLE = '/a0.html'
+
+
+class PortalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    new_article = False
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        page = re.fullmatch(r'/arch/(\d+)\.html', self.path)
+        if self.path == '/robots.txt':
+            status, body = 404, ''
+        elif page is not None:
+            articles = list(ARCHIVE_PAGES.get(int(page.group(1)), []))
+            if page.group(1) == '1' and PortalHandler.new_article:
+                articles.insert(0, NEW_ARTICLE)
+            status, body = 200, ''.join('<a href="{0}">{0}</a>'.format(url) for url in articles)
+        else:
+            status, body = 200, 'Article {0}'.format(self.path)
+        body = '<html><body>{0}</body></html>'.format(body).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DummyConverter:
+    logger = None
+
+    def identify_site_scheme(self, url, article_raw_html):
+        return 'scheme'
+
+    def article_to_corpus(self, url, article_raw_html, scheme):
+        pass
+
+    def follow_links_on_page(self, url, article_raw_html, scheme):
+        return set()
+
+
+@pytest.fixture
+def portal():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PortalHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    PortalHandler.new_article = False
+    yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def crawl(base_url, tmp_path, name, url_store, old_articles_warc=None, old_archive_warc=None):
+    settings = {'log_file_archive': str(tmp_path / '{0}_archive.log'.format(name)),
+                'log_file_articles': str(tmp_path / '{0}_articles.log'.format(name)),
+                'columns': {'column': {'archive_url_format': base_url + '/arch/#pagenum.html', 'min_pagenum': 2,
+                                       'INITIAL_PAGENUM': '1', 'max_pagenum': None}},
+                'archive_page_urls_by_date': False, 'ignore_archive_cache': True, 'infinite_scrolling': True,
+                'EXTRACT_ARTICLE_URLS_FROM_PAGE_FUN':
+                    lambda html: {base_url + url for url in re.findall(r'href="([^"]+)"', html)},
+                'EXTRACT_NEXT_PAGE_URL_FUN': None, 'next_url_by_pagenum': True, 'new_article_url_threshold': None,
+                'stop_on_empty_archive_page': True, 'stop_on_taboo_set': False, 'TABOO_ARTICLE_URLS': set(),
+                'FILTER_ARTICLES_BY_DATE': False, 'CORPUS_CONVERTER': DummyConverter()}
+    articles_warc, archive_warc = (str(tmp_path / '{0}_{1}.warc.gz'.format(name, kind)) for kind in ('articles',
+                                                                                                        'archive'))
+    crawler = NewsArticleCrawler(settings, old_articles_warc, articles_warc, old_archive_warc, archive_warc,
+                                 download_params={'max_no_of_calls_in_period': 1000}, url_store=url_store)
+    crawler.download_and_extract_all_articles()
+    del crawler
+    return articles_warc, archive_warc
+
+
+def warc_urls(filename):
+    with open(filename, 'rb') as stream:
+        return {record.rec_headers.get_header('WARC-Target-URI') for record in ArchiveIterator(stream)
+                if record.rec_type in {'response', 'revisit'}}
+
+
+def test_two_crawls_into_different_warcs(portal, tmp_path):
+    url_store_filename = str(tmp_path / 'urls.sqlite')
+    archive_urls = {portal + '/arch/{0}.html'.format(page) for page in (1, 2, 3)}
+    article_urls = {portal + url for urls in ARCHIVE_PAGES.values() for url in urls}
+
+    url_store = UrlStateStore(url_store_filename)
+    first_articles_warc, first_archive_warc = crawl(portal, tmp_path, 'first', url_store)
+    url_store.commit()
+    assert warc_urls(first_archive_warc) == archive_urls
+    assert warc_urls(first_articles_warc) == article_urls
+
+    # The second crawl reuses the first WARC files as cache and writes every page to its own WARC files again
+    PortalHandler.new_article = True
+    url_store = UrlStateStore(url_store_filename)
+    assert len(url_store.view(UrlStatus.ARTICLE_DOWNLOADED)) == 0
+    assert len(url_store.view(UrlStatus.ARCHIVE_DOWNLOADED)) == 0
+    assert set(url_store.view(UrlStatus.ARTICLE_NEW)) == article_urls  # The results of the previous crawls remain
+    second_articles_warc, second_archive_warc = crawl(portal, tmp_path, 'second', url_store, first_articles_warc,
+                                                      first_archive_warc)
+    assert warc_urls(second_archive_warc) == archive_urls
+    assert warc_urls(second_articles_warc) == article_urls | {portal + NEW_ARTICLE}
+
+
+def test_resume_keeps_the_downloaded_urls(tmp_path):
+    url_store_filename = str(tmp_path / 'urls.sqlite')
+    url_store = UrlStateStore(url_store_filename)
+    url_store.add(UrlStatus.ARTICLE_DOWNLOADED, 'http://example.com/a1.html')
+    resume_state = url_store.checkpoint_state()
+    url_store.add(UrlStatus.ARTICLE_DOWNLOADED, 'http://example.com/a2.html')
+    del url_store
+
+    url_store = UrlStateStore(url_store_filename, resume_state=resume_state)
+    assert set(url_store.view(UrlStatus.ARTICLE_DOWNLOADED)) == {'http://example.com/a1.html'}